@@ -0,0 +1,216 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+asyncio facade over the backend (Python 3.5+).
+
+    from django_pyodbc.aio import AsyncConnection
+
+    async with AsyncConnection('default') as conn:
+        cursor = await conn.aexecute("SELECT name FROM app_item WHERE id = %s", [1])
+        row = await cursor.afetchone()
+
+        async for row in conn.astream("SELECT id, name FROM app_item"):
+            ...
+
+        items = await conn.run(lambda: list(Item.objects.filter(active=True)))
+
+Every call is dispatched to a worker of django_pyodbc.pool. An AsyncConnection
+keeps the same worker, and so the same database connection, until it's closed,
+which makes multi-statement transactions safe to await.
+"""
+import asyncio
+import collections
+from concurrent import futures
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from django_pyodbc.pool import get_pool
+
+
+def _open_cursor(alias):
+    return connections[alias].cursor()
+
+
+class AsyncCursor(object):
+    """
+    Wraps a django_pyodbc CursorWrapper that lives on a worker thread.
+    """
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    def _run(self, fn, *args):
+        return self.connection._run(fn, *args)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    async def aexecute(self, sql, params=()):
+        await self._run(self.cursor.execute, sql, params)
+        return self
+
+    async def aexecutemany(self, sql, params_list):
+        await self._run(self.cursor.executemany, sql, params_list)
+        return self
+
+    async def afetchone(self):
+        return await self._run(self.cursor.fetchone)
+
+    async def afetchmany(self, size=None):
+        return await self._run(self.cursor.fetchmany, size or self.cursor.arraysize)
+
+    async def afetchall(self):
+        return await self._run(self.cursor.fetchall)
+
+    def astream(self, sql=None, params=(), chunk_size=None):
+        """
+        Returns an async iterator over the rows of the current result set, or
+        of `sql` if given. Rows are fetched from the server `chunk_size` at a
+        time.
+        """
+        return RowStream(self, sql, params, chunk_size)
+
+    async def aclose(self):
+        await self._run(self.cursor.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+class RowStream(object):
+    def __init__(self, cursor, sql=None, params=(), chunk_size=None):
+        self.cursor = cursor
+        self.sql = sql
+        self.params = params
+        self.chunk_size = chunk_size or 100
+        self._rows = collections.deque()
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.sql is not None:
+            sql, self.sql = self.sql, None
+            await self.cursor.aexecute(sql, self.params)
+        if not self._rows and not self._exhausted:
+            rows = await self.cursor.afetchmany(self.chunk_size)
+            self._exhausted = len(rows) < self.chunk_size
+            self._rows.extend(rows)
+        if not self._rows:
+            raise StopAsyncIteration
+        return self._rows.popleft()
+
+
+class AsyncConnection(object):
+    """
+    An awaitable handle on one pooled database connection.
+    """
+    def __init__(self, alias=DEFAULT_DB_ALIAS, loop=None):
+        self.alias = alias
+        self.loop = loop
+        self.pool = get_pool(alias)
+        self._worker = None
+
+    async def _acquire(self):
+        if self._worker is None:
+            loop = self.loop or asyncio.get_event_loop()
+            acquired = futures.Future()
+
+            def acquire():
+                if acquired.set_running_or_notify_cancel():
+                    try:
+                        acquired.set_result(self.pool.acquire())
+                    except BaseException as e:
+                        acquired.set_exception(e)
+
+            # Waiting for an idle worker blocks, so don't do it on the loop.
+            loop.run_in_executor(None, acquire)
+            try:
+                self._worker = await asyncio.wrap_future(acquired, loop=loop)
+            except asyncio.CancelledError:
+                # The thread may be past the point of no return; hand back the
+                # worker it gets.
+                acquired.add_done_callback(self._release_abandoned)
+                raise
+        return self._worker
+
+    def _release_abandoned(self, acquired):
+        if not acquired.cancelled() and acquired.exception() is None:
+            self.pool.release(acquired.result())
+
+    async def _run(self, fn, *args, **kwargs):
+        worker = await self._acquire()
+        return await asyncio.wrap_future(worker.submit(fn, *args, **kwargs), loop=self.loop)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Calls fn on this connection's worker thread. Use it for ORM code:
+        anything fn does through connections[alias] uses this connection.
+        """
+        return await self._run(fn, *args, **kwargs)
+
+    async def acursor(self):
+        cursor = await self._run(_open_cursor, self.alias)
+        return AsyncCursor(self, cursor)
+
+    async def aexecute(self, sql, params=()):
+        cursor = await self.acursor()
+        return await cursor.aexecute(sql, params)
+
+    def astream(self, sql, params=(), chunk_size=None):
+        return _ConnectionRowStream(self, sql, params, chunk_size)
+
+    async def aclose(self):
+        """
+        Hands the worker, and its connection, back to the pool.
+        """
+        if self._worker is not None:
+            worker, self._worker = self._worker, None
+            self.pool.release(worker)
+
+    async def __aenter__(self):
+        await self._acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+class _ConnectionRowStream(RowStream):
+    """
+    RowStream that opens its own cursor on first iteration and closes it once
+    the result set is exhausted.
+    """
+    def __init__(self, connection, sql, params, chunk_size):
+        super(_ConnectionRowStream, self).__init__(None, sql, params, chunk_size)
+        self.connection = connection
+
+    async def __anext__(self):
+        if self.cursor is None:
+            self.cursor = await self.connection.acursor()
+        try:
+            return await super(_ConnectionRowStream, self).__anext__()
+        except StopAsyncIteration:
+            await self.cursor.aclose()
+            raise
@@ -44,22 +44,28 @@
 MS SQL Server database backend for Django.
 """
 import datetime
+import decimal
 import os
 import re
 import sys
 import warnings
+from contextlib import contextmanager
 
 from django import VERSION as DjangoVersion
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db import utils
+from django.db import transaction, utils
 from django.db.backends.signals import connection_created
+from django.utils.functional import cached_property
 
 from django_pyodbc.client import DatabaseClient
 from django_pyodbc.compat import binary_type, text_type, timezone
 from django_pyodbc.creation import DatabaseCreation
+from django_pyodbc import fulltext  # noqa: F401, registers the full-text lookups
+from django_pyodbc.batch import WriteBatch
 from django_pyodbc.introspection import DatabaseIntrospection
-from django_pyodbc.operations import DatabaseOperations
+from django_pyodbc.operations import DatabaseOperations, DateTimeParam, VarCharParam
+from django_pyodbc.schema import DatabaseSchemaEditor
 
 try:
     import pyodbc as Database
@@ -108,14 +114,20 @@ class DatabaseFeatures(BaseDatabaseFeatures):
     allow_sliced_subqueries = False
     supports_paramstyle_pyformat = False
 
-    has_bulk_insert = False
     # DateTimeField doesn't support timezones, only DateTimeOffsetField
     supports_timezones = False
     supports_sequence_reset = False
     supports_tablespaces = True
     ignores_nulls_in_unique_constraints = False
     can_introspect_autofield = True
+    can_clone_databases = True
+    # DDL can't be parameterized, so column defaults are inlined as literals.
+    requires_literal_defaults = True
 
+    @cached_property
+    def has_bulk_insert(self):
+        # Multi-row VALUES lists are new in SQL Server 2008.
+        return not self.connection.ops.is_openedge and self.connection.ops.sql_server_ver >= 2008
 
     def _supports_transactions(self):
         # keep it compatible with Django 1.3 and 1.4
@@ -174,6 +186,7 @@ class DatabaseWrapper(BaseDatabaseWrapper):
     creation_class = DatabaseCreation
     introspection_class = DatabaseIntrospection
     validation_class = BaseDatabaseValidation
+    SchemaEditorClass = DatabaseSchemaEditor
 
 
     def __init__(self, *args, **kwargs):
@@ -201,6 +214,17 @@ class DatabaseWrapper(BaseDatabaseWrapper):
                         ops[op] = '%s COLLATE %s' % (sql, self.collation)
                 self.operators.update(ops)
 
+        # Bind string and decimal parameters with normalized sizes, so that
+        # a query reuses one cached plan whatever the values' lengths.
+        # pyodbc honours setinputsizes() from 4.0.24 on.
+        self.normalize_params = ((options or {}).get('normalize_params', True)
+                                 and pyodbc_ver >= (4, 0, 24))
+        # Bind lookup parameters with the type of the column they're compared
+        # with (varchar, datetime), or only warn about the mismatch.
+        self.match_column_types = ((options or {}).get('match_column_types', False)
+                                   and pyodbc_ver >= (4, 0, 24))
+        self.warn_column_type_mismatch = (options or {}).get('warn_column_type_mismatch', False)
+
         self.test_create = self.settings_dict.get('TEST_CREATE', True)
 
         self.features = DatabaseFeatures(self)
@@ -210,6 +234,13 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         self.introspection = DatabaseIntrospection(self)
         self.validation = BaseDatabaseValidation(self)
         self.connection = None
+        # Stack of the constraints switched off by disable_constraint_checking().
+        self._disabled_constraints = []
+        # Table IDENTITY_INSERT is switched on for, if any. The insert
+        # compiler doesn't toggle it around statements for that table.
+        self._identity_insert_table = None
+        # Writes queued by batch_writes(), if it's active.
+        self._write_batch = None
 
 
     def get_connection_params(self):
@@ -236,6 +267,8 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         return conn_params
 
     def get_new_connection(self, conn_params):
+        # Session settings don't survive the connection.
+        self._identity_insert_table = None
         return Database.connect(**conn_params)
 
     def init_connection_state(self):
@@ -364,7 +397,6 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             if self.ops.sql_server_ver < 2005:
                 self.creation.data_types['TextField'] = 'ntext'
                 self.data_types['TextField'] = 'ntext'
-                self.features.can_return_id_from_insert = False
 
             ms_sqlncli = re.compile('^((LIB)?SQLN?CLI|LIBMSODBCSQL)')
             self.drv_name = self.connection.getinfo(Database.SQL_DRIVER_NAME).upper()
@@ -401,26 +433,154 @@ class DatabaseWrapper(BaseDatabaseWrapper):
 
         return CursorWrapper(cursor, self.driver_supports_utf8, self.encoding, self)
 
-    def _execute_foreach(self, sql, table_names=None):
-        cursor = self.cursor()
+    # Validates the enabled constraints that SQL Server no longer trusts,
+    # i.e. those that were switched off at some point, which also makes them
+    # trusted again.
+    sql_check_constraints = (
+        "SET NOCOUNT ON; DECLARE @sql nvarchar(max); SET @sql = N''; "
+        "SELECT @sql = @sql + N'ALTER TABLE ' + QUOTENAME(OBJECT_SCHEMA_NAME(parent_object_id)) + N'.' "
+        "+ QUOTENAME(OBJECT_NAME(parent_object_id)) + N' WITH CHECK CHECK CONSTRAINT ' + QUOTENAME(name) + N'; ' "
+        "FROM (SELECT parent_object_id, name, is_disabled, is_not_trusted FROM sys.foreign_keys "
+        "WHERE is_not_for_replication = 0 "
+        "UNION ALL SELECT parent_object_id, name, is_disabled, is_not_trusted FROM sys.check_constraints "
+        "WHERE is_not_for_replication = 0) c "
+        "WHERE is_disabled = 0 AND is_not_trusted = 1%(table_filter)s; "
+        "EXEC sp_executesql @sql"
+    )
+
+    def _table_filter_sql(self, table_names):
         if not table_names:
-            table_names = self.introspection.get_table_list(cursor)
-        for table_name in table_names:
-            cursor.execute(sql % self.ops.quote_name(table_name))
+            return ''
+        return ' AND parent_object_id IN (%s)' % ', '.join(
+            "OBJECT_ID(N'%s')" % self.ops.quote_name(table_name).replace("'", "''")
+            for table_name in table_names)
 
     def check_constraints(self, table_names=None):
-        self._execute_foreach('ALTER TABLE %s WITH CHECK CHECK CONSTRAINT ALL', table_names)
+        cursor = self.cursor()
+        cursor.execute(self.sql_check_constraints % {'table_filter': self._table_filter_sql(table_names)})
+
+    @contextmanager
+    def constraint_checks_disabled(self, table_names=None):
+        disabled = self.disable_constraint_checking(table_names)
+        try:
+            yield
+        finally:
+            if disabled:
+                self.enable_constraint_checking()
 
-    def disable_constraint_checking(self):
-        # Windows Azure SQL Database doesn't support sp_msforeachtable
-        #cursor.execute('EXEC sp_msforeachtable "ALTER TABLE ? NOCHECK CONSTRAINT ALL"')
-        self._execute_foreach('ALTER TABLE %s NOCHECK CONSTRAINT ALL')
+    def disable_constraint_checking(self, table_names=None):
+        """
+        Switches off the enabled foreign key and check constraints of the
+        given tables (all tables by default) in one batch, and remembers them
+        for enable_constraint_checking().
+        """
+        cursor = self.cursor()
+        table_filter = self._table_filter_sql(table_names)
+        cursor.execute(
+            "SELECT OBJECT_NAME(parent_object_id), name FROM sys.foreign_keys "
+            "WHERE is_disabled = 0%(table_filter)s "
+            "UNION ALL SELECT OBJECT_NAME(parent_object_id), name FROM sys.check_constraints "
+            "WHERE is_disabled = 0%(table_filter)s" % {'table_filter': table_filter})
+        disabled = {}
+        for table_name, name in cursor.fetchall():
+            disabled.setdefault(table_name, []).append(name)
+        self._toggle_constraints('NOCHECK', disabled)
+        self._disabled_constraints.append(disabled)
         return True
 
     def enable_constraint_checking(self):
-        # Windows Azure SQL Database doesn't support sp_msforeachtable
-        #cursor.execute('EXEC sp_msforeachtable "ALTER TABLE ? WITH CHECK CHECK CONSTRAINT ALL"')
-        self.check_constraints()
+        """
+        Switches back on the constraints of the matching
+        disable_constraint_checking() call. They aren't validated here; that's
+        what check_constraints() is for.
+        """
+        if self._disabled_constraints:
+            self._toggle_constraints('CHECK', self._disabled_constraints.pop())
+
+    @contextmanager
+    def batch_writes(self):
+        """
+        Queues the INSERT, UPDATE and DELETE statements of the ORM and sends
+        them as one batch at the end of the block, or before any other
+        statement. The block is atomic. See django_pyodbc.batch.
+        """
+        if self._write_batch is not None:
+            yield
+            return
+        with transaction.atomic(using=self.alias):
+            self._write_batch = WriteBatch(self)
+            try:
+                yield
+                self._flush_writes()
+            finally:
+                self._write_batch = None
+
+    def _flush_writes(self):
+        if self._write_batch:
+            self._write_batch.flush()
+
+    def _internal_cursor(self):
+        """
+        Returns a cursor for the backend's own lookups (catalog views, server
+        properties, sequence ranges). They don't depend on the queued writes,
+        so it doesn't send the write batch before its statements.
+        """
+        cursor = self.cursor()
+        cursor.flushes_writes = False
+        return cursor
+
+    def _commit(self):
+        self._flush_writes()
+        return super(DatabaseWrapper, self)._commit()
+
+    def _rollback(self):
+        if self._write_batch is not None:
+            self._write_batch.discard()
+        return super(DatabaseWrapper, self)._rollback()
+
+    @contextmanager
+    def identity_insert(self, model):
+        """
+        Keeps IDENTITY_INSERT on for the table of the given model (or table
+        name) during the block, so that inserts with explicit primary keys
+        aren't each wrapped in SET IDENTITY_INSERT statements:
+
+            with connection.identity_insert(Order):
+                Order.objects.bulk_create(orders)
+        """
+        table_name = model._meta.db_table if hasattr(model, '_meta') else model
+        previous = self._identity_insert_table
+        self._set_identity_insert(table_name)
+        try:
+            yield
+        finally:
+            self._set_identity_insert(previous)
+
+    def _set_identity_insert(self, table_name):
+        """
+        Switches IDENTITY_INSERT on for the given table, and off for the table
+        it was on for. SQL Server allows it for only one table per session.
+        """
+        if table_name == self._identity_insert_table:
+            return
+        qn = self.ops.quote_name
+        sql = []
+        if self._identity_insert_table is not None:
+            sql.append('SET IDENTITY_INSERT %s OFF;' % qn(self._identity_insert_table))
+        if table_name is not None:
+            sql.append('SET IDENTITY_INSERT %s ON;' % qn(table_name))
+        cursor = self.cursor()
+        cursor.execute('\n'.join(sql))
+        self._identity_insert_table = table_name
+
+    def _toggle_constraints(self, action, constraints):
+        if not constraints:
+            return
+        qn = self.ops.quote_name
+        cursor = self.cursor()
+        cursor.execute('\n'.join(
+            'ALTER TABLE %s %s CONSTRAINT %s;' % (qn(table_name), action, ', '.join(qn(name) for name in names))
+            for table_name, names in sorted(constraints.items())))
 
 
 class CursorWrapper(object):
@@ -428,6 +588,9 @@ class CursorWrapper(object):
     A wrapper around the pyodbc's cursor that takes in account a) some pyodbc
     DB-API 2.0 implementation and b) some common ODBC driver particularities.
     """
+    # Whether the queued writes of the connection are sent before a statement.
+    flushes_writes = True
+
     def __init__(self, cursor, driver_supports_utf8, encoding="", db_wrpr=None):
         self.cursor = cursor
         self.driver_supports_utf8 = driver_supports_utf8
@@ -435,6 +598,7 @@ class CursorWrapper(object):
         self.last_params = ()
         self.encoding = encoding
         self.db_wrpr = db_wrpr
+        self._input_sizes_set = False
 
     def close(self):
         try:
@@ -474,6 +638,33 @@ class CursorWrapper(object):
                 fp.append(p)
         return tuple(fp)
 
+    def input_sizes(self, params):
+        """
+        Returns the setinputsizes() entries for params, or None when they're
+        all left to the driver. Strings are sent as nvarchar(4000), or
+        nvarchar(max) beyond that, and decimals with the largest precision.
+        Parameters typed after their column are bound as that type.
+        """
+        normalize = self.db_wrpr.normalize_params
+        sizes = []
+        for p in params:
+            if isinstance(p, VarCharParam):
+                sizes.append((Database.SQL_VARCHAR, 8000 if len(p) <= 8000 else 0, 0))
+            elif isinstance(p, DateTimeParam):
+                sizes.append((Database.SQL_TYPE_TIMESTAMP, 23, 3))
+            elif not normalize:
+                sizes.append(None)
+            elif isinstance(p, text_type):
+                sizes.append((Database.SQL_WVARCHAR, 4000 if len(p) <= 4000 else 0, 0))
+            elif isinstance(p, decimal.Decimal) and p.is_finite() and len(p.as_tuple().digits) <= 38:
+                scale = min(max(-p.as_tuple().exponent, 0), 38)
+                sizes.append((Database.SQL_DECIMAL, 38, scale))
+            else:
+                sizes.append(None)
+        if not any(sizes):
+            return None
+        return sizes
+
     def execute(self, sql, params=()):
         self.last_sql = sql
         #django-debug toolbar error
@@ -482,6 +673,13 @@ class CursorWrapper(object):
         sql = self.format_sql(sql, len(params))
         params = self.format_params(params)
         self.last_params = params
+        if self.db_wrpr is not None and self.flushes_writes:
+            self.db_wrpr._flush_writes()
+        if self.db_wrpr is not None and (self.db_wrpr.normalize_params or self.db_wrpr.match_column_types):
+            sizes = self.input_sizes(params)
+            if sizes is not None or self._input_sizes_set:
+                self.cursor.setinputsizes(sizes)
+                self._input_sizes_set = sizes is not None
         try:
             return self.cursor.execute(sql, params)
         except IntegrityError:
@@ -492,6 +690,8 @@ class CursorWrapper(object):
             raise utils.DatabaseError(*e.args)
 
     def executemany(self, sql, params_list):
+        if self.db_wrpr is not None and self.flushes_writes:
+            self.db_wrpr._flush_writes()
         sql = self.format_sql(sql)
         # pyodbc's cursor.executemany() doesn't support an empty param_list
         if not params_list:
@@ -500,6 +700,10 @@ class CursorWrapper(object):
         else:
             raw_pll = params_list
             params_list = [self.format_params(p) for p in raw_pll]
+        if self._input_sizes_set:
+            # The sizes of the last execute() don't fit these rows.
+            self.cursor.setinputsizes(None)
+            self._input_sizes_set = False
 
         try:
             return self.cursor.executemany(sql, params_list)
@@ -0,0 +1,91 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Write batching.
+
+Inside connection.batch_writes() the INSERT, UPDATE and DELETE statements of
+the ORM are queued instead of executed, and sent to the server as one batch
+when the block ends, or before anything else runs on the connection. The
+block runs in a transaction:
+
+    with connection.batch_writes():
+        for item in items:
+            item.save()
+
+The primary keys of inserted objects are set when the batch is sent. An
+UPDATE of a single object by primary key that matched no row raises
+DatabaseError then, since save() can't fall back to an INSERT any more.
+"""
+from django.db import DatabaseError
+
+
+class WriteBatch(object):
+    # SQL Server takes at most 2100 parameters per request.
+    max_params = 2100
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def add(self, sql, params, callback=None):
+        """
+        Queues a statement. callback, if given, is called with the first row of
+        the result set the statement produces.
+        """
+        self.statements.append((sql, tuple(params), callback))
+
+    def discard(self):
+        self.statements = []
+
+    def flush(self):
+        statements, self.statements = self.statements, []
+        chunk, n_params = [], 0
+        for statement in statements:
+            if chunk and n_params + len(statement[1]) > self.max_params:
+                self._execute(chunk)
+                chunk, n_params = [], 0
+            chunk.append(statement)
+            n_params += len(statement[1])
+        if chunk:
+            self._execute(chunk)
+
+    def _execute(self, statements):
+        # NOCOUNT keeps the row counts of the statements out of the results,
+        # leaving only the result sets the callbacks read.
+        sql = ';\n'.join(['SET NOCOUNT ON'] + [s[0] for s in statements] + ['SET NOCOUNT OFF'])
+        params = [p for s in statements for p in s[1]]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = []
+            while True:
+                if cursor.description is not None:
+                    rows.append(cursor.fetchone())
+                if not cursor.nextset():
+                    break
+        callbacks = [s[2] for s in statements if s[2] is not None]
+        if len(rows) < len(callbacks):
+            raise DatabaseError('The batch returned %d result sets, %d were expected.' % (len(rows), len(callbacks)))
+        for callback, row in zip(callbacks, rows):
+            callback(row)
+
+
+def check_updated(sql):
+    def callback(row):
+        if not row or not row[0]:
+            raise DatabaseError('A batched update matched no rows: %s' % sql)
+    return callback
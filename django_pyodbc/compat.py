@@ -92,6 +92,11 @@ except:
     def upath(path):
         return path.decode(fs_encoding)
 
+try:
+    input = raw_input
+except NameError:
+    input = input
+
 # new modules from Python3
 try:
     if _py3:
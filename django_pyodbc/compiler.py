@@ -46,9 +46,27 @@ from datetime import date, datetime
 
 import django
 from django import VERSION as DjangoVersion
+from django.core.exceptions import EmptyResultSet
+from django.db.models.expressions import Col, Subquery
+from django.db.models.lookups import (
+    Contains, EndsWith, Exact, IContains, IEndsWith, IExact, IStartsWith,
+    Lookup, StartsWith,
+)
 from django.db.models.sql import compiler, where
+from django.db.models.sql.constants import MULTI
+
+from django_pyodbc.batch import check_updated
+from django_pyodbc.fields import SequenceAutoField
+from django_pyodbc.functions import date_range_sql, merge_date_parts
+from django_pyodbc.prepared import SLOT_LOOKUPS, P
+
 
-from django_pyodbc.compat import zip_longest
+_CASE_SENSITIVE_LOOKUPS = {
+    IExact: Exact,
+    IContains: Contains,
+    IStartsWith: StartsWith,
+    IEndsWith: EndsWith,
+}
 
 REV_ODIR = {
     'ASC': 'DESC',
@@ -81,18 +99,6 @@ USE_TOP_HMARK = 1 # For SQL Server 2000 when both limit and offset are provided
 USE_TOP_LMARK = 2 # For SQL Server 2000 when offset but no limit is provided
 
 
-# Pattern to scan a column data type string and split the data type from any
-# constraints or other included parts of a column definition. Based upon
-# <column_definition> from http://msdn.microsoft.com/en-us/library/ms174979.aspx
-_re_data_type_terminator = re.compile(
-    r'\s*\b(?:' +
-    r'filestream|collate|sparse|not|null|constraint|default|identity|rowguidcol' +
-    r'|primary|unique|clustered|nonclustered|with|on|foreign|references|check' +
-    ')',
-    re.IGNORECASE,
-)
-
-
 _re_order_limit_offset = re.compile(
     r'(?:ORDER BY\s+(.+?))?\s*(?:LIMIT\s+(\d+))?\s*(?:OFFSET\s+(\d+))?$')
 
@@ -146,27 +152,82 @@ class SQLCompiler(compiler.SQLCompiler):
                 if type(val.rhs) == date or type(val.lhs) == date:
                     setattr(val, 'as_microsoft', types.MethodType(where_date, val))
 
+        if isinstance(node, Lookup):
+            if isinstance(node.rhs, P):
+                self._prepare_slot(node)
+            node = self._case_sensitive_lookup(node)
+            result = date_range_sql(self, self.connection, node)
+            if result is not None:
+                return result
+        elif isinstance(node, where.WhereNode):
+            node = merge_date_parts(node) or node
+        elif isinstance(node, Subquery) and not node.queryset.query.subquery:
+            # Subquery() compiles its query as if it stood alone, which would
+            # order a sliced one by the row number.
+            node = node.copy()
+            node.queryset.query.subquery = True
+
         args = [node]
         if select_format:
             args.append(select_format)
-        return super(SQLCompiler, self).compile(*args)
-
-    def resolve_columns(self, row, fields=()):
-        # If the results are sliced, the resultset will have an initial
-        # "row number" column. Remove this column before the ORM sees it.
-        if getattr(self, '_using_row_number', False):
-            row = row[1:]
-        values = []
-        index_extra_select = len(self.query.extra_select)
-        for value, field in zip_longest(row[index_extra_select:], fields):
-            # print '\tfield=%s\tvalue=%s' % (repr(field), repr(value))
-            if field:
-                try:
-                    value = self.connection.ops.convert_values(value, field)
-                except ValueError:
-                    pass
-            values.append(value)
-        return row[:index_extra_select] + tuple(values)
+        sql, params = super(SQLCompiler, self).compile(*args)
+        if isinstance(node, Lookup) and not isinstance(node.rhs, P) and (
+                self.connection.match_column_types or self.connection.warn_column_type_mismatch):
+            params = self._match_column_types(node, params)
+        return sql, params
+
+    def _case_sensitive_lookup(self, lookup):
+        """
+        Returns the case-sensitive counterpart of a case-insensitive lookup on
+        a column whose collation already ignores case, so that the column
+        isn't wrapped in UPPER() and its indexes can be seeked. Other lookups
+        are returned as they are.
+        """
+        counterpart = _CASE_SENSITIVE_LOOKUPS.get(type(lookup))
+        if counterpart is None or not isinstance(lookup.lhs, Col):
+            return lookup
+        ops = self.connection.ops
+        if ops.is_db2 or ops.is_openedge:
+            return lookup
+        configured = getattr(self.connection, 'collation', None)
+        if lookup.lookup_name != 'iexact' and configured:
+            # The LIKE operators are given the configured collation.
+            collation = configured
+        else:
+            target = lookup.lhs.target
+            collation = self.connection.introspection.get_column_collation(target.model._meta.db_table, target.column)
+        if not ops.is_case_insensitive(collation):
+            return lookup
+        return counterpart(lookup.lhs, lookup.rhs)
+
+    def _match_column_types(self, lookup, params):
+        """
+        Types the parameters of a lookup against a column like the column is,
+        using its introspected type: pyodbc binds str as nvarchar and datetime
+        as datetime2, which makes SQL Server convert varchar and datetime
+        columns for the comparison and scan instead of seek.
+        """
+        if not isinstance(lookup.lhs, Col) or not params or hasattr(lookup.rhs, 'as_sql'):
+            return params
+        return self.connection.ops.typed_lookup_params(lookup, self._column_type(lookup.lhs), params)
+
+    def _prepare_slot(self, lookup):
+        """
+        Tells the slot of a prepared query which lookup it's the value of and,
+        when values are matched with their columns, the type of the column,
+        so that the value is typed when it's given without going back to the
+        catalog.
+        """
+        slot = lookup.rhs
+        if lookup.lookup_name not in SLOT_LOOKUPS:
+            raise TypeError('%r can only be the value of an exact, gt, gte, lt or lte lookup.' % slot)
+        slot.lookup = lookup
+        if isinstance(lookup.lhs, Col) and (self.connection.match_column_types or
+                                            self.connection.warn_column_type_mismatch):
+            slot.column_type = self._column_type(lookup.lhs)
+
+    def _column_type(self, col):
+        return self.connection.introspection.get_column_type(col.target.model._meta.db_table, col.target.column)
 
     def _fix_aggregates(self):
         """
@@ -213,8 +274,6 @@ class SQLCompiler(compiler.SQLCompiler):
 
         self._fix_aggregates()
 
-        self._using_row_number = False
-
         # Get out of the way if we're not a select query or there's no limiting involved.
         check_limits = with_limits and (self.query.low_mark or self.query.high_mark is not None)
         if not check_limits:
@@ -231,6 +290,10 @@ class SQLCompiler(compiler.SQLCompiler):
 
         raw_sql, fields = super(SQLCompiler, self).as_sql(False, with_col_aliases, **kwargs)
 
+        # The bounds are bound as parameters where the server takes them, so
+        # that every page of a query shares one cached plan.
+        bind_limits = self._can_bind_limits()
+
         # Check for high mark only and replace with "TOP"
         if self.query.high_mark is not None and not self.query.low_mark:
             if self.connection.ops.is_db2:
@@ -239,12 +302,15 @@ class SQLCompiler(compiler.SQLCompiler):
                 _select = 'SELECT'
                 if self.query.distinct:
                     _select += ' DISTINCT'
-                sql = re.sub(r'(?i)^{0}'.format(_select), '{0} TOP {1}'.format(_select, self.query.high_mark), raw_sql, 1)
+                if bind_limits:
+                    top = '{0} TOP (%s)'.format(_select)
+                    fields = (self.query.high_mark,) + tuple(fields)
+                else:
+                    top = '{0} TOP {1}'.format(_select, self.query.high_mark)
+                sql = re.sub(r'(?i)^{0}'.format(_select), top, raw_sql, 1)
             return sql, fields
 
         # Else we have limits; rewrite the query using ROW_NUMBER()
-        self._using_row_number = True
-
         # Lop off ORDER... and the initial "SELECT"
         inner_select = _remove_order_limit_offset(raw_sql)
         outer_fields, inner_select = self._alias_columns(inner_select)
@@ -277,9 +343,16 @@ class SQLCompiler(compiler.SQLCompiler):
 
         # IBM's DB2 cannot have a prefix of `_` for column names
         row_num_col = 'django_pyodbc_row_num' if self.connection.ops.is_db2 else '_row_num'
-        where_row_num = '{0} < {row_num_col}'.format(self.query.low_mark, row_num_col=row_num_col)
-        if self.query.high_mark:
-            where_row_num += ' and {row_num_col} <= {0}'.format(self.query.high_mark, row_num_col=row_num_col)
+        if bind_limits:
+            limits = [self.query.low_mark]
+            where_row_num = '{row_num_col} > %s'.format(row_num_col=row_num_col)
+            if self.query.high_mark:
+                limits.append(self.query.high_mark)
+                where_row_num += ' and {row_num_col} <= %s'.format(row_num_col=row_num_col)
+        else:
+            where_row_num = '{0} < {row_num_col}'.format(self.query.low_mark, row_num_col=row_num_col)
+            if self.query.high_mark:
+                where_row_num += ' and {row_num_col} <= {0}'.format(self.query.high_mark, row_num_col=row_num_col)
 
         # SQL Server 2000 doesn't support the `ROW_NUMBER()` function, thus it
         # is necessary to use the `TOP` construct with `ORDER BY` so we can
@@ -291,7 +364,6 @@ class SQLCompiler(compiler.SQLCompiler):
             opposite_order_direction = REV_ODIR[order_direction]
             sql = r'''
                 SELECT
-                1, -- placeholder for _row_num
                 * FROM
                 (
                     SELECT TOP
@@ -324,17 +396,29 @@ class SQLCompiler(compiler.SQLCompiler):
                     right_sql_quote=self.connection.ops.right_sql_quote,
                 )
         else:
-            sql = "SELECT {outer}, {row_num_col} FROM ( SELECT ROW_NUMBER() OVER ( ORDER BY {order}) as {row_num_col}, {inner}) as QQQ where {where}".format(
+            # The row number is only filtered and ordered on, so the rows come
+            # back with just the selected columns.
+            sql = "SELECT {outer} FROM ( SELECT ROW_NUMBER() OVER ( ORDER BY {order}) as {row_num_col}, {inner}) as QQQ where {where}".format(
                 outer=outer_fields,
                 order=order,
                 inner=inner_select,
                 where=where_row_num,
                 row_num_col=row_num_col
             )
+            if not self.query.subquery:
+                # ORDER BY isn't allowed when this is a subquery.
+                sql += " ORDER BY {row_num_col}".format(row_num_col=row_num_col)
+            if bind_limits:
+                fields = tuple(fields) + tuple(limits)
 
 
         return sql, fields
 
+    def _can_bind_limits(self):
+        # SQL Server 2000 takes only a constant after TOP.
+        ops = self.connection.ops
+        return not (ops.is_db2 or ops.is_openedge) and ops.sql_server_ver >= 2005
+
     def _select_top(self,select,inner_sql,number_to_fetch):
         if self.connection.ops.is_db2:
             return "{select} {inner_sql} FETCH FIRST {number_to_fetch} ROWS ONLY".format(
@@ -485,16 +569,51 @@ class SQLCompiler(compiler.SQLCompiler):
 
 
 class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
-    # search for after table/column list
-    _re_values_sub = re.compile(r'(?P<prefix>\)|\])(?P<default>\s*|\s*default\s*)values(?P<suffix>\s*|\s+\()?', re.IGNORECASE)
-    # ... and insert the OUTPUT clause between it and the values list (or DEFAULT VALUES).
-    _values_repl = r'\g<prefix> OUTPUT INSERTED.{col} INTO @sqlserver_ado_return_id\g<default>VALUES\g<suffix>'
+
+    def pre_save_val(self, field, obj):
+        if isinstance(field, SequenceAutoField) and not self.query.raw and getattr(obj, field.attname) is None:
+            # Drawn here rather than in pre_save(), so that the key comes from
+            # the sequence of the database the INSERT goes to.
+            setattr(obj, field.attname, field.next_value(self.connection))
+        return super(SQLInsertCompiler, self).pre_save_val(field, obj)
+
+    def execute_sql(self, return_id=False):
+        batch = self.connection._write_batch
+        if batch is None:
+            meta = self.query.get_meta()
+            if (len(self.query.objs) > 1 and not self.connection.features.has_bulk_insert and
+                    meta.has_auto_field and meta.auto_field in self.query.fields):
+                # One INSERT per row; switch IDENTITY_INSERT on around all of
+                # them rather than around each.
+                with self.connection.identity_insert(meta.db_table):
+                    return super(SQLInsertCompiler, self).execute_sql(return_id)
+            return super(SQLInsertCompiler, self).execute_sql(return_id)
+        self.return_id = return_id
+        callback = None
+        if return_id:
+            obj, attname = self.query.objs[0], self.query.get_meta().pk.attname
+
+            def callback(row):
+                setattr(obj, attname, row[0])
+        for sql, params in self.as_sql():
+            batch.add(sql, params, callback)
+        # The caller sets the primary key to this, until the batch is sent.
+        return None
 
     def as_sql(self, *args, **kwargs):
         # Fix for Django ticket #14019
         if not hasattr(self, 'return_id'):
             self.return_id = False
 
+        meta = self.query.get_meta()
+        if self.return_id and self.connection.features.can_return_id_from_insert:
+            return [self._returning_insert()]
+
+        if not self.query.fields and len(self.query.objs) > 1:
+            # A VALUES list can't be made of DEFAULTs only.
+            sql = 'INSERT INTO %s DEFAULT VALUES' % self.connection.ops.quote_name(meta.db_table)
+            return [(sql, ()) for obj in self.query.objs]
+
         result = super(SQLInsertCompiler, self).as_sql(*args, **kwargs)
         if isinstance(result, list):
             # Django 1.4 wraps return in list
@@ -503,6 +622,50 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
         sql, params = result
         return self._fix_insert(sql, params)
 
+    def _output_inserted(self, meta):
+        # OUTPUT without INTO is refused on tables with triggers.
+        # http://msdn.microsoft.com/en-us/library/ms177564.aspx
+        return (self.connection.ops.sql_server_ver >= 2005 and
+                not self.connection.introspection.has_triggers(meta.db_table))
+
+    def _returning_insert(self):
+        """
+        Builds the INSERT of a single object that also returns its primary key,
+        from an OUTPUT clause or, where one can't be used, from SCOPE_IDENTITY()
+        in the same batch.
+        """
+        qn = self.connection.ops.quote_name
+        meta = self.query.get_meta()
+        fields = self.query.fields
+        quoted_table = qn(meta.db_table)
+
+        result = ['INSERT INTO %s' % quoted_table]
+        if fields:
+            result.append('(%s)' % ', '.join(qn(f.column) for f in fields))
+        output_inserted = self._output_inserted(meta)
+        if output_inserted:
+            result.append('OUTPUT INSERTED.%s' % qn(meta.pk.column))
+        if fields:
+            obj = self.query.objs[0]
+            value_rows = [[self.prepare_value(field, self.pre_save_val(field, obj)) for field in fields]]
+            placeholder_rows, param_rows = self.assemble_as_sql(fields, value_rows)
+            result.append('VALUES (%s)' % ', '.join(placeholder_rows[0]))
+            params = tuple(param_rows[0])
+        else:
+            result.append('DEFAULT VALUES')
+            params = ()
+        sql = ' '.join(result)
+        if not output_inserted:
+            sql += '; SELECT CAST(SCOPE_IDENTITY() AS bigint)'
+
+        if (meta.has_auto_field and meta.auto_field in fields and
+                self.connection._identity_insert_table != meta.db_table):
+            sql = 'SET IDENTITY_INSERT {table} ON;{sql};SET IDENTITY_INSERT {table} OFF'.format(
+                table=quoted_table,
+                sql=sql,
+            )
+        return sql, params
+
     def _fix_insert(self, sql, params):
         """
         Wrap the passed SQL with IDENTITY_INSERT statements and apply
@@ -530,150 +693,59 @@ class SQLInsertCompiler(compiler.SQLInsertCompiler, SQLCompiler):
                     quoted_table
                 )
                 params = []
-            elif auto_in_fields:
+            elif auto_in_fields and self.connection._identity_insert_table != meta.db_table:
                 # wrap with identity insert
                 sql = 'SET IDENTITY_INSERT {table} ON;{sql};SET IDENTITY_INSERT {table} OFF'.format(
                     table=quoted_table,
                     sql=sql,
                 )
 
-        # mangle SQL to return ID from insert
-        # http://msdn.microsoft.com/en-us/library/ms177564.aspx
-        if self.return_id and self.connection.features.can_return_id_from_insert:
-            col = self.connection.ops.quote_name(meta.pk.db_column or meta.pk.get_attname())
-
-            # Determine datatype for use with the table variable that will return the inserted ID
-            pk_db_type = _re_data_type_terminator.split(meta.pk.db_type(self.connection))[0]
-
-            # NOCOUNT ON to prevent additional trigger/stored proc related resultsets
-            sql = 'SET NOCOUNT ON;{declare_table_var};{sql};{select_return_id}'.format(
-                sql=sql,
-                declare_table_var="DECLARE @sqlserver_ado_return_id table ({col_name} {pk_type})".format(
-                    col_name=col,
-                    pk_type=pk_db_type,
-                ),
-                select_return_id="SELECT * FROM @sqlserver_ado_return_id",
-            )
-
-            output = self._values_repl.format(col=col)
-            sql = self._re_values_sub.sub(output, sql)
-
         return sql, params
 
-class SQLInsertCompiler2(compiler.SQLInsertCompiler, SQLCompiler):
-
-    def as_sql_legacy(self):
-        # We don't need quote_name_unless_alias() here, since these are all
-        # going to be column names (so we can avoid the extra overhead).
-        qn = self.connection.ops.quote_name
-        opts = self.query.model._meta
-        returns_id = bool(self.return_id and
-                          self.connection.features.can_return_id_from_insert)
-
-        result = ['INSERT INTO %s' % qn(opts.db_table)]
-        result.append('(%s)' % ', '.join([qn(c) for c in self.query.columns]))
-
-        if returns_id:
-            result.append('OUTPUT inserted.%s' % qn(opts.pk.column))
-
-        values = [self.placeholder(*v) for v in self.query.values]
-        result.append('VALUES (%s)' % ', '.join(values))
-
-        params = self.query.params
-        sql = ' '.join(result)
-
-        meta = self.query.get_meta()
-        if meta.has_auto_field:
-            # db_column is None if not explicitly specified by model field
-            auto_field_column = meta.auto_field.db_column or meta.auto_field.column
-
-            if auto_field_column in self.query.columns:
-                quoted_table = self.connection.ops.quote_name(meta.db_table)
-
-                if len(self.query.columns) == 1 and not params:
-                    result = ['INSERT INTO %s' % quoted_table]
-                    if returns_id:
-                        result.append('OUTPUT inserted.%s' % qn(opts.pk.column))
-                    result.append('DEFAULT VALUES')
-                    sql = ' '.join(result)
-                else:
-                    sql = "SET IDENTITY_INSERT %s ON;\n%s;\nSET IDENTITY_INSERT %s OFF" % \
-                        (quoted_table, sql, quoted_table)
-
-        return sql, params
-
-    def as_sql(self):
-        if self.connection._DJANGO_VERSION < 14:
-            return self.as_sql_legacy()
-
-        # We don't need quote_name_unless_alias() here, since these are all
-        # going to be column names (so we can avoid the extra overhead).
-        qn = self.connection.ops.quote_name
-        opts = self.query.model._meta
-        result = ['INSERT INTO %s' % qn(opts.db_table)]
-
-        has_fields = bool(self.query.fields)
-        fields = self.query.fields if has_fields else [opts.pk]
-        columns = [f.column for f in fields]
-
-        result.append('(%s)' % ', '.join([qn(c) for c in columns]))
-
-        if has_fields:
-            params = values = [
-                [
-                    f.get_db_prep_save(getattr(obj, f.attname) if self.query.raw else f.pre_save(obj, True), connection=self.connection)
-                    for f in fields
-                ]
-                for obj in self.query.objs
-            ]
-        else:
-            values = [[self.connection.ops.pk_default_value()] for obj in self.query.objs]
-            params = [[]]
-            fields = [None]
-
-        placeholders = [
-            [self.placeholder(field, v) for field, v in zip(fields, val)]
-            for val in values
-        ]
-
-        if self.return_id and self.connection.features.can_return_id_from_insert:
-            params = params[0]
-            output = 'OUTPUT inserted.%s' % qn(opts.pk.column)
-            result.append(output)
-            result.append("VALUES (%s)" % ", ".join(placeholders[0]))
-            return [(" ".join(result), tuple(params))]
-
-        items = [
-            (" ".join(result + ["VALUES (%s)" % ", ".join(p)]), vals)
-            for p, vals in zip(placeholders, params)
-        ]
-
-        # This section deals with specifically setting the primary key,
-        # or using default values if necessary
-        meta = self.query.get_meta()
-        if meta.has_auto_field:
-            # db_column is None if not explicitly specified by model field
-            auto_field_column = meta.auto_field.db_column or meta.auto_field.column
-            out = []
-            for sql, params in items:
-                if auto_field_column in columns:
-                    quoted_table = self.connection.ops.quote_name(meta.db_table)
-                    # If there are no fields specified in the insert..
-                    if not has_fields:
-                        sql = "INSERT INTO %s DEFAULT VALUES" % quoted_table
-                    else:
-                        sql = "SET IDENTITY_INSERT %s ON;\n%s;\nSET IDENTITY_INSERT %s OFF" % \
-                            (quoted_table, sql, quoted_table)
-                out.append([sql, params])
-            items = out
-        return items
-
-
 class SQLDeleteCompiler(compiler.SQLDeleteCompiler, SQLCompiler):
-    pass
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        batch = self.connection._write_batch
+        if batch is None:
+            return super(SQLDeleteCompiler, self).execute_sql(result_type, *args, **kwargs)
+        try:
+            sql, params = self.as_sql()
+        except EmptyResultSet:
+            return None
+        batch.add(sql, params)
+        # The number of deleted rows isn't known yet.
+        return None
 
 class SQLUpdateCompiler(compiler.SQLUpdateCompiler, SQLCompiler):
-    pass
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        batch = self.connection._write_batch
+        if batch is None:
+            return super(SQLUpdateCompiler, self).execute_sql(result_type, *args, **kwargs)
+        try:
+            sql, params = self.as_sql()
+        except EmptyResultSet:
+            sql = None
+        rows = 0
+        if sql:
+            if self._updates_one_object():
+                # Model.save() inserts the object when it matched no row, so
+                # that has to fail loudly once the batch is sent.
+                batch.add(sql + '; SELECT @@ROWCOUNT', params, check_updated(sql))
+            else:
+                batch.add(sql, params)
+            rows = 1
+        for query in self.query.get_related_updates():
+            aux_rows = query.get_compiler(self.using).execute_sql(result_type)
+            rows = rows or aux_rows
+        return rows
+
+    def _updates_one_object(self):
+        children = self.query.where.children
+        if len(children) != 1 or not isinstance(children[0], Exact):
+            return False
+        lhs = children[0].lhs
+        return isinstance(lhs, Col) and lhs.target.primary_key
 
 class SQLAggregateCompiler(compiler.SQLAggregateCompiler, SQLCompiler):
     def as_sql(self, qn=None):
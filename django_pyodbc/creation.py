@@ -41,15 +41,24 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import base64
+import hashlib
 import random
+import sys
+import time
 
-from django_pyodbc.compat import b, md5_constructor
+from django.db.utils import DatabaseError
+
+from django_pyodbc.compat import b, input, md5_constructor
 
 try:
     from django.db.backends.base.creation import BaseDatabaseCreation
 except ImportError:
     # import location prior to Django 1.8
     from django.db.backends.creation import BaseDatabaseCreation
+try:
+    from django.db.backends.base.base import NO_DB_ALIAS
+except ImportError:
+    NO_DB_ALIAS = '__no_db__'
 
 
 
@@ -107,6 +116,164 @@ class DatabaseCreation(BaseDatabaseCreation):
         'TimeField':                    'time',
     })
 
+    sql_drop_all_tables = (
+        "DECLARE @sql nvarchar(max); SET @sql = N''; "
+        "SELECT @sql = @sql + N'ALTER TABLE ' + QUOTENAME(SCHEMA_NAME(t.schema_id)) + N'.' + QUOTENAME(t.name) "
+        "+ N' DROP CONSTRAINT ' + QUOTENAME(fk.name) + N'; ' "
+        "FROM sys.foreign_keys fk JOIN sys.tables t ON t.object_id = fk.parent_object_id "
+        "WHERE %(schema_filter)s; "
+        "SELECT @sql = @sql + N'DROP TABLE ' + QUOTENAME(SCHEMA_NAME(t.schema_id)) + N'.' + QUOTENAME(t.name) + N'; ' "
+        "FROM sys.tables t WHERE t.is_ms_shipped = 0 AND %(schema_filter)s; "
+        "EXEC sp_executesql @sql"
+    )
+
+    sql_last_backup_path = (
+        "SELECT TOP 1 mf.physical_device_name FROM msdb.dbo.backupset bs "
+        "JOIN msdb.dbo.backupmediafamily mf ON mf.media_set_id = bs.media_set_id "
+        "WHERE bs.database_name = %s ORDER BY bs.backup_set_id DESC"
+    )
+
+    # Set by _create_test_db() when the template backup has to be (re)made.
+    _template_digest = None
+    # Backup the clones of the test database are restored from.
+    _clone_backup = None
+    # Seconds between checks of an Azure SQL Database copy.
+    clone_poll_interval = 5
+
+    def _get_master_connection(self):
+        """
+        Returns a new autocommit connection to the master database, for
+        statements that can't run in a transaction or in the database they act
+        on (BACKUP, RESTORE, ...).
+        """
+        settings_dict = self.connection.settings_dict.copy()
+        settings_dict['NAME'] = 'master'
+        settings_dict['OPTIONS'] = dict(settings_dict['OPTIONS'], autocommit=True)
+        return self.connection.__class__(settings_dict, alias=NO_DB_ALIAS)
+
+    def _get_template_backup(self, test_name):
+        """
+        Returns the path, on the database server, of the backup that holds the
+        migrated test database, or None if TEST['TEMPLATE_DIR'] isn't set.
+        """
+        directory = self.connection.settings_dict['TEST'].get('TEMPLATE_DIR')
+        if not directory or self.connection.ops.on_azure_sql_db:
+            return None
+        sep = '\\' if '\\' in directory else '/'
+        return '%s%s%s_template.bak' % (directory.rstrip('/\\'), sep, test_name)
+
+    def _migration_hash(self):
+        """
+        Returns a digest of the migration graph and the source of every
+        migration, plus the models of apps without migrations. It changes
+        whenever migrating from scratch could produce another schema.
+        """
+        from django.apps import apps
+        from django.db.migrations.loader import MigrationLoader
+
+        def update_from_module(digest, module):
+            path = getattr(module, '__file__', None)
+            if path:
+                if path.endswith('.pyc'):
+                    path = path[:-1]
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        digest = hashlib.sha1()
+        for key in sorted(loader.graph.nodes):
+            digest.update(b('%s.%s\n' % key))
+            update_from_module(digest, sys.modules.get(loader.graph.nodes[key].__module__))
+        for app_label in sorted(loader.unmigrated_apps):
+            digest.update(b('%s\n' % app_label))
+            app_config = apps.get_app_config(app_label)
+            update_from_module(digest, app_config.models_module)
+        return digest.hexdigest()
+
+    def _read_backup_description(self, cursor, path):
+        try:
+            cursor.execute("RESTORE HEADERONLY FROM DISK = %s" % self._quote_string(path))
+            rows = cursor.fetchall()
+        except DatabaseError:
+            # No backup there yet.
+            return None
+        names = [column[0] for column in cursor.description]
+        if not rows:
+            return None
+        return rows[-1][names.index('BackupDescription')]
+
+    def _quote_string(self, value):
+        return "N'%s'" % value.replace("'", "''")
+
+    def _consume_messages(self, cursor):
+        # BACKUP and RESTORE report progress as result sets; the statement
+        # only completes once they have all been read.
+        while cursor.nextset():
+            pass
+
+    def _restore_template(self, test_name, digest, verbosity, autoclobber):
+        """
+        Restores the test database from the template backup if the backup was
+        taken from the same migrations. Returns whether it did. Like creating
+        it, replacing an existing test database needs autoclobber or the
+        user's confirmation.
+        """
+        path = self._get_template_backup(test_name)
+        connection = self._get_master_connection()
+        try:
+            with connection.cursor() as cursor:
+                if self._read_backup_description(cursor, path) != digest:
+                    return False
+                qn = self.connection.ops.quote_name
+                cursor.execute("SELECT DB_ID(%s)" % self._quote_string(test_name))
+                if cursor.fetchone()[0] is not None:
+                    if not autoclobber:
+                        sys.stderr.write("The test database '%s' already exists.\n" % test_name)
+                        confirm = input(
+                            "Type 'yes' if you would like to try deleting the test "
+                            "database '%s', or 'no' to cancel: " % test_name)
+                        if confirm != 'yes':
+                            print("Tests cancelled.")
+                            sys.exit(1)
+                    if verbosity >= 1:
+                        print("Destroying old test database for alias %s..." % (
+                            self._get_database_display_str(verbosity, test_name),
+                        ))
+                    cursor.execute("ALTER DATABASE %s SET SINGLE_USER WITH ROLLBACK IMMEDIATE" % qn(test_name))
+                if verbosity >= 1:
+                    print("Restoring test database from template %s..." % path)
+                cursor.execute("RESTORE DATABASE %s FROM DISK = %s WITH REPLACE" % (
+                    qn(test_name), self._quote_string(path)))
+                self._consume_messages(cursor)
+                cursor.execute("ALTER DATABASE %s SET MULTI_USER" % qn(test_name))
+            return True
+        finally:
+            connection.close()
+
+    def _backup_template(self, test_name, digest, verbosity):
+        path = self._get_template_backup(test_name)
+        if verbosity >= 1:
+            print("Saving test database template to %s..." % path)
+        connection = self._get_master_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("BACKUP DATABASE %s TO DISK = %s WITH INIT, COPY_ONLY, DESCRIPTION = %s" % (
+                    self.connection.ops.quote_name(test_name), self._quote_string(path),
+                    self._quote_string(digest)))
+                self._consume_messages(cursor)
+        finally:
+            connection.close()
+
+    def create_test_db(self, verbosity=1, autoclobber=False, serialize=True, keepdb=False):
+        self._template_digest = None
+        self._clone_backup = None
+        test_name = super(DatabaseCreation, self).create_test_db(verbosity, autoclobber, serialize, keepdb)
+        if self._template_digest is not None:
+            # The database was just built by running the migrations; keep it
+            # as the template for the next runs.
+            self._backup_template(test_name, self._template_digest, verbosity)
+        return test_name
+
     def _create_test_db(self, verbosity, autoclobber, keepdb=False):
         settings_dict = self.connection.settings_dict
 
@@ -136,25 +303,130 @@ class DatabaseCreation(BaseDatabaseCreation):
             self.connection.close()
             settings_dict["NAME"] = test_name
             cursor = self.connection.cursor()
-            qn = self.connection.ops.quote_name
-            sql = "SELECT TABLE_NAME, CONSTRAINT_NAME " \
-                  "FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS " \
-                  "WHERE CONSTRAINT_TYPE = 'FOREIGN KEY'"
-            for row in cursor.execute(sql).fetchall():
-                objs = (qn(row[0]), qn(row[1]))
-                cursor.execute("ALTER TABLE %s DROP CONSTRAINT %s" % objs)
-            for table in self.connection.introspection.get_table_list(cursor):
-                if verbosity >= 1:
-                    print("Dropping table %s" % table)
-                cursor.execute('DROP TABLE %s' % qn(table))
+            if self.connection.limit_table_list:
+                schema_filter = "SCHEMA_NAME(t.schema_id) = 'dbo'"
+            else:
+                schema_filter = "1 = 1"
+            # Build every DROP on the server and run them as one batch.
+            cursor.execute(self.sql_drop_all_tables % {'schema_filter': schema_filter})
             self.connection.connection.commit()
             return test_name
 
+        if self._get_template_backup(test_name) and not keepdb:
+            digest = self._migration_hash()
+            if self._restore_template(test_name, digest, verbosity, autoclobber):
+                return test_name
+            self._template_digest = digest
+
         if self.connection.ops.on_azure_sql_db:
             self.connection.close()
             settings_dict["NAME"] = 'master'
         return super(DatabaseCreation, self)._create_test_db(verbosity, autoclobber, keepdb)
 
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        source_name = self.connection.settings_dict['NAME']
+        target_name = self.get_test_db_clone_settings(suffix)['NAME']
+        qn = self.connection.ops.quote_name
+        connection = self._get_master_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT DB_ID(%s)" % self._quote_string(target_name))
+                if cursor.fetchone()[0] is not None:
+                    if keepdb:
+                        return
+                    if verbosity >= 1:
+                        print("Destroying old test database for alias %s..." % (
+                            self._get_database_display_str(verbosity, target_name),
+                        ))
+                    if not self.connection.ops.on_azure_sql_db:
+                        cursor.execute("ALTER DATABASE %s SET SINGLE_USER WITH ROLLBACK IMMEDIATE" % qn(target_name))
+                    cursor.execute("DROP DATABASE %s" % qn(target_name))
+                if self.connection.ops.on_azure_sql_db:
+                    self._copy_database(cursor, source_name, target_name)
+                else:
+                    self._restore_clone(cursor, source_name, target_name)
+        finally:
+            connection.close()
+
+    def _copy_database(self, cursor, source_name, target_name):
+        # Azure SQL Database copies asynchronously; the copy is usable once
+        # it's ONLINE.
+        qn = self.connection.ops.quote_name
+        cursor.execute("CREATE DATABASE %s AS COPY OF %s" % (qn(target_name), qn(source_name)))
+        while True:
+            cursor.execute("SELECT state_desc FROM sys.databases WHERE name = %s" % self._quote_string(target_name))
+            row = cursor.fetchone()
+            if row is not None and row[0] == 'ONLINE':
+                return
+            if row is None or row[0] not in ('COPYING', 'RESTORING'):
+                raise DatabaseError("Copying %s to %s failed (%s)." % (
+                    source_name, target_name, row[0] if row else 'no database'))
+            time.sleep(self.clone_poll_interval)
+
+    def _get_clone_backup(self, cursor, source_name):
+        """
+        Backs up the test database once, for all of its clones. Without
+        TEST['TEMPLATE_DIR'] the file goes to the server's default backup
+        directory.
+        """
+        if self._clone_backup is None:
+            directory = self.connection.settings_dict['TEST'].get('TEMPLATE_DIR')
+            path = '%s_clone.bak' % source_name
+            if directory:
+                sep = '\\' if '\\' in directory else '/'
+                path = '%s%s%s' % (directory.rstrip('/\\'), sep, path)
+            cursor.execute("BACKUP DATABASE %s TO DISK = %s WITH INIT, COPY_ONLY" % (
+                self.connection.ops.quote_name(source_name), self._quote_string(path)))
+            self._consume_messages(cursor)
+            if not directory:
+                # Look up where the server put it, to delete it afterwards.
+                cursor.execute(self.sql_last_backup_path % self._quote_string(source_name))
+                row = cursor.fetchone()
+                if row is not None:
+                    path = row[0]
+            self._clone_backup = path
+        return self._clone_backup
+
+    def _delete_clone_backup(self, verbosity):
+        path, self._clone_backup = self._clone_backup, None
+        connection = self._get_master_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("EXEC master.sys.xp_delete_file 0, %s" % self._quote_string(path))
+        except DatabaseError as e:
+            if verbosity >= 1:
+                print("Couldn't delete the clone backup %s: %s" % (path, e))
+        finally:
+            connection.close()
+
+    def _restore_clone(self, cursor, source_name, target_name):
+        path = self._get_clone_backup(cursor, source_name)
+        cursor.execute("RESTORE FILELISTONLY FROM DISK = %s" % self._quote_string(path))
+        names = [column[0] for column in cursor.description]
+        files = [dict(zip(names, row)) for row in cursor.fetchall()]
+        # Put the clone's files next to the originals, under a new name.
+        moves = []
+        for f in files:
+            physical = f['PhysicalName']
+            sep = '\\' if '\\' in physical else '/'
+            directory, filename = physical.rsplit(sep, 1)
+            extension = filename[filename.rfind('.'):] if '.' in filename else ''
+            moves.append("MOVE %s TO %s" % (
+                self._quote_string(f['LogicalName']),
+                self._quote_string('%s%s%s_%s%s' % (directory, sep, target_name, f['LogicalName'], extension))))
+        cursor.execute("RESTORE DATABASE %s FROM DISK = %s WITH %s" % (
+            self.connection.ops.quote_name(target_name), self._quote_string(path), ', '.join(moves)))
+        self._consume_messages(cursor)
+
+    def destroy_test_db(self, old_database_name=None, verbosity=1, keepdb=False, suffix=None):
+        if suffix is not None:
+            return super(DatabaseCreation, self).destroy_test_db(old_database_name, verbosity, keepdb, suffix)
+        super(DatabaseCreation, self).destroy_test_db(old_database_name, verbosity, keepdb)
+        # The clones are destroyed first; their backup isn't needed any more
+        # (not even with keepdb, which keeps the clone databases themselves).
+        if self._clone_backup is not None:
+            self._delete_clone_backup(verbosity)
+
     def _destroy_test_db(self, test_database_name, verbosity):
         "Internal implementation - remove the test db tables."
         if self.connection.test_create:
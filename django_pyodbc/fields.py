@@ -0,0 +1,76 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Primary keys drawn from a SEQUENCE instead of an IDENTITY column.
+
+    class Event(models.Model):
+        id = SequenceAutoField()
+
+The key is assigned when the INSERT is compiled, from a range of values the
+process reserves with sp_sequence_get_range on the database the INSERT goes
+to. Inserts then don't need to return the key, so bulk_create() sets it on
+the objects as well. Needs SQL Server 2012 or later; the schema editor creates
+the sequence along with the table, or starting after the column's values when
+an existing field is altered into a SequenceAutoField.
+"""
+from django.db import NotSupportedError, models
+from django.db.backends.utils import truncate_name
+
+
+class SequenceAutoField(models.IntegerField):
+    description = "Integer drawn from a sequence"
+    sequence_type = 'int'
+
+    def __init__(self, *args, **kwargs):
+        self.sequence_name = kwargs.pop('sequence_name', None)
+        self.range_size = kwargs.pop('range_size', 100)
+        kwargs['blank'] = True
+        kwargs.setdefault('primary_key', True)
+        super(SequenceAutoField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(SequenceAutoField, self).deconstruct()
+        del kwargs['blank']
+        if kwargs.get('primary_key'):
+            del kwargs['primary_key']
+        else:
+            kwargs['primary_key'] = False
+        if self.sequence_name is not None:
+            kwargs['sequence_name'] = self.sequence_name
+        if self.range_size != 100:
+            kwargs['range_size'] = self.range_size
+        return name, path, args, kwargs
+
+    def get_sequence_name(self, connection, db_table=None):
+        if self.sequence_name is not None:
+            return self.sequence_name
+        return truncate_name('%s_%s_seq' % (db_table or self.model._meta.db_table, self.column),
+                             connection.ops.max_name_length())
+
+    def next_value(self, connection):
+        if connection.vendor != 'microsoft' or connection.ops.sql_server_ver < 2012:
+            raise NotSupportedError('%s needs SQL Server 2012 or later.' % self.__class__.__name__)
+        return connection.ops.next_sequence_value(self.get_sequence_name(connection), self.range_size)
+
+
+class BigSequenceAutoField(SequenceAutoField):
+    description = "Big (8 byte) integer drawn from a sequence"
+    sequence_type = 'bigint'
+
+    def get_internal_type(self):
+        return "BigIntegerField"
+
+    def formfield(self, **kwargs):
+        return models.BigIntegerField.formfield(self, **kwargs)
@@ -0,0 +1,237 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Full-text search.
+
+Character columns covered by a full-text index can be searched with the
+contains_ft and freetext lookups, which compile to CONTAINS() and FREETEXT():
+
+    Product.objects.filter(description__contains_ft='"wireless" AND "charger*"')
+    Product.objects.filter(description__freetext='wireless phone charger')
+
+and the matches ranked with SearchRank, read from CONTAINSTABLE or
+FREETEXTTABLE joined to the table:
+
+    Product.objects.filter(description__freetext=terms).annotate(
+        rank=SearchRank('description', terms, function='FREETEXTTABLE'),
+    ).order_by('-rank')
+
+The full-text catalog and index come from the migration operations below.
+Full-text DDL can't run inside a transaction, so put them in a migration with
+atomic = False.
+"""
+from django.db import NotSupportedError, router
+from django.db.migrations.operations.base import Operation
+from django.db.models import CharField, F, IntegerField, Lookup, TextField
+from django.db.models.expressions import Col, Expression
+from django.db.models.sql.constants import INNER, LOUTER
+
+
+class FullTextLookup(Lookup):
+    # The full-text predicate the lookup compiles to.
+    function = None
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'microsoft':
+            raise NotSupportedError('The %s lookup is only supported on SQL Server.' % self.lookup_name)
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '%s(%s, %s)' % (self.function, lhs, rhs), lhs_params + rhs_params
+
+
+class FullTextContains(FullTextLookup):
+    lookup_name = 'contains_ft'
+    function = 'CONTAINS'
+
+
+class FreeText(FullTextLookup):
+    lookup_name = 'freetext'
+    function = 'FREETEXT'
+
+
+CharField.register_lookup(FullTextContains)
+CharField.register_lookup(FreeText)
+TextField.register_lookup(FullTextContains)
+TextField.register_lookup(FreeText)
+
+
+class FullTextTable(object):
+    """
+    The join of CONTAINSTABLE or FREETEXTTABLE to the table it searches, on
+    the table's primary key, in the FROM clause of a query.
+    """
+    filtered_relation = None
+    nullable = True
+
+    def __init__(self, function, table_name, column, query, top_n, parent_alias, parent_key,
+                 table_alias=None, join_type=LOUTER):
+        self.function = function
+        self.table_name = table_name
+        self.column = column
+        self.query = query
+        self.top_n = top_n
+        self.parent_alias = parent_alias
+        self.parent_key = parent_key
+        self.table_alias = table_alias
+        self.join_type = join_type
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'microsoft':
+            raise NotSupportedError('SearchRank is only supported on SQL Server.')
+        qn = compiler.quote_name_unless_alias
+        qn2 = connection.ops.quote_name
+        args = [qn2(self.table_name), qn2(self.column), '%s']
+        if self.top_n is not None:
+            args.append('%d' % self.top_n)
+        sql = '%s %s(%s) AS %s ON (%s.[KEY] = %s.%s)' % (
+            self.join_type, self.function, ', '.join(args), qn(self.table_alias),
+            qn(self.table_alias), qn(self.parent_alias), qn2(self.parent_key))
+        return sql, [self.query]
+
+    def _clone(self, **kwargs):
+        attrs = dict(self.__dict__, **kwargs)
+        return self.__class__(**attrs)
+
+    def relabeled_clone(self, change_map):
+        return self._clone(
+            parent_alias=change_map.get(self.parent_alias, self.parent_alias),
+            table_alias=change_map.get(self.table_alias, self.table_alias),
+        )
+
+    @property
+    def identity(self):
+        return (self.__class__, self.function, self.table_name, self.column, self.query, self.top_n,
+                self.parent_alias, self.parent_key)
+
+    def equals(self, other, with_filtered_relation):
+        return isinstance(other, FullTextTable) and self.identity == other.identity
+
+    def __eq__(self, other):
+        return self.equals(other, with_filtered_relation=True)
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def demote(self):
+        return self._clone(join_type=INNER)
+
+    def promote(self):
+        return self._clone(join_type=LOUTER)
+
+
+class SearchRank(Expression):
+    """
+    The full-text rank of a row for a search condition, 0 when it doesn't
+    match. function is CONTAINSTABLE (for CONTAINS conditions) or
+    FREETEXTTABLE, which is joined to the searched table; with top_n, only
+    the top_n best matches are ranked.
+    """
+    def __init__(self, expression, query, function='CONTAINSTABLE', top_n=None):
+        if function not in ('CONTAINSTABLE', 'FREETEXTTABLE'):
+            raise ValueError('function must be CONTAINSTABLE or FREETEXTTABLE.')
+        super(SearchRank, self).__init__(output_field=IntegerField())
+        if not hasattr(expression, 'resolve_expression'):
+            expression = F(expression)
+        self.expression = expression
+        self.query = query
+        self.function = function
+        self.top_n = top_n
+        # The alias of the joined full-text table, once resolved.
+        self.alias = None
+
+    def get_source_expressions(self):
+        return [self.expression]
+
+    def set_source_expressions(self, exprs):
+        self.expression, = exprs
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        c = super(SearchRank, self).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        if not isinstance(c.expression, Col):
+            raise ValueError('SearchRank needs a column of the queried model or of a joined one.')
+        target = c.expression.target
+        model = target.model
+        c.alias = query.join(FullTextTable(
+            c.function, model._meta.db_table, target.column, c.query, c.top_n,
+            c.expression.alias, model._meta.pk.column))
+        return c
+
+    def relabeled_clone(self, change_map):
+        clone = super(SearchRank, self).relabeled_clone(change_map)
+        clone.alias = change_map.get(self.alias, self.alias)
+        return clone
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'microsoft':
+            raise NotSupportedError('SearchRank is only supported on SQL Server.')
+        return 'COALESCE(%s.[RANK], 0)' % compiler.quote_name_unless_alias(self.alias), []
+
+
+class FullTextOperation(Operation):
+    reduces_to_sql = True
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _allowed(self, app_label, schema_editor):
+        return (schema_editor.connection.vendor == 'microsoft' and
+                router.allow_migrate(schema_editor.connection.alias, app_label))
+
+
+class CreateFullTextCatalog(FullTextOperation):
+    """
+    CREATE FULLTEXT CATALOG name [AS DEFAULT]
+    """
+    def __init__(self, name, default=False):
+        self.name = name
+        self.default = default
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self._allowed(app_label, schema_editor):
+            schema_editor.create_fulltext_catalog(self.name, self.default)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self._allowed(app_label, schema_editor):
+            schema_editor.delete_fulltext_catalog(self.name)
+
+    def describe(self):
+        return "Create full-text catalog %s" % self.name
+
+
+class CreateFullTextIndex(FullTextOperation):
+    """
+    Creates the full-text index of a model's table on the given fields, keyed
+    on its primary key. A table has at most one full-text index.
+    """
+    def __init__(self, model_name, fields, catalog=None, language=None, change_tracking='AUTO'):
+        self.model_name = model_name
+        self.fields = fields
+        self.catalog = catalog
+        self.language = language
+        self.change_tracking = change_tracking
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self._allowed(app_label, schema_editor):
+            model = to_state.apps.get_model(app_label, self.model_name)
+            schema_editor.create_fulltext_index(
+                model, self.fields, self.catalog, self.language, self.change_tracking)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self._allowed(app_label, schema_editor):
+            schema_editor.delete_fulltext_index(from_state.apps.get_model(app_label, self.model_name))
+
+    def describe(self):
+        return "Create full-text index on %s (%s)" % (self.model_name, ', '.join(self.fields))
@@ -0,0 +1,265 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Date lookups as range predicates.
+
+A filter on a truncated date or on the year of a date, e.g. created__date=day,
+created__year=2024 or TruncMonth('created') >= month, is compiled to a range on
+the column itself:
+
+    created >= start AND created < end
+
+with the bounds computed here in the current time zone (and converted to UTC
+like any other datetime parameter), so the column isn't wrapped in a function
+and its indexes can be seeked. Exact year, quarter, month and day filters on
+the same column, e.g. created__year=2024, created__month=3, are merged into a
+single range the same way.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import DateField, DateTimeField
+from django.db.models.expressions import Col
+from django.db.models.functions.datetime import Extract, TruncBase
+from django.db.models.lookups import Exact, YearLookup
+from django.db.models.sql.where import AND, WhereNode
+
+from django_pyodbc.compat import timezone
+
+RANGE_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte')
+
+
+def trunc_datetime(value, kind):
+    """
+    Truncates a naive datetime like Trunc(kind) does.
+    """
+    if kind == 'year':
+        return value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if kind == 'quarter':
+        return value.replace(month=(value.month - 1) // 3 * 3 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if kind == 'month':
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if kind in ('day', 'date'):
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if kind == 'minute':
+        return value.replace(second=0, microsecond=0)
+    if kind == 'second':
+        return value.replace(microsecond=0)
+    raise ValueError('Unknown truncation: %s' % kind)
+
+
+def next_boundary(value, kind):
+    """
+    Returns the start of the period after the one a truncated datetime starts.
+    """
+    if kind in ('year', 'quarter', 'month'):
+        months = value.year * 12 + value.month - 1 + {'year': 12, 'quarter': 3, 'month': 1}[kind]
+        return value.replace(year=months // 12, month=months % 12 + 1)
+    return value + {
+        'day': datetime.timedelta(days=1),
+        'date': datetime.timedelta(days=1),
+        'hour': datetime.timedelta(hours=1),
+        'minute': datetime.timedelta(minutes=1),
+        'second': datetime.timedelta(seconds=1),
+    }[kind]
+
+
+def _range_bounds(lookup_name, value, kind):
+    """
+    Returns the (lower, upper) bounds of the column values for which
+    Trunc(column, kind) <lookup_name> value holds; either may be None.
+    """
+    start = trunc_datetime(value, kind)
+    aligned = start == value
+    end = next_boundary(start, kind)
+    if lookup_name == 'exact':
+        return (start, end) if aligned else None
+    if lookup_name == 'gt' or (lookup_name == 'gte' and not aligned):
+        return end, None
+    if lookup_name == 'gte':
+        return start, None
+    if lookup_name == 'lt' and aligned:
+        return None, start
+    # lt on an unaligned value, and lte
+    return None, end
+
+
+def _column_tz(expression):
+    """
+    Returns the time zone the date parts of a Trunc or Extract over a column
+    are taken in (None for naive datetimes and dates), or False if the
+    expression isn't over a date or datetime column.
+    """
+    if not isinstance(expression.lhs, Col):
+        return False
+    field = expression.lhs.output_field
+    if isinstance(field, DateTimeField):
+        if settings.USE_TZ:
+            return expression.tzinfo or timezone.get_current_timezone()
+        return None
+    if isinstance(field, DateField):
+        return None
+    return False
+
+
+def column_range_sql(compiler, connection, col, lower, upper, tz):
+    """
+    Returns the SQL and params of col >= lower AND col < upper, for naive
+    bounds in the time zone tz; either bound may be None.
+    """
+    field = col.output_field
+    column_sql, column_params = compiler.compile(col)
+    sql = []
+    params = []
+    for operator, bound in zip(('>=', '<'), (lower, upper)):
+        if bound is None:
+            continue
+        if isinstance(field, DateTimeField):
+            if tz is not None:
+                bound = timezone.make_aware(bound, tz, is_dst=False)
+            bound = connection.ops.adapt_datetimefield_value(bound)
+        else:
+            bound = connection.ops.adapt_datefield_value(bound.date())
+        sql.append('%s %s %%s' % (column_sql, operator))
+        params.extend(column_params)
+        params.append(bound)
+    return '(%s)' % ' AND '.join(sql), params
+
+
+class ColumnRange(object):
+    """
+    A WHERE clause child standing for the range of a column that merged date
+    lookups select.
+    """
+    contains_aggregate = False
+
+    def __init__(self, col, lower, upper, tz):
+        self.col = col
+        self.lower = lower
+        self.upper = upper
+        self.tz = tz
+
+    def as_sql(self, compiler, connection):
+        return column_range_sql(compiler, connection, self.col, self.lower, self.upper, self.tz)
+
+
+def date_range_sql(compiler, connection, lookup):
+    """
+    Returns the SQL and params of a range predicate equivalent to the lookup
+    on a Trunc or on the year of a column, or None if it can't be rewritten.
+    """
+    if lookup.lookup_name not in RANGE_LOOKUPS or hasattr(lookup.rhs, 'as_sql') or lookup.rhs is None:
+        return None
+    expression = lookup.lhs
+    value = lookup.rhs
+    if isinstance(lookup, YearLookup):
+        if not isinstance(expression, Extract) or not isinstance(value, int):
+            return None
+        kind = 'year'
+        try:
+            value = datetime.datetime(value, 1, 1)
+        except ValueError:
+            return None
+    elif isinstance(expression, TruncBase):
+        kind = expression.kind
+    else:
+        return None
+    if kind not in ('year', 'quarter', 'month', 'day', 'date', 'hour', 'minute', 'second'):
+        return None
+    tz = _column_tz(expression)
+    if tz is False:
+        return None
+    if not isinstance(expression.lhs.output_field, DateTimeField) and kind in ('hour', 'minute', 'second'):
+        return None
+
+    if isinstance(value, datetime.datetime):
+        if tz is not None and timezone.is_aware(value):
+            value = timezone.make_naive(value, tz)
+        elif timezone.is_aware(value):
+            value = value.replace(tzinfo=None)
+    elif isinstance(value, datetime.date):
+        value = datetime.datetime.combine(value, datetime.time())
+    else:
+        return None
+
+    bounds = _range_bounds(lookup.lookup_name, value, kind)
+    if bounds is None:
+        return None
+    return column_range_sql(compiler, connection, expression.lhs, bounds[0], bounds[1], tz)
+
+
+def _date_part(child):
+    """
+    Returns (column key, date part, value) for an exact lookup on the year,
+    quarter, month or day of a column, else None.
+    """
+    if not isinstance(child, Exact) or not isinstance(child.lhs, Extract):
+        return None
+    part = child.lhs.lookup_name
+    if part not in ('year', 'quarter', 'month', 'day'):
+        return None
+    if not isinstance(child.rhs, int) or isinstance(child.rhs, bool):
+        return None
+    tz = _column_tz(child.lhs)
+    if tz is False:
+        return None
+    col = child.lhs.lhs
+    return (col.alias, col.target.column, tz), part, child.rhs
+
+
+def merge_date_parts(node):
+    """
+    Returns a copy of the WHERE node in which exact lookups on the year and
+    quarter, or the year, month and day, of the same column are replaced by a
+    ColumnRange, or None if there's nothing to merge.
+    """
+    if node.connector != AND:
+        return None
+    parts = {}
+    for child in node.children:
+        date_part = _date_part(child)
+        if date_part is not None:
+            key, part, value = date_part
+            parts.setdefault(key, {}).setdefault(part, []).append((child, value))
+
+    ranges = []
+    merged = set()
+    for (alias, column, tz), column_parts in parts.items():
+        if any(len(values) > 1 for values in column_parts.values()):
+            continue
+        values = dict((part, found[0][1]) for part, found in column_parts.items())
+        if 'year' not in values or ('month' in values) == ('quarter' in values):
+            continue
+        if 'day' in values and 'month' not in values:
+            continue
+        if 'quarter' in values:
+            kind, month, day = 'quarter', (values['quarter'] - 1) * 3 + 1, 1
+        else:
+            kind, month, day = ('day', values['month'], values['day']) if 'day' in values else ('month', values['month'], 1)
+        try:
+            lower = datetime.datetime(values['year'], month, day)
+            upper = next_boundary(lower, kind)
+        except (ValueError, OverflowError):
+            # Matches nothing; left to the lookups.
+            continue
+        children = [found[0][0] for found in column_parts.values()]
+        merged.update(id(child) for child in children)
+        ranges.append(ColumnRange(children[0].lhs.lhs, lower, upper, tz))
+    if not ranges:
+        return None
+    children = [child for child in node.children if id(child) not in merged] + ranges
+    return WhereNode(children, node.connector, node.negated)
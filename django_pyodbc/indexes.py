@@ -0,0 +1,102 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SQL Server specific indexes, for use in a model's Meta.indexes.
+"""
+from django.db.backends.ddl_references import Columns, Statement, Table
+from django.db.backends.utils import split_identifier
+from django.db.models import Index
+
+
+class ColumnStoreIndex(Index):
+    """
+    A columnstore index. Nonclustered ones cover the given fields; a clustered
+    one stores the whole table column-wise and takes no fields:
+
+        class Event(models.Model):
+            ...
+            class Meta:
+                indexes = [ColumnStoreIndex(clustered=True)]
+
+    The table of a model with a clustered columnstore index is created with a
+    nonclustered primary key, so declare the index along with the model rather
+    than adding it to an existing table.
+    """
+    suffix = 'csi'
+    sql_create_clustered = "CREATE CLUSTERED COLUMNSTORE INDEX %(name)s ON %(table)s%(extra)s"
+    sql_create_nonclustered = "CREATE NONCLUSTERED COLUMNSTORE INDEX %(name)s ON %(table)s (%(columns)s)%(extra)s"
+
+    def __init__(self, fields=[], name=None, db_tablespace=None, clustered=False):
+        self.clustered = clustered
+        if not clustered:
+            if any(field_name.startswith('-') for field_name in fields):
+                raise ValueError('Columnstore index columns have no order.')
+            super(ColumnStoreIndex, self).__init__(fields=fields, name=name, db_tablespace=db_tablespace)
+            return
+        if fields:
+            raise ValueError('A clustered columnstore index covers every column; fields cannot be given.')
+        # Index insists on at least one field, so set up what it would.
+        self.fields = []
+        self.fields_orders = []
+        self.name = name or ''
+        self.db_tablespace = db_tablespace
+        if self.name:
+            errors = self.check_name()
+            if len(self.name) > self.max_name_length:
+                errors.append('Index names cannot be longer than %s characters.' % self.max_name_length)
+            if errors:
+                raise ValueError(errors)
+
+    def create_sql(self, model, schema_editor, using=''):
+        table = model._meta.db_table
+        fields = [model._meta.get_field(field_name) for field_name, _ in self.fields_orders]
+        columns = [field.column for field in fields]
+        if self.clustered:
+            sql = self.sql_create_clustered
+        else:
+            sql = self.sql_create_nonclustered
+        return Statement(
+            sql,
+            table=Table(table, schema_editor.quote_name),
+            name=schema_editor.quote_name(self.name),
+            columns=Columns(table, columns, schema_editor.quote_name),
+            extra=schema_editor._get_index_tablespace_sql(model, fields, db_tablespace=self.db_tablespace),
+        )
+
+    def set_name_with_model(self, model):
+        if not self.clustered:
+            return super(ColumnStoreIndex, self).set_name_with_model(model)
+        _, table_name = split_identifier(model._meta.db_table)
+        self.name = '%s_%s_%s' % (table_name[:17], self._hash_generator(table_name, self.suffix), self.suffix)
+        self.check_name()
+
+    def deconstruct(self):
+        path, args, kwargs = super(ColumnStoreIndex, self).deconstruct()
+        if self.clustered:
+            del kwargs['fields']
+            kwargs['clustered'] = True
+        return path, args, kwargs
+
+    def __repr__(self):
+        if self.clustered:
+            return "<%s: clustered>" % self.__class__.__name__
+        return super(ColumnStoreIndex, self).__repr__()
+
+
+def has_clustered_columnstore(model):
+    return any(
+        isinstance(index, ColumnStoreIndex) and index.clustered
+        for index in model._meta.indexes
+    )
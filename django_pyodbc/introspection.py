@@ -40,6 +40,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from contextlib import contextmanager
+
 try:
     from django.db.backends.base.introspection import BaseDatabaseIntrospection, TableInfo
 except ImportError:
@@ -50,10 +52,227 @@ except ImportError:
 else:
     row_to_table_info = lambda row: TableInfo(row[0].lower(), row[1])
 
+from django.db.models import Index
+
+from django_pyodbc.indexes import ColumnStoreIndex
+
 import pyodbc as Database
 
 SQL_AUTOFIELD = -777555
 
+# sys.types names of the variable length types whose sys.columns.max_length is
+# -1 for (max), and of those that store two bytes per character.
+_SIZED_TYPES = ('binary', 'char', 'nchar', 'nvarchar', 'varbinary', 'varchar')
+_WIDE_TYPES = ('nchar', 'ntext', 'nvarchar')
+
+# Map sys.types names to the ODBC type codes pyodbc's cursor.columns() reports.
+_TYPE_CODES = {
+    'bigint':           Database.SQL_BIGINT,
+    'binary':           Database.SQL_BINARY,
+    'bit':              Database.SQL_BIT,
+    'char':             Database.SQL_CHAR,
+    'date':             Database.SQL_TYPE_DATE,
+    'datetime':         Database.SQL_TYPE_TIMESTAMP,
+    'datetime2':        Database.SQL_TYPE_TIMESTAMP,
+    'decimal':          Database.SQL_DECIMAL,
+    'float':            Database.SQL_FLOAT,
+    'image':            Database.SQL_LONGVARBINARY,
+    'int':              Database.SQL_INTEGER,
+    'money':            Database.SQL_DECIMAL,
+    'nchar':            Database.SQL_WCHAR,
+    'ntext':            Database.SQL_WLONGVARCHAR,
+    'numeric':          Database.SQL_NUMERIC,
+    'nvarchar':         Database.SQL_WVARCHAR,
+    'real':             Database.SQL_REAL,
+    'smalldatetime':    Database.SQL_TYPE_TIMESTAMP,
+    'smallint':         Database.SQL_SMALLINT,
+    'smallmoney':       Database.SQL_DECIMAL,
+    'text':             Database.SQL_LONGVARCHAR,
+    'time':             Database.SQL_TYPE_TIME,
+    'tinyint':          Database.SQL_TINYINT,
+    'uniqueidentifier': Database.SQL_GUID,
+    'varbinary':        Database.SQL_VARBINARY,
+    'varchar':          Database.SQL_VARCHAR,
+}
+
+# (max) columns are reported as their "long" counterparts
+_MAX_TYPE_CODES = {
+    'nvarchar':         Database.SQL_WLONGVARCHAR,
+    'varbinary':        Database.SQL_LONGVARBINARY,
+    'varchar':          Database.SQL_LONGVARCHAR,
+}
+
+
+class SchemaSnapshot(object):
+    """
+    In-memory copy of the catalog of a set of tables (or of all of them).
+
+    Every kind of metadata (columns, foreign keys, indexes) is read with a
+    single set-based query against the sys.* catalog views the first time it's
+    needed, instead of one query per table, column or key.
+    """
+    def __init__(self, connection, table_names=None):
+        self.connection = connection
+        self.table_names = [t.lower() for t in table_names] if table_names else None
+        self._tables = None
+        self._columns = None
+        self._constraints = None
+        self._indexes = None
+
+    def covers(self, table_name):
+        return self.table_names is None or table_name.lower() in self.table_names
+
+    def _table_filter(self, filters=1):
+        """
+        Returns the WHERE clause (and its params) that restricts a catalog
+        query, in which sys.tables is aliased as `t`, to the snapshot tables.
+        filters is the number of times the query repeats the clause.
+        """
+        where = ['t.is_ms_shipped = 0']
+        params = []
+        if self.connection.limit_table_list:
+            where.append("SCHEMA_NAME(t.schema_id) = 'dbo'")
+        # A query can't take more than 2100 parameters; beyond that it's
+        # cheaper to read the whole catalog anyway.
+        if self.table_names is not None and len(self.table_names) * filters <= 2100:
+            where.append('t.name IN (%s)' % ', '.join(['%s'] * len(self.table_names)))
+            params.extend(self.table_names)
+        return ' AND '.join(where), params
+
+    def _fetch(self, cursor, sql, filters=1):
+        where, params = self._table_filter(filters)
+        cursor.execute(sql % {'where': where}, params * filters)
+        return cursor.fetchall()
+
+    def tables(self, cursor):
+        """
+        Returns a list of the names of the base tables.
+        """
+        if self._tables is None:
+            self._tables = [row[0] for row in self._fetch(cursor, """
+                SELECT t.name FROM sys.tables t WHERE %(where)s""")]
+        return self._tables
+
+    def columns(self, cursor, table_name):
+        """
+        Returns a list of (name, type_name, max_length, precision, scale,
+        is_nullable, is_identity, collation_name) for the given table, in
+        column order.
+        """
+        if self._columns is None:
+            self._columns = {}
+            for row in self._fetch(cursor, """
+                SELECT t.name, c.name, TYPE_NAME(c.system_type_id), c.max_length,
+                    c.precision, c.scale, c.is_nullable, c.is_identity, c.collation_name
+                FROM sys.tables t
+                JOIN sys.columns c ON c.object_id = t.object_id
+                WHERE %(where)s
+                ORDER BY t.object_id, c.column_id"""):
+                self._columns.setdefault(row[0].lower(), []).append(tuple(row[1:]))
+        return self._columns.get(table_name.lower(), [])
+
+    def constraints(self, cursor, table_name):
+        """
+        Returns a list of (kind, constraint_name, column, referenced_table,
+        referenced_column, definition) for the foreign key ('F') and check
+        ('C') constraints of the given table. Foreign keys have one row per
+        column, in key order.
+        """
+        if self._constraints is None:
+            self._constraints = {}
+            for row in self._fetch(cursor, """
+                SELECT t.name, 'F', fk.name, pc.name, rt.name, rc.name, NULL,
+                    fk.object_id, fkc.constraint_column_id
+                FROM sys.tables t
+                JOIN sys.foreign_keys fk ON fk.parent_object_id = t.object_id
+                JOIN sys.foreign_key_columns fkc ON fkc.constraint_object_id = fk.object_id
+                JOIN sys.columns pc
+                    ON pc.object_id = fkc.parent_object_id AND pc.column_id = fkc.parent_column_id
+                JOIN sys.tables rt ON rt.object_id = fkc.referenced_object_id
+                JOIN sys.columns rc
+                    ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+                WHERE %(where)s
+                UNION ALL
+                SELECT t.name, 'C', cc.name, c.name, NULL, NULL, cc.definition,
+                    cc.object_id, 0
+                FROM sys.tables t
+                JOIN sys.check_constraints cc ON cc.parent_object_id = t.object_id
+                LEFT JOIN sys.columns c
+                    ON c.object_id = cc.parent_object_id AND c.column_id = cc.parent_column_id
+                WHERE %(where)s
+                ORDER BY 1, 8, 9""", 2):
+                self._constraints.setdefault(row[0].lower(), []).append(tuple(row[1:7]))
+        return self._constraints.get(table_name.lower(), [])
+
+    def foreign_keys(self, cursor, table_name):
+        """
+        Returns a list of (constraint_name, column, referenced_table,
+        referenced_column) for the given table.
+        """
+        return [
+            (name, column, referenced_table, referenced_column)
+            for kind, name, column, referenced_table, referenced_column, definition
+            in self.constraints(cursor, table_name)
+            if kind == 'F'
+        ]
+
+    def indexes(self, cursor, table_name):
+        """
+        Returns a list of dicts describing each index of the given table: its
+        name, type, key columns (in key order) and their orders, included
+        columns, filter predicate and primary_key/unique/unique_constraint
+        flags.
+        """
+        if self._indexes is None:
+            self._indexes = {}
+            if self.connection.ops.sql_server_ver >= 2008:
+                filter_definition = 'i.filter_definition'
+            else:
+                filter_definition = 'NULL'
+            current = None
+            for row in self._fetch(cursor, """
+                SELECT t.name, i.name, LOWER(i.type_desc), i.is_primary_key, i.is_unique,
+                    i.is_unique_constraint, %(filter_definition)s, c.name, ic.key_ordinal,
+                    ic.is_descending_key, ic.is_included_column
+                FROM sys.tables t
+                JOIN sys.indexes i ON i.object_id = t.object_id
+                JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+                WHERE %%(where)s
+                ORDER BY t.object_id, i.index_id, ic.key_ordinal, ic.index_column_id""" % {
+                    'filter_definition': filter_definition,
+                }):
+                (table, name, type_desc, primary_key, unique, unique_constraint, condition,
+                 column, key_ordinal, descending, included) = row
+                if current is None or current['table'] != table or current['name'] != name:
+                    current = {
+                        'table': table,
+                        'name': name,
+                        'type': type_desc,
+                        'primary_key': bool(primary_key),
+                        'unique': bool(unique),
+                        'unique_constraint': bool(unique_constraint),
+                        'condition': condition,
+                        'columns': [],
+                        'orders': [],
+                        'included': [],
+                    }
+                    self._indexes.setdefault(table.lower(), []).append(current)
+                if type_desc.endswith('columnstore'):
+                    # Columnstore indexes have no key columns; their columns
+                    # are listed as included ones.
+                    current['columns'].append(column)
+                    current['orders'].append('ASC')
+                elif key_ordinal > 0:
+                    current['columns'].append(column)
+                    current['orders'].append('DESC' if descending else 'ASC')
+                elif included:
+                    current['included'].append(column)
+                # Otherwise it's a partitioning column that SQL Server added
+                # to the index on its own.
+        return self._indexes.get(table_name.lower(), [])
+
+
 class DatabaseIntrospection(BaseDatabaseIntrospection):
     # Map type codes to Django Field types.
     data_types_reverse = {
@@ -83,10 +302,88 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
         Database.SQL_WVARCHAR:          'TextField',
     }
 
+    def __init__(self, connection):
+        super(DatabaseIntrospection, self).__init__(connection)
+        self._snapshot = None
+        self._column_info = {}
+        self._has_triggers = {}
+
+    @contextmanager
+    def snapshot(self, table_names=None):
+        """
+        Answer every introspection call made inside the block from a single
+        SchemaSnapshot of the given tables (all of them by default), instead of
+        querying the catalog again for each table:
+
+            with connection.introspection.snapshot():
+                for table in connection.introspection.table_names(cursor):
+                    ...
+        """
+        previous = self._snapshot
+        self._snapshot = SchemaSnapshot(self.connection, table_names)
+        try:
+            yield self._snapshot
+        finally:
+            self._snapshot = previous
+
+    def _get_snapshot(self, table_name=None):
+        if self._snapshot is not None and (table_name is None or self._snapshot.covers(table_name)):
+            return self._snapshot
+        return SchemaSnapshot(self.connection, table_name and [table_name])
+
+    def _get_column_info(self, table_name):
+        # {column: (type_name, collation_name)}, read once per table and kept
+        # until the schema editor changes the schema.
+        column_info = self._column_info.get(table_name)
+        if column_info is None:
+            cursor = self.connection._internal_cursor()
+            column_info = dict(
+                (column[0], (column[1], column[7]))
+                for column in self._get_snapshot(table_name).columns(cursor, table_name))
+            self._column_info[table_name] = column_info
+        return column_info
+
+    def get_column_type(self, table_name, column):
+        """
+        Returns the sys.types name of a column, or None if it isn't found.
+        """
+        info = self._get_column_info(table_name).get(column)
+        return info and info[0]
+
+    def get_column_collation(self, table_name, column):
+        """
+        Returns the collation of a character column, the database's if the
+        column isn't found, or None for other columns.
+        """
+        info = self._get_column_info(table_name).get(column)
+        if info is None:
+            return self.connection.ops.database_collation
+        return info[1]
+
+    def has_triggers(self, table_name):
+        """
+        Returns whether DML triggers are defined on a table, enabled or not.
+        Cached like the column information.
+        """
+        has_triggers = self._has_triggers.get(table_name)
+        if has_triggers is None:
+            cursor = self.connection._internal_cursor()
+            cursor.execute("SELECT COUNT(*) FROM sys.triggers WHERE parent_id = OBJECT_ID(%s)",
+                           [self.connection.ops.quote_name(table_name)])
+            has_triggers = self._has_triggers[table_name] = bool(cursor.fetchone()[0])
+        return has_triggers
+
+    def _uses_odbc_catalog(self):
+        # IBM's DB2 and Progress OpenEdge don't have the sys.* catalog views
+        return self.connection.ops.is_db2 or self.connection.ops.is_openedge
+
     def get_table_list(self, cursor):
         """
         Returns a list of table names in the current database.
         """
+        if self._snapshot is not None:
+            return [row_to_table_info((name, 't')) for name in self._snapshot.tables(cursor)]
+
         # TABLES: http://msdn2.microsoft.com/en-us/library/ms186224.aspx
         # TODO: Believe the below queries should actually select `TABLE_NAME, TABLE_TYPE`
         if cursor.db_wrpr.limit_table_list:
@@ -96,116 +393,132 @@ class DatabaseIntrospection(BaseDatabaseIntrospection):
 
         return [row_to_table_info(row) for row in cursor.fetchall()]
 
-    def _is_auto_field(self, cursor, table_name, column_name):
-        """
-        Checks whether column is Identity
-        """
-        # COLUMNPROPERTY: http://msdn2.microsoft.com/en-us/library/ms174968.aspx
-
-        #from django.db import connection
-        #cursor.execute("SELECT COLUMNPROPERTY(OBJECT_ID(%s), %s, 'IsIdentity')",
-        #                 (connection.ops.quote_name(table_name), column_name))
-        cursor.execute("SELECT COLUMNPROPERTY(OBJECT_ID(%s), %s, 'IsIdentity')",
-                         (self.connection.ops.quote_name(table_name), column_name))
-        return cursor.fetchall()[0][0]
-
-
-
     def get_table_description(self, cursor, table_name, identity_check=True):
         """Returns a description of the table, with DB-API cursor.description interface.
 
-        The 'auto_check' parameter has been added to the function argspec.
+        The 'identity_check' parameter has been added to the function argspec.
         If set to True, the function will check each of the table's fields for the
         IDENTITY property (the IDENTITY property is the MSSQL equivalent to an AutoField).
 
         When a field is found with an IDENTITY property, it is given a custom field number
         of SQL_AUTOFIELD, which maps to the 'AutoField' value in the DATA_TYPES_REVERSE dict.
         """
+        if self._uses_odbc_catalog():
+            # map pyodbc's cursor.columns to db-api cursor description
+            return [[c[3], c[4], None, c[6], c[6], c[8], c[10]] for c in cursor.columns(table=table_name)]
 
-        # map pyodbc's cursor.columns to db-api cursor description
-        columns = [[c[3], c[4], None, c[6], c[6], c[8], c[10]] for c in cursor.columns(table=table_name)]
         items = []
-        for column in columns:
-            if identity_check and self._is_auto_field(cursor, table_name, column[0]):
-                column[1] = SQL_AUTOFIELD
+        for name, type_name, max_length, precision, scale, nullable, identity, collation in \
+                self._get_snapshot(table_name).columns(cursor, table_name):
+            if type_name in _SIZED_TYPES:
+                if max_length == -1:
+                    size = 0
+                elif type_name in _WIDE_TYPES:
+                    size = max_length // 2
+                else:
+                    size = max_length
+            else:
+                size = precision
+            if max_length == -1 and type_name in _MAX_TYPE_CODES:
+                type_code = _MAX_TYPE_CODES[type_name]
+            else:
+                type_code = _TYPE_CODES.get(type_name, type_name)
+            if identity_check and identity:
+                type_code = SQL_AUTOFIELD
             # The conversion from TextField to CharField below is unwise.
             #   A SQLServer db field of type "Text" is not interchangeable with a CharField, no matter how short its max_length.
             #   For example, model.objects.values(<text_field_name>).count() will fail on a sqlserver 'text' field
-            if column[1] == Database.SQL_WVARCHAR and column[3] < 4000:
-                column[1] = Database.SQL_WCHAR
-            items.append(column)
+            if type_code == Database.SQL_WVARCHAR and size < 4000:
+                type_code = Database.SQL_WCHAR
+            items.append([name, type_code, None, size, size, scale, nullable])
         return items
 
-    def _name_to_index(self, cursor, table_name):
+    def get_relations(self, cursor, table_name):
         """
-        Returns a dictionary of {field_name: field_index} for the given table.
-        Indexes are 0-based.
+        Returns a dictionary of {field_name: (field_name_other_table, other_table)}
+        representing all relationships to the given table.
         """
-        return dict([(d[0], i) for i, d in enumerate(self.get_table_description(cursor, table_name, identity_check=False))])
+        return dict(
+            (column, (referenced_column, referenced_table.lower()))
+            for name, column, referenced_table, referenced_column
+            in self._get_snapshot(table_name).foreign_keys(cursor, table_name)
+        )
 
-    def get_relations(self, cursor, table_name):
+    def get_primary_key_column(self, cursor, table_name):
+        for index in self._get_snapshot(table_name).indexes(cursor, table_name):
+            if index['primary_key']:
+                return index['columns'][0]
+        return None
+
+    def get_constraints(self, cursor, table_name):
         """
-        Returns a dictionary of {field_index: (field_index_other_table, other_table)}
-        representing all relationships to the given table. Indexes are 0-based.
+        Returns a dict mapping constraint and index names to their attributes
+        (see BaseDatabaseIntrospection.get_constraints). Indexes also report
+        their 'included' columns, filter 'condition' and whether they're
+        'clustered'.
         """
-        # CONSTRAINT_COLUMN_USAGE: http://msdn2.microsoft.com/en-us/library/ms174431.aspx
-        # CONSTRAINT_TABLE_USAGE:  http://msdn2.microsoft.com/en-us/library/ms179883.aspx
-        # REFERENTIAL_CONSTRAINTS: http://msdn2.microsoft.com/en-us/library/ms179987.aspx
-        # TABLE_CONSTRAINTS:       http://msdn2.microsoft.com/en-us/library/ms181757.aspx
-
-        table_index = self._name_to_index(cursor, table_name)
-        sql = """
-SELECT e.COLUMN_NAME AS column_name,
-  c.TABLE_NAME AS referenced_table_name,
-  d.COLUMN_NAME AS referenced_column_name
-FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS a
-INNER JOIN INFORMATION_SCHEMA.REFERENTIAL_CONSTRAINTS AS b
-  ON a.CONSTRAINT_NAME = b.CONSTRAINT_NAME
-INNER JOIN INFORMATION_SCHEMA.CONSTRAINT_TABLE_USAGE AS c
-  ON b.UNIQUE_CONSTRAINT_NAME = c.CONSTRAINT_NAME
-INNER JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE AS d
-  ON c.CONSTRAINT_NAME = d.CONSTRAINT_NAME
-INNER JOIN INFORMATION_SCHEMA.CONSTRAINT_COLUMN_USAGE AS e
-  ON a.CONSTRAINT_NAME = e.CONSTRAINT_NAME
-WHERE a.TABLE_NAME = %s AND a.CONSTRAINT_TYPE = 'FOREIGN KEY'"""
-        cursor.execute(sql, (table_name,))
-        return dict([(table_index[item[0]], (self._name_to_index(cursor, item[1])[item[2]], item[1]))
-                     for item in cursor.fetchall()])
+        snapshot = self._get_snapshot(table_name)
+        constraints = {}
+        for index in snapshot.indexes(cursor, table_name):
+            constraints[index['name']] = {
+                'columns': index['columns'],
+                'primary_key': index['primary_key'],
+                'unique': index['unique'],
+                'foreign_key': None,
+                'check': False,
+                # Primary keys and unique constraints are enforced through an
+                # index of the same name, but they aren't "indexes" to Django.
+                'index': not (index['primary_key'] or index['unique_constraint']),
+                'orders': index['orders'],
+                # The suffix of the Index class that creates such an index,
+                # which is what the schema editor looks indexes up by.
+                'type': ColumnStoreIndex.suffix if index['type'].endswith('columnstore') else Index.suffix,
+                'clustered': index['type'].startswith('clustered'),
+                'included': index['included'],
+                'condition': index['condition'],
+            }
+        for kind, name, column, referenced_table, referenced_column, definition in \
+                snapshot.constraints(cursor, table_name):
+            if name not in constraints:
+                constraints[name] = {
+                    'columns': [],
+                    'primary_key': False,
+                    'unique': False,
+                    'foreign_key': None,
+                    'check': kind == 'C',
+                    'index': False,
+                    'definition': definition,
+                }
+            if column is not None:
+                constraints[name]['columns'].append(column)
+            if kind == 'F':
+                constraints[name]['foreign_key'] = (referenced_table.lower(), referenced_column)
+        return constraints
+
+    def get_constraints_for_tables(self, cursor, table_names):
+        """
+        Returns a dict mapping each of the given tables to its get_constraints()
+        result, reading the catalog only once for all of them.
+        """
+        with self.snapshot(table_names):
+            return dict(
+                (table_name, self.get_constraints(cursor, table_name))
+                for table_name in table_names
+            )
 
     def get_indexes(self, cursor, table_name):
     #    Returns a dictionary of fieldname -> infodict for the given table,
     #    where each infodict is in the format:
     #        {'primary_key': boolean representing whether it's the primary key,
     #         'unique': boolean representing whether it's a unique index}
-        sql = """
-            select
-            C.name as [column_name],
-            IX.is_unique as [unique],
-            IX.is_primary_key as [primary_key]
-            from
-            sys.tables T
-            join sys.index_columns IC on IC.object_id = T.object_id
-            join sys.columns C on C.object_id = T.object_id and C.column_id = IC.column_id
-            join sys.indexes IX on IX.object_id = T.object_id and IX.index_id = IC.index_id
-            where
-            T.name = %s
-            -- Omit multi-column keys
-            and not exists (
-                select *
-                from sys.index_columns cols
-                where
-                    cols.object_id = T.object_id
-                    and cols.index_id = IC.index_id
-                    and cols.key_ordinal > 1
-            )
-        """
-        cursor.execute(sql,[table_name])
-        constraints = cursor.fetchall()
         indexes = dict()
-
-        for column_name, unique, primary_key in constraints:
-            indexes[column_name.lower()] = {"primary_key":primary_key, "unique":unique}
-
+        for index in self._get_snapshot(table_name).indexes(cursor, table_name):
+            # Omit multi-column keys
+            if len(index['columns']) == 1:
+                indexes[index['columns'][0].lower()] = {
+                    "primary_key": index['primary_key'],
+                    "unique": index['unique'],
+                }
         return indexes
 
     #def get_collations_list(self, cursor):
@@ -223,38 +536,8 @@ WHERE a.TABLE_NAME = %s AND a.CONSTRAINT_TYPE = 'FOREIGN KEY'"""
         Backends can override this to return a list of (column_name, referenced_table_name,
         referenced_column_name) for all key columns in given table.
         """
-        source_field_dict = self._name_to_index(cursor, table_name)
-
-        sql = """
-select
-    COLUMN_NAME = fk_cols.COLUMN_NAME,
-    REFERENCED_TABLE_NAME = pk.TABLE_NAME,
-    REFERENCED_COLUMN_NAME = pk_cols.COLUMN_NAME
-from INFORMATION_SCHEMA.REFERENTIAL_CONSTRAINTS ref_const
-join INFORMATION_SCHEMA.TABLE_CONSTRAINTS fk
-    on ref_const.CONSTRAINT_CATALOG = fk.CONSTRAINT_CATALOG
-    and ref_const.CONSTRAINT_SCHEMA = fk.CONSTRAINT_SCHEMA
-    and ref_const.CONSTRAINT_NAME = fk.CONSTRAINT_NAME
-    and fk.CONSTRAINT_TYPE = 'FOREIGN KEY'
-
-join INFORMATION_SCHEMA.TABLE_CONSTRAINTS pk
-    on ref_const.UNIQUE_CONSTRAINT_CATALOG = pk.CONSTRAINT_CATALOG
-    and ref_const.UNIQUE_CONSTRAINT_SCHEMA = pk.CONSTRAINT_SCHEMA
-    and ref_const.UNIQUE_CONSTRAINT_NAME = pk.CONSTRAINT_NAME
-    And pk.CONSTRAINT_TYPE = 'PRIMARY KEY'
-
-join INFORMATION_SCHEMA.KEY_COLUMN_USAGE fk_cols
-    on ref_const.CONSTRAINT_NAME = fk_cols.CONSTRAINT_NAME
-
-join INFORMATION_SCHEMA.KEY_COLUMN_USAGE pk_cols
-    on pk.CONSTRAINT_NAME = pk_cols.CONSTRAINT_NAME
-where
-    fk.TABLE_NAME = %s"""
-
-        cursor.execute(sql,[table_name])
-        relations = cursor.fetchall()
-
-        key_columns = []
-        key_columns.extend([(source_column, target_table, target_column) \
-            for source_column, target_table, target_column in relations])
-        return key_columns
+        return [
+            (column, referenced_table, referenced_column)
+            for name, column, referenced_table, referenced_column
+            in self._get_snapshot(table_name).foreign_keys(cursor, table_name)
+        ]
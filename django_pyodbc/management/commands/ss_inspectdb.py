@@ -0,0 +1,33 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ss_inspectdb management command: Django's inspectdb, answered from a single
+catalog snapshot so that large databases are introspected with a handful of
+queries instead of several per table.
+"""
+
+from django.core.management.commands import inspectdb
+from django.db import connections
+
+
+class Command(inspectdb.Command):
+    help = ("Introspects the database tables in the given database and outputs "
+            "a Django model module (MS SQL Server-specific).")
+
+    def handle_inspection(self, options):
+        connection = connections[options['database']]
+        with connection.introspection.snapshot(options['table'] or None):
+            for line in super(Command, self).handle_inspection(options):
+                yield line
@@ -43,22 +43,31 @@
 """
 ss_loaddata management command, we need to keep close track of changes in
 django/core/management/commands/loaddata.py.
-"""
 
-from __future__ import print_function
+It loads fixtures the way loaddata does, only faster on SQL Server:
+
+* consecutive objects of a model are inserted with multi-row INSERTs instead
+  of one save() each; objects that already exist in the table or have no
+  primary key are still saved one by one,
+* IDENTITY_INSERT is switched on once per table rather than per statement,
+* constraints are disabled only on the tables the fixtures load into, as they
+  are reached, and only those tables are checked afterwards.
+
+pre_save and post_save are sent with raw=True as loaddata does; m2m_changed
+isn't sent for the relations of inserted objects.
+"""
 
-import sys
-import os
 import gzip
-import zipfile
+import os
+import sys
+import warnings
 
-from django.core.management.base import BaseCommand
+from django.core import serializers
+from django.core.management.base import CommandError
 from django.core.management.color import no_style
-
-try:
-    set
-except NameError:
-    from sets import Set as set   # Python 2.3 fallback
+from django.core.management.commands import loaddata
+from django.db import DatabaseError, IntegrityError, connections, router
+from django.db.models import signals
 
 try:
     import bz2
@@ -66,254 +75,232 @@ try:
 except ImportError:
     has_bz2 = False
 
-class Command(BaseCommand):
-    help = 'Installs the named fixture(s) in the database (MS SQL Server-specific).'
-    args = "fixture [fixture ...]"
-
-    def __init__(self):
-        super(Command, self).__init__()
-        self.in_disabled_constraints = False
-        self.model_name = None
-        self.tables = set()
 
-    def handle(self, *fixture_labels, **options):
-        from django.db.models import get_apps
-        from django.core import serializers
-        from django.db import connection, transaction
-        from django.conf import settings
-
-        self.style = no_style()
+class Command(loaddata.Command):
+    help = 'Installs the named fixture(s) in the database (MS SQL Server-specific).'
 
-        verbosity = int(options.get('verbosity', 1))
-        show_traceback = options.get('traceback', False)
+    # Most objects of one model inserted by a single INSERT, further limited
+    # by ops.bulk_batch_size().
+    batch_size = 1000
 
-        # commit is a stealth option - it isn't really useful as
-        # a command line option, but it can be useful when invoking
-        # loaddata from within another script.
-        # If commit=True, loaddata will use its own transaction;
-        # if commit=False, the data load SQL will become part of
-        # the transaction in place when loaddata was invoked.
-        commit = options.get('commit', True)
+    def loaddata(self, fixture_labels):
+        connection = connections[self.using]
 
         # Keep a count of the installed objects and fixtures
-        fixture_count = 0
-        object_count = 0
-        models = set()
-
-        humanize = lambda dirname: dirname and "'%s'" % dirname or 'absolute path'
-
-        # Get a cursor (even though we don't need one yet). This has
-        # the side effect of initializing the test database (if
-        # it isn't already initialized).
-        cursor = connection.cursor()
-
-        # Start transaction management. All fixtures are installed in a
-        # single transaction to ensure that all references are resolved.
-        if commit:
-            transaction.commit_unless_managed()
-            transaction.enter_transaction_management()
-            transaction.managed(True)
-
-        self.disable_forward_ref_checks()
-
-        class SingleZipReader(zipfile.ZipFile):
-            def __init__(self, *args, **kwargs):
-                zipfile.ZipFile.__init__(self, *args, **kwargs)
-                if settings.DEBUG:
-                    assert len(self.namelist()) == 1, "Zip-compressed fixtures must contain only one file."
-            def read(self):
-                return zipfile.ZipFile.read(self, self.namelist()[0])
-
-        compression_types = {
-            None:   file,
-            'gz':   gzip.GzipFile,
-            'zip':  SingleZipReader
+        self.fixture_count = 0
+        self.loaded_object_count = 0
+        self.fixture_object_count = 0
+        self.models = set()
+        # Tables constraints were disabled on, in order, and the number of
+        # disable_constraint_checking() calls that disabled them.
+        self.disabled_tables = []
+        self.disable_count = 0
+
+        self.serialization_formats = serializers.get_public_serializer_formats()
+        self.compression_formats = {
+            None: (open, 'rb'),
+            'gz': (gzip.GzipFile, 'rb'),
+            'zip': (loaddata.SingleZipReader, 'r'),
+            'stdin': (lambda *args: sys.stdin, None),
         }
         if has_bz2:
-            compression_types['bz2'] = bz2.BZ2File
+            self.compression_formats['bz2'] = (bz2.BZ2File, 'r')
 
-        app_fixtures = [os.path.join(os.path.dirname(app.__file__), 'fixtures') for app in get_apps()]
         for fixture_label in fixture_labels:
-            parts = fixture_label.split('.')
-
-            if len(parts) > 1 and parts[-1] in compression_types:
-                compression_formats = [parts[-1]]
-                parts = parts[:-1]
-            else:
-                compression_formats = compression_types.keys()
-
-            if len(parts) == 1:
-                fixture_name = parts[0]
-                formats = serializers.get_public_serializer_formats()
-            else:
-                fixture_name, format = '.'.join(parts[:-1]), parts[-1]
-                if format in serializers.get_public_serializer_formats():
-                    formats = [format]
-                else:
-                    formats = []
-
-            if formats:
-                if verbosity > 1:
-                    print("Loading '%s' fixtures..." % fixture_name)
-            else:
-                self.enable_forward_ref_checks(cursor)
-                sys.stderr.write(
-                    self.style.ERROR("Problem installing fixture '%s': %s is not a known serialization format." %
-                        (fixture_name, format)))
-                transaction.rollback()
-                transaction.leave_transaction_management()
-                return
-
-            if os.path.isabs(fixture_name):
-                fixture_dirs = [fixture_name]
-            else:
-                fixture_dirs = app_fixtures + list(settings.FIXTURE_DIRS) + ['']
-
-            for fixture_dir in fixture_dirs:
-                if verbosity > 1:
-                    print("Checking %s for fixtures..." % humanize(fixture_dir))
-
-                label_found = False
-                for format in formats:
-                    for compression_format in compression_formats:
-                        if compression_format:
-                            file_name = '.'.join([fixture_name, format,
-                                                  compression_format])
-                        else:
-                            file_name = '.'.join([fixture_name, format])
-
-                        if verbosity > 1:
-                            print("Trying %s for %s fixture '%s'..." % \
-                                (humanize(fixture_dir), file_name, fixture_name))
-                        full_path = os.path.join(fixture_dir, file_name)
-                        open_method = compression_types[compression_format]
-                        try:
-                            fixture = open_method(full_path, 'r')
-                            if label_found:
-                                fixture.close()
-                                self.enable_forward_ref_checks(cursor)
-                                print(self.style.ERROR("Multiple fixtures named '%s' in %s. Aborting." %
-                                    (fixture_name, humanize(fixture_dir))))
-                                transaction.rollback()
-                                transaction.leave_transaction_management()
-                                return
-                            else:
-                                fixture_count += 1
-                                objects_in_fixture = 0
-                                if verbosity > 0:
-                                    print("Installing %s fixture '%s' from %s." % \
-                                        (format, fixture_name, humanize(fixture_dir)))
-                                try:
-                                    objects = serializers.deserialize(format, fixture)
-                                    for obj in objects:
-                                        objects_in_fixture += 1
-                                        self.handle_ref_checks(cursor, obj)
-                                        models.add(obj.object.__class__)
-                                        obj.save()
-                                    object_count += objects_in_fixture
-                                    label_found = True
-                                except (SystemExit, KeyboardInterrupt):
-                                    self.enable_forward_ref_checks(cursor)
-                                    raise
-                                except Exception:
-                                    import traceback
-                                    fixture.close()
-                                    self.enable_forward_ref_checks(cursor)
-                                    transaction.rollback()
-                                    transaction.leave_transaction_management()
-                                    if show_traceback:
-                                        traceback.print_exc()
-                                    else:
-                                        sys.stderr.write(
-                                            self.style.ERROR("Problem installing fixture '%s': %s\n" %
-                                                 (full_path, ''.join(traceback.format_exception(sys.exc_type,
-                                                     sys.exc_value, sys.exc_traceback)))))
-                                    return
-                                fixture.close()
-
-                                # If the fixture we loaded contains 0 objects, assume that an
-                                # error was encountered during fixture loading.
-                                if objects_in_fixture == 0:
-                                    self.enable_forward_ref_checks(cursor)
-                                    sys.stderr.write(
-                                        self.style.ERROR("No fixture data found for '%s'. (File format may be invalid.)" %
-                                            (fixture_name)))
-                                    transaction.rollback()
-                                    transaction.leave_transaction_management()
-                                    return
-
-                        except Exception as e:
-                            if verbosity > 1:
-                                print("No %s fixture '%s' in %s." % \
-                                    (format, fixture_name, humanize(fixture_dir)))
-
-        self.enable_forward_ref_checks(cursor)
-
-        # If we found even one object in a fixture, we need to reset the
-        # database sequences.
-        if object_count > 0:
-            sequence_sql = connection.ops.sequence_reset_sql(self.style, models)
-            if sequence_sql:
-                if verbosity > 1:
-                    print("Resetting sequences")
-                for line in sequence_sql:
-                    cursor.execute(line)
-
-        if commit:
-            transaction.commit()
-            transaction.leave_transaction_management()
-
-        if object_count == 0:
-            if verbosity > 1:
-                print("No fixtures found.")
+            if self.find_fixtures(fixture_label):
+                break
         else:
-            if verbosity > 0:
-                print("Installed %d object(s) from %d fixture(s)" % (object_count, fixture_count))
-
-        # Close the DB connection. This is required as a workaround for an
-        # edge case in MySQL: if the same connection is used to
-        # create tables, load data, and query, the query can return
-        # incorrect results. See Django #7572, MySQL #37735.
-        if commit:
-            connection.close()
-
-    def disable_forward_ref_checks(self):
-        self.in_disabled_constraints = True
-
-    def enable_forward_ref_checks(self, cursor):
-        # re-activate constraint checks for any remaining table
-        # and force a check
-        # See also 'DBCC CHECKCONSTRAINTS(%s) WITH NO_INFOMSGS'
-        for t in self.tables:
-            cursor.execute('ALTER TABLE [%s] WITH CHECK CHECK CONSTRAINT ALL' % t)
-        self.tables.clear()
-        self.in_disabled_constraints = False
-
-    def handle_ref_checks(self, cursor, obj):
-        mobj = obj.object
-        if self.in_disabled_constraints:
-            # Should we re-activate constraint checks for any table back?
-            #if self.model_name is not None and mobj.__class__ != self.model_name:
-            #    for t in self.tables:
-            #        cursor.execute('ALTER TABLE [%s] WITH CHECK CHECK CONSTRAINT ALL' % t)
-            #    self.tables.clear()
-
-            # A model transition is underway in the fixture
-            if self.model_name is None or mobj.__class__ != self.model_name:
-                # Should we de-activate constraint checks for any table?. Check
-                # if the model has any FK defined
-                has_outgoing_fks = False
-                for f in mobj._meta.fields:
-                    if f.rel:
-                        has_outgoing_fks = True
-                # Also check for m2m fields and take in account its intermediate tables
-                # XXX: What about _meta.many_to_many?
-                # XXX: Take in account the m2m with 'through' option case
-                for f in mobj._meta.local_many_to_many:
-                    cursor.execute('ALTER TABLE [%s] NOCHECK CONSTRAINT ALL' % f.m2m_db_table())
-                    self.tables.add(f.m2m_db_table())
-
-                if has_outgoing_fks:
-                    cursor.execute('ALTER TABLE [%s] NOCHECK CONSTRAINT ALL' % mobj._meta.db_table)
-                    self.tables.add(mobj._meta.db_table)
-        self.model_name = mobj.__class__
+            return
+
+        try:
+            for fixture_label in fixture_labels:
+                self.load_label(fixture_label)
+        finally:
+            connection._set_identity_insert(None)
+            for _ in range(self.disable_count):
+                connection.enable_constraint_checking()
+
+        # Only the tables loaded into had their constraints disabled.
+        try:
+            connection.check_constraints(table_names=self.disabled_tables)
+        except Exception as e:
+            e.args = ("Problem installing fixtures: %s" % e,)
+            raise
+
+        if self.loaded_object_count > 0:
+            sequence_sql = connection.ops.sequence_reset_sql(no_style(), self.models)
+            if sequence_sql:
+                if self.verbosity >= 2:
+                    self.stdout.write("Resetting sequences\n")
+                with connection.cursor() as cursor:
+                    for line in sequence_sql:
+                        cursor.execute(line)
+
+        if self.verbosity >= 1:
+            if self.fixture_object_count == self.loaded_object_count:
+                self.stdout.write(
+                    "Installed %d object(s) from %d fixture(s)"
+                    % (self.loaded_object_count, self.fixture_count)
+                )
+            else:
+                self.stdout.write(
+                    "Installed %d object(s) (of %d) from %d fixture(s)"
+                    % (self.loaded_object_count, self.fixture_object_count, self.fixture_count)
+                )
+
+    def load_label(self, fixture_label):
+        """Load fixtures files for a given label."""
+        show_progress = self.verbosity >= 3
+        for fixture_file, fixture_dir, fixture_name in self.find_fixtures(fixture_label):
+            _, ser_fmt, cmp_fmt = self.parse_name(os.path.basename(fixture_file))
+            open_method, mode = self.compression_formats[cmp_fmt]
+            fixture = open_method(fixture_file, mode)
+            try:
+                self.fixture_count += 1
+                objects_in_fixture = 0
+                loaded_objects_in_fixture = 0
+                if self.verbosity >= 2:
+                    self.stdout.write(
+                        "Installing %s fixture '%s' from %s."
+                        % (ser_fmt, fixture_name, loaddata.humanize(fixture_dir))
+                    )
+
+                objects = serializers.deserialize(
+                    ser_fmt, fixture, using=self.using, ignorenonexistent=self.ignore,
+                )
+
+                # Consecutive objects of the same model, not saved yet.
+                batch = []
+                for obj in objects:
+                    objects_in_fixture += 1
+                    model = type(obj.object)
+                    if (obj.object._meta.app_config in self.excluded_apps or
+                            model in self.excluded_models):
+                        continue
+                    if router.allow_migrate_model(self.using, model):
+                        loaded_objects_in_fixture += 1
+                        if batch and (type(batch[0].object) is not model or len(batch) >= self.batch_size):
+                            self.save_batch(batch)
+                            batch = []
+                        batch.append(obj)
+                        if show_progress:
+                            self.stdout.write(
+                                '\rProcessed %i object(s).' % loaded_objects_in_fixture,
+                                ending=''
+                            )
+                if batch:
+                    self.save_batch(batch)
+                if objects and show_progress:
+                    self.stdout.write('')  # add a newline after progress indicator
+                self.loaded_object_count += loaded_objects_in_fixture
+                self.fixture_object_count += objects_in_fixture
+            except Exception as e:
+                if not isinstance(e, CommandError):
+                    e.args = ("Problem installing fixture '%s': %s" % (fixture_file, e),)
+                raise
+            finally:
+                fixture.close()
+
+            # Warn if the fixture we loaded contains 0 objects.
+            if objects_in_fixture == 0:
+                warnings.warn(
+                    "No fixture data found for '%s'. (File format may be "
+                    "invalid.)" % fixture_name,
+                    RuntimeWarning
+                )
+
+    def disable_constraints(self, model):
+        """
+        Disables the constraints of the model's table, and of the tables of
+        its many-to-many relations, the first time the model is loaded.
+        """
+        connection = connections[self.using]
+        meta = model._meta.concrete_model._meta
+        tables = [meta.db_table] + [
+            f.remote_field.through._meta.db_table for f in meta.local_many_to_many
+            if f.remote_field.through._meta.auto_created
+        ]
+        tables = [table for table in tables if table not in self.disabled_tables]
+        if tables:
+            connection.disable_constraint_checking(tables)
+            self.disable_count += 1
+            self.disabled_tables.extend(tables)
+
+    def save_batch(self, batch):
+        """
+        Saves deserialized objects of a single model.
+        """
+        connection = connections[self.using]
+        origin = type(batch[0].object)
+        model = origin._meta.concrete_model
+        meta = model._meta
+        self.models.add(origin)
+        self.disable_constraints(origin)
+
+        pks = [obj.object.pk for obj in batch if obj.object.pk is not None]
+        existing = set()
+        if pks:
+            existing = set(model._base_manager.using(self.using).filter(pk__in=pks).values_list('pk', flat=True))
+        new = [obj for obj in batch if obj.object.pk is not None and obj.object.pk not in existing]
+        others = [obj for obj in batch if obj.object.pk is None or obj.object.pk in existing]
+
+        try:
+            if others:
+                # A plain INSERT fails while IDENTITY_INSERT is on.
+                connection._set_identity_insert(None)
+                for obj in others:
+                    obj.save(using=self.using)
+            if new:
+                self.insert_objects(origin, [obj.object for obj in new])
+                self.insert_m2m(model, new)
+        except (DatabaseError, IntegrityError) as e:
+            e.args = ("Could not load %(app_label)s.%(object_name)s: %(error_msg)s" % {
+                'app_label': meta.app_label,
+                'object_name': origin._meta.object_name,
+                'error_msg': e,
+            },)
+            raise
+
+    def insert_objects(self, origin, objs):
+        connection = connections[self.using]
+        model = origin._meta.concrete_model
+        meta = model._meta
+        if not meta.auto_created:
+            for obj in objs:
+                signals.pre_save.send(sender=origin, instance=obj, raw=True, using=self.using, update_fields=None)
+
+        fields = meta.local_concrete_fields
+        if meta.auto_field is not None:
+            connection._set_identity_insert(meta.db_table)
+        batch_size = connection.ops.bulk_batch_size(fields, objs)
+        for i in range(0, len(objs), batch_size):
+            model._base_manager._insert(objs[i:i + batch_size], fields=fields, using=self.using, raw=True)
+
+        for obj in objs:
+            obj._state.adding = False
+            obj._state.db = self.using
+            if not meta.auto_created:
+                signals.post_save.send(
+                    sender=origin, instance=obj, created=True, update_fields=None, raw=True, using=self.using,
+                )
+
+    def insert_m2m(self, model, deserialized_objects):
+        """
+        Inserts the rows of the auto-created many-to-many tables for newly
+        inserted objects; explicit through models are set() as loaddata does.
+        """
+        for field in model._meta.local_many_to_many:
+            through = field.remote_field.through
+            rows = []
+            for obj in deserialized_objects:
+                if not obj.m2m_data or field.name not in obj.m2m_data:
+                    continue
+                if not through._meta.auto_created:
+                    getattr(obj.object, field.name).set(obj.m2m_data[field.name])
+                    continue
+                source = through._meta.get_field(field.m2m_field_name()).attname
+                target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                for pk in obj.m2m_data[field.name]:
+                    rows.append(through(**{source: obj.object.pk, target: pk}))
+            if rows:
+                through._base_manager.using(self.using).bulk_create(rows)
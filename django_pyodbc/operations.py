@@ -42,7 +42,9 @@
 
 import datetime
 import decimal
+import threading
 import time
+import warnings
 try:
     import pytz
 except:
@@ -57,9 +59,37 @@ except ImportError:
 from django.utils.dateparse import parse_date, parse_time, parse_datetime
 
 
-from django_pyodbc.compat import smart_text, string_types, timezone
+from django_pyodbc.compat import smart_text, string_types, text_type, timezone
+from django_pyodbc.partitioning import parse_partition_scheme
 
+# SERVERPROPERTY('EngineEdition'); Enterprise also covers Developer edition.
+EDITION_ENTERPRISE = 3
 EDITION_AZURE_SQL_DB = 5
+EDITION_AZURE_SQL_MI = 8
+
+# Ranges of sequence values handed out by sp_sequence_get_range, shared by
+# the connections of the process: {(alias, sequence): [next, last]}.
+_sequence_ranges = {}
+_sequence_lock = threading.Lock()
+
+
+class VarCharParam(text_type):
+    """
+    A string parameter bound as varchar instead of nvarchar, for comparisons
+    with varchar columns.
+    """
+
+
+class DateTimeParam(datetime.datetime):
+    """
+    A datetime parameter bound as datetime instead of datetime2, for
+    comparisons with datetime columns.
+    """
+    @classmethod
+    def from_datetime(cls, value):
+        # datetime keeps milliseconds at most.
+        return cls(value.year, value.month, value.day, value.hour, value.minute,
+                   value.second, value.microsecond // 1000 * 1000, value.tzinfo)
 
 class DatabaseOperations(BaseDatabaseOperations):
     compiler_module = "django_pyodbc.compiler"
@@ -72,6 +102,8 @@ class DatabaseOperations(BaseDatabaseOperations):
         self.connection = connection
         self._ss_ver = None
         self._ss_edition = None
+        self._foreign_keys = None
+        self._db_collation = None
         self._is_db2 = None
         self._is_openedge = None
         self._left_sql_quote = None
@@ -127,7 +159,7 @@ class DatabaseOperations(BaseDatabaseOperations):
         """
         if self._ss_ver is not None:
             return self._ss_ver
-        cur = self.connection.cursor()
+        cur = self.connection._internal_cursor()
         ver_code = None
         if not self.is_db2 and not self.is_openedge:
             cur.execute("SELECT CAST(SERVERPROPERTY('ProductVersion') as varchar)")
@@ -135,7 +167,17 @@ class DatabaseOperations(BaseDatabaseOperations):
             ver_code = int(ver_code.split('.')[0])
         else:
             ver_code = 0
-        if ver_code >= 11:
+        if ver_code >= 16:
+            self._ss_ver = 2022
+        elif ver_code == 15:
+            self._ss_ver = 2019
+        elif ver_code == 14:
+            self._ss_ver = 2017
+        elif ver_code == 13:
+            self._ss_ver = 2016
+        elif ver_code == 12:
+            self._ss_ver = 2014
+        elif ver_code == 11:
             self._ss_ver = 2012
         elif ver_code == 10:
             self._ss_ver = 2008
@@ -146,13 +188,56 @@ class DatabaseOperations(BaseDatabaseOperations):
         return self._ss_ver
     sql_server_ver = property(_get_sql_server_ver)
 
+    def _get_engine_edition(self):
+        if self._ss_edition is None:
+            cur = self.connection._internal_cursor()
+            cur.execute("SELECT CAST(SERVERPROPERTY('EngineEdition') as integer)")
+            self._ss_edition = cur.fetchone()[0]
+        return self._ss_edition
+    engine_edition = property(_get_engine_edition)
+
+    def _get_database_collation(self):
+        if self._db_collation is None:
+            cur = self.connection._internal_cursor()
+            cur.execute("SELECT CONVERT(nvarchar(128), DATABASEPROPERTYEX(DB_NAME(), 'Collation'))")
+            self._db_collation = cur.fetchone()[0]
+        return self._db_collation
+    database_collation = property(_get_database_collation)
+
+    def is_case_insensitive(self, collation):
+        """
+        Tells whether comparisons under the named collation ignore case.
+        """
+        return bool(collation) and '_CI_' in collation.upper() + '_'
+
+    def typed_lookup_params(self, lookup, column_type, params):
+        """
+        Returns the parameters of a lookup on a column of the given sys.types
+        type, with the strings and datetimes compared with varchar and
+        datetime columns typed like them. With only warn_column_type_mismatch
+        on, warns about them instead.
+        """
+        if column_type in ('char', 'varchar', 'text'):
+            param_type, convert = text_type, VarCharParam
+        elif column_type in ('datetime', 'smalldatetime'):
+            param_type, convert = datetime.datetime, DateTimeParam.from_datetime
+        else:
+            return params
+        mismatched = [isinstance(p, param_type) and not isinstance(p, (VarCharParam, DateTimeParam)) for p in params]
+        if not any(mismatched):
+            return params
+        if not self.connection.match_column_types:
+            target = lookup.lhs.target
+            warnings.warn(
+                "The %s lookup on %s.%s binds a parameter of a different type than "
+                "the %s column, which makes SQL Server convert the column." % (
+                    lookup.lookup_name, target.model._meta.db_table, target.column, column_type),
+                RuntimeWarning)
+            return params
+        return [convert(p) if m else p for p, m in zip(params, mismatched)]
+
     def _on_azure_sql_db(self):
-        if self._ss_edition is not None:
-            return self._ss_edition == EDITION_AZURE_SQL_DB
-        cur = self.connection.cursor()
-        cur.execute("SELECT CAST(SERVERPROPERTY('EngineEdition') as integer)")
-        self._ss_edition = cur.fetchone()[0]
-        return self._ss_edition == EDITION_AZURE_SQL_DB
+        return self.engine_edition == EDITION_AZURE_SQL_DB
     on_azure_sql_db = property(_on_azure_sql_db)
 
     def date_extract_sql(self, lookup_type, field_name):
@@ -162,17 +247,24 @@ class DatabaseOperations(BaseDatabaseOperations):
         """
         if lookup_type == 'week_day':
             return "DATEPART(dw, %s)" % field_name
+        elif lookup_type == 'week':
+            return "DATEPART(iso_week, %s)" % field_name
         else:
             return "DATEPART(%s, %s)" % (lookup_type, field_name)
 
     def date_trunc_sql(self, lookup_type, field_name):
+        if self.sql_server_ver >= 2022:
+            return "DATETRUNC(%s, %s)" % (lookup_type, field_name)
         return "DATEADD(%s, DATEDIFF(%s, 0, %s), 0)" % (lookup_type, lookup_type, field_name)
 
     def _switch_tz_offset_sql(self, field_name, tzname):
         """
-        Returns the SQL that will convert field_name to UTC from tzname.
+        Returns the SQL that will convert field_name from UTC to tzname.
+
+        The offset is added as a number of minutes, which keeps the column's
+        type and costs less than going through datetimeoffset. Filters on
+        truncated datetimes don't get here; see django_pyodbc.functions.
         """
-        field_name = self.quote_name(field_name)
         if settings.USE_TZ:
             if pytz is None:
                 from django.core.exceptions import ImproperlyConfigured
@@ -180,41 +272,47 @@ class DatabaseOperations(BaseDatabaseOperations):
                                            "but it isn't installed.")
             tz = pytz.timezone(tzname)
             td = tz.utcoffset(datetime.datetime(2000, 1, 1))
+            total_minutes = (td.days * 24 * 60 * 60 + td.seconds) // 60
+            if total_minutes:
+                field_name = "DATEADD(minute, %d, %s)" % (total_minutes, field_name)
+        return field_name
 
-            def total_seconds(td):
-                if hasattr(td, 'total_seconds'):
-                    return td.total_seconds()
-                else:
-                    return td.days * 24 * 60 * 60 + td.seconds
+    def datetime_cast_date_sql(self, field_name, tzname):
+        field_name = self._switch_tz_offset_sql(field_name, tzname)
+        if self.sql_server_ver >= 2008:
+            return "CAST(%s AS date)" % field_name
+        return "DATEADD(day, DATEDIFF(day, 0, %s), 0)" % field_name
 
-            total_minutes = total_seconds(td) // 60
-            hours, minutes = divmod(total_minutes, 60)
-            tzoffset = "%+03d:%02d" % (hours, minutes)
-            field_name = "CAST(SWITCHOFFSET(TODATETIMEOFFSET(%s, '+00:00'), '%s') AS DATETIME2)" % (field_name, tzoffset)
-        return field_name
+    def datetime_cast_time_sql(self, field_name, tzname):
+        field_name = self._switch_tz_offset_sql(field_name, tzname)
+        return "CAST(%s AS time)" % field_name
+
+    def datetime_extract_sql(self, lookup_type, field_name, tzname):
+        field_name = self._switch_tz_offset_sql(field_name, tzname)
+        return self.date_extract_sql(lookup_type, field_name)
 
     def datetime_trunc_sql(self, lookup_type, field_name, tzname):
         """
         Given a lookup_type of 'year', 'month', 'day', 'hour', 'minute' or
         'second', returns the SQL that truncates the given datetime field
-        field_name to a datetime object with only the given specificity, and
-        a tuple of parameters.
+        field_name to a datetime object with only the given specificity.
         """
-        field_name = self._switch_tz_offset_sql(field_name, tzname)
-        reference_date = '0' # 1900-01-01
-        if lookup_type in ['minute', 'second']:
-            # Prevent DATEDIFF overflow by using the first day of the year as
-            # the reference point. Only using for minute and second to avoid any
-            # potential performance hit for queries against very large datasets.
-            reference_date = "CONVERT(datetime2, CONVERT(char(4), {field_name}, 112) + '0101', 112)".format(
-                field_name=field_name,
-            )
-        sql = "DATEADD({lookup}, DATEDIFF({lookup}, {reference_date}, {field_name}), {reference_date})".format(
-            lookup=lookup_type,
-            field_name=field_name,
-            reference_date=reference_date,
-        )
-        return sql, []
+        return self._datetime_trunc_sql(lookup_type, self._switch_tz_offset_sql(field_name, tzname))
+
+    def _datetime_trunc_sql(self, lookup_type, field_name):
+        if self.sql_server_ver >= 2022:
+            return "DATETRUNC(%s, %s)" % (lookup_type, field_name)
+        if lookup_type == 'second':
+            # Seconds since 1900 overflow DATEDIFF's int, so count them from
+            # the start of the day.
+            day = "DATEADD(day, DATEDIFF(day, 0, %s), 0)" % field_name
+            return "DATEADD(second, DATEDIFF(second, {day}, {field}), {day})".format(day=day, field=field_name)
+        return "DATEADD({lookup}, DATEDIFF({lookup}, 0, {field}), 0)".format(lookup=lookup_type, field=field_name)
+
+    def time_trunc_sql(self, lookup_type, field_name):
+        if self.sql_server_ver >= 2022:
+            return "DATETRUNC(%s, %s)" % (lookup_type, field_name)
+        return "CAST(%s AS time)" % self._datetime_trunc_sql(lookup_type, "CAST(%s AS datetime)" % field_name)
 
     def field_cast_sql(self, db_type, internal_type=None):
         """
@@ -264,12 +362,59 @@ class DatabaseOperations(BaseDatabaseOperations):
         cursor.execute("SELECT CAST(IDENT_CURRENT(%s) as bigint)", [table_name])
         return cursor.fetchone()[0]
 
+    def bulk_batch_size(self, fields, objs):
+        """
+        SQL Server takes at most 1000 rows in a VALUES list and 2100 parameters
+        in a statement.
+        """
+        if not fields:
+            return 1000
+        return max(min(1000, 2100 // len(fields)), 1)
+
+    def bulk_insert_sql(self, fields, placeholder_rows):
+        return "VALUES " + ", ".join("(%s)" % ", ".join(row) for row in placeholder_rows)
+
+    def next_sequence_value(self, sequence_name, range_size):
+        """
+        Returns the next value of a sequence, taken from a range of range_size
+        values reserved at once for the whole process.
+        """
+        key = (self.connection.alias, sequence_name)
+        with _sequence_lock:
+            reserved = _sequence_ranges.get(key)
+            if reserved is None or reserved[0] > reserved[1]:
+                cursor = self.connection._internal_cursor()
+                cursor.execute(
+                    "DECLARE @first sql_variant; "
+                    "EXEC sp_sequence_get_range @sequence_name = %s, @range_size = %s, "
+                    "@range_first_value = @first OUTPUT; "
+                    "SELECT CAST(@first AS bigint)",
+                    [self.quote_name(sequence_name), range_size])
+                first = int(cursor.fetchone()[0])
+                # The sequences are created with INCREMENT BY 1.
+                reserved = _sequence_ranges[key] = [first, first + range_size - 1]
+            value = reserved[0]
+            reserved[0] += 1
+        return value
+
+    def forget_sequence_range(self, sequence_name):
+        """
+        Drops what's left of the range reserved from a sequence, once it's
+        dropped, renamed or restarted and its values don't follow on anymore.
+        """
+        with _sequence_lock:
+            _sequence_ranges.pop((self.connection.alias, sequence_name), None)
+
     def fetch_returned_insert_id(self, cursor):
         """
         Given a cursor object that has just performed an INSERT/OUTPUT statement
         into a table that has an auto-incrementing ID, returns the newly created
         ID.
         """
+        # With SCOPE_IDENTITY() the INSERT, and the triggers it fired, report
+        # their row counts before the SELECT.
+        while cursor.description is None and cursor.nextset():
+            pass
         return cursor.fetchone()[0]
 
     def lookup_cast(self, lookup_type, internal_type=None):
@@ -327,6 +472,19 @@ class DatabaseOperations(BaseDatabaseOperations):
        """
        return "ROLLBACK TRANSACTION %s" % sid
 
+    def _get_foreign_keys(self):
+        """
+        Returns a list of (table, constraint_name, referenced_table) for every
+        foreign key of the database. The list is cached until the schema
+        editor changes the schema.
+        """
+        if self._foreign_keys is None:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT OBJECT_NAME(parent_object_id), name, OBJECT_NAME(referenced_object_id) "
+                           "FROM sys.foreign_keys")
+            self._foreign_keys = [tuple(row) for row in cursor.fetchall()]
+        return self._foreign_keys
+
     def sql_flush(self, style, tables, sequences, allow_cascade=False):
         """
         Returns a list of SQL statements required to remove all data from
@@ -336,53 +494,74 @@ class DatabaseOperations(BaseDatabaseOperations):
         The `style` argument is a Style object as returned by either
         color_style() or no_style() in django.core.management.color.
         """
-        if tables:
-            # Cannot use TRUNCATE on tables that are referenced by a FOREIGN KEY
-            # So must use the much slower DELETE
-            from django.db import connections
-            cursor = connections[self.connection.alias].cursor()
-            # Try to minimize the risks of the braindeaded inconsistency in
-            # DBCC CHEKIDENT(table, RESEED, n) behavior.
-            seqs = []
-            for seq in sequences:
-                cursor.execute("SELECT COUNT(*) FROM %s" % self.quote_name(seq["table"]))
-                rowcnt = cursor.fetchone()[0]
-                elem = {}
-                if rowcnt:
-                    elem['start_id'] = 0
-                else:
-                    elem['start_id'] = 1
-                elem.update(seq)
-                seqs.append(elem)
-            cursor.execute("SELECT TABLE_NAME, CONSTRAINT_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS WHERE CONSTRAINT_TYPE not in ('PRIMARY KEY','UNIQUE')")
-            fks = cursor.fetchall()
-            sql_list = ['ALTER TABLE %s NOCHECK CONSTRAINT %s;' % \
-                    (self.quote_name(fk[0]), self.quote_name(fk[1])) for fk in fks]
-            sql_list.extend(['%s %s %s;' % (style.SQL_KEYWORD('DELETE'), style.SQL_KEYWORD('FROM'),
-                             style.SQL_FIELD(self.quote_name(table)) ) for table in tables])
+        if not tables:
+            return []
+        flushed = set(table.lower() for table in tables)
+        # Cannot use TRUNCATE on tables that are referenced by a FOREIGN KEY,
+        # so those are emptied with the much slower DELETE, with the foreign
+        # keys pointing at them switched off meanwhile.
+        referenced = set()
+        disabled = {}
+        for table, name, referenced_table in self._get_foreign_keys():
+            referenced.add(referenced_table.lower())
+            if referenced_table.lower() in flushed:
+                disabled.setdefault(table, []).append(name)
+
+        sql_list = ['%s %s %s %s;' % (
+            style.SQL_KEYWORD('ALTER TABLE'),
+            style.SQL_FIELD(self.quote_name(table)),
+            style.SQL_KEYWORD('NOCHECK CONSTRAINT'),
+            ', '.join(self.quote_name(name) for name in names),
+            ) for table, names in sorted(disabled.items())]
+        deleted = []
+        for table in tables:
+            if table.lower() in referenced:
+                deleted.append(table)
+                sql_list.append('%s %s;' % (style.SQL_KEYWORD('DELETE FROM'), style.SQL_FIELD(self.quote_name(table))))
+            else:
+                # TRUNCATE also resets the identity column.
+                sql_list.append('%s %s;' % (style.SQL_KEYWORD('TRUNCATE TABLE'), style.SQL_FIELD(self.quote_name(table))))
 
+        reseed = set(seq['table'].lower() for seq in sequences) & set(table.lower() for table in deleted)
+        if reseed:
             if self.on_azure_sql_db:
                 import warnings
                 warnings.warn("The identity columns will never be reset " \
                               "on Windows Azure SQL Database.",
                               RuntimeWarning)
             else:
-                # Then reset the counters on each table.
-                sql_list.extend(['%s %s (%s, %s, %s) %s %s;' % (
-                    style.SQL_KEYWORD('DBCC'),
-                    style.SQL_KEYWORD('CHECKIDENT'),
-                    style.SQL_FIELD(self.quote_name(seq["table"])),
-                    style.SQL_KEYWORD('RESEED'),
-                    style.SQL_FIELD('%d' % seq['start_id']),
-                    style.SQL_KEYWORD('WITH'),
-                    style.SQL_KEYWORD('NO_INFOMSGS'),
-                    ) for seq in seqs])
-
-            sql_list.extend(['ALTER TABLE %s CHECK CONSTRAINT %s;' % \
-                    (self.quote_name(fk[0]), self.quote_name(fk[1])) for fk in fks])
-            return sql_list
-        else:
-            return []
+                # Then reset the counters of the emptied tables. After
+                # DBCC CHECKIDENT (table, RESEED, n) the next value is n + 1,
+                # except on a table that never had a row, where it's n;
+                # last_value tells the two apart on the server.
+                sql_list.append(
+                    "DECLARE @reseed nvarchar(max); SET @reseed = N''; "
+                    "SELECT @reseed = @reseed + N'DBCC CHECKIDENT (' + "
+                    "QUOTENAME(QUOTENAME(OBJECT_NAME(object_id)), '''') + N', RESEED, ' + "
+                    "CASE WHEN last_value IS NULL THEN N'1' ELSE N'0' END + N') WITH NO_INFOMSGS; ' "
+                    "FROM sys.identity_columns WHERE object_id IN (%s); "
+                    "EXEC sp_executesql @reseed;" % ', '.join(
+                        "OBJECT_ID(N'%s')" % self.quote_name(table).replace("'", "''")
+                        for table in sorted(reseed)))
+
+        sql_list.extend(['%s %s %s %s;' % (
+            style.SQL_KEYWORD('ALTER TABLE'),
+            style.SQL_FIELD(self.quote_name(table)),
+            style.SQL_KEYWORD('CHECK CONSTRAINT'),
+            ', '.join(self.quote_name(name) for name in names),
+            ) for table, names in sorted(disabled.items())])
+        return sql_list
+
+    def execute_sql_flush(self, using, sql_list):
+        """
+        Runs the flush statements as a single batch.
+        """
+        from django.db import transaction
+        if not sql_list:
+            return
+        with transaction.atomic(using=using, savepoint=self.connection.features.can_rollback_ddl):
+            with self.connection.cursor() as cursor:
+                cursor.execute('\n'.join(sql_list))
 
     #def sequence_reset_sql(self, style, model_list):
     #    """
@@ -416,6 +595,13 @@ class DatabaseOperations(BaseDatabaseOperations):
         """
         return "ON %s" % self.quote_name(tablespace)
 
+    def tablespace_sql(self, tablespace, inline=False):
+        # A tablespace of the form 'scheme(column)' is a partition scheme.
+        partition_scheme = parse_partition_scheme(tablespace)
+        if partition_scheme:
+            return "ON %s(%s)" % tuple(self.quote_name(name) for name in partition_scheme)
+        return self.sql_for_tablespace(tablespace, inline)
+
     def prep_for_like_query(self, x):
         """Prepares a value for use in a LIKE query."""
         # http://msdn2.microsoft.com/en-us/library/ms179859.aspx
@@ -455,72 +641,87 @@ class DatabaseOperations(BaseDatabaseOperations):
             return datetime.datetime(*(time.strptime(value, '%H:%M:%S')[:6]))
         return datetime.datetime(1900, 1, 1, value.hour, value.minute, value.second)
 
-    def year_lookup_bounds(self, value):
-        """
-        Returns a two-elements list with the lower and upper bound to be used
-        with a BETWEEN operator to query a field value using a year lookup
-
-        `value` is an int, containing the looked-up year.
-        """
-        first = '%s-01-01 00:00:00'
-        # SQL Server doesn't support microseconds
-        last = '%s-12-31 23:59:59'
-        return [first % value, last % value]
-
     def adapt_decimalfield_value(self, value, max_digits, decimal_places):
         """
         Transform a decimal.Decimal value to an object compatible with what is
         expected by the backend driver for decimal (numeric) columns.
+
+        The value stays a Decimal, rounded to the field's decimal places, so
+        that it's bound as a decimal with the field's scale.
         """
         if value is None:
             return None
-        if isinstance(value, decimal.Decimal):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value))
+        if decimal_places is not None:
             context = decimal.getcontext().copy()
-            context.prec = max_digits
-            #context.rounding = ROUND_FLOOR
-            return "%.*f" % (decimal_places + 1, value.quantize(decimal.Decimal(".1") ** decimal_places, context=context))
-        else:
-            return "%.*f" % (decimal_places + 1, value)
+            if max_digits is not None:
+                context.prec = max_digits
+            value = value.quantize(decimal.Decimal(1).scaleb(-decimal_places), context=context)
+        return value
+
+    def get_db_converters(self, expression):
+        """
+        Returns the converters for a selected column, looked up once per query
+        rather than per value. Columns of other types are returned as fetched.
+        """
+        converters = super(DatabaseOperations, self).get_db_converters(expression)
+        internal_type = expression.output_field.get_internal_type()
+        converter = self._db_converters.get(internal_type)
+        if converter is not None and (self._driver_returns_strings() or (
+                internal_type in ('DateField', 'TimeField') and self.sql_server_ver < 2008)):
+            converters.append(getattr(self, converter))
+        return converters
+
+    def _driver_returns_strings(self):
+        # The legacy SQL Server driver and FreeTDS return the types added in
+        # SQL Server 2008 as strings.
+        drv_name = self.connection.drv_name or ''
+        return drv_name == 'SQLSRV32.DLL' or drv_name.startswith('LIBTDSODBC')
+
+    # SQL Server < 2008 has no separate date and time types, and older ODBC
+    # drivers return the newer ones as strings.
+    _db_converters = {
+        'DateTimeField': 'convert_datetimefield_value',
+        'DateField': 'convert_datefield_value',
+        'TimeField': 'convert_timefield_value',
+        'FloatField': 'convert_floatfield_value',
+    }
+
+    def convert_datetimefield_value(self, value, expression, connection):
+        if value and isinstance(value, string_types):
+            value = parse_datetime(value)
+        return value
+
+    def convert_datefield_value(self, value, expression, connection):
+        if isinstance(value, datetime.datetime):
+            value = value.date()
+        elif value and isinstance(value, string_types):
+            value = parse_date(value)
+        return value
+
+    def convert_timefield_value(self, value, expression, connection):
+        if isinstance(value, datetime.datetime) and value.year == 1900 and value.month == value.day == 1:
+            value = value.time()
+        elif value and isinstance(value, string_types):
+            value = parse_time(value)
+        return value
+
+    def convert_floatfield_value(self, value, expression, connection):
+        if value is not None:
+            value = float(value)
+        return value
 
     def convert_values(self, value, field):
         """
         Coerce the value returned by the database backend into a consistent
         type that is compatible with the field type.
-
-        In our case, cater for the fact that SQL Server < 2008 has no
-        separate Date and Time data types.
-        TODO: See how we'll handle this for SQL Server >= 2008
         """
-        if value is None:
-            return None
-        if field and field.get_internal_type() == 'DateTimeField':
-            if isinstance(value, string_types) and value:
-                value = parse_datetime(value)
+        if value is None or field is None:
             return value
-        elif field and field.get_internal_type() == 'DateField':
-            if isinstance(value, datetime.datetime):
-                value = value.date() # extract date
-            elif isinstance(value, string_types):
-                value = parse_date(value)
-        elif field and field.get_internal_type() == 'TimeField':
-            if (isinstance(value, datetime.datetime) and value.year == 1900 and value.month == value.day == 1):
-                value = value.time() # extract time
-            elif isinstance(value, string_types):
-                # If the value is a string, parse it using parse_time.
-                value = parse_time(value)
-        # Some cases (for example when select_related() is used) aren't
-        # caught by the DateField case above and date fields arrive from
-        # the DB as datetime instances.
-        # Implement a workaround stealing the idea from the Oracle
-        # backend. It's not perfect so the same warning applies (i.e. if a
-        # query results in valid date+time values with the time part set
-        # to midnight, this workaround can surprise us by converting them
-        # to the datetime.date Python type).
-        elif isinstance(value, datetime.datetime) and value.hour == value.minute == value.second == value.microsecond == 0:
-            value = value.date()
-        # Force floats to the correct type
-        elif value is not None and field and field.get_internal_type() == 'FloatField':
-            value = float(value)
+        converter = self._db_converters.get(field.get_internal_type())
+        if converter is not None:
+            value = getattr(self, converter)(value, field, self.connection)
         return value
 
     def return_insert_id(self):
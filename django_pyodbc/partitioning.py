@@ -0,0 +1,237 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Table partitioning.
+
+A model is partitioned by naming a partition scheme and its partitioning
+column as its tablespace:
+
+    class Reading(models.Model):
+        recorded = models.DateTimeField()
+        ...
+        class Meta:
+            db_tablespace = 'ps_monthly(recorded)'
+
+The table and its indexes are then created on that scheme, aligned, which is
+what allows a whole partition to be switched out or truncated as a metadata
+operation. The partition function and scheme are created by the migration
+operations below; the functions at the bottom are for retention jobs.
+"""
+import datetime
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.migrations.operations.base import Operation
+
+partition_scheme_re = re.compile(r'^\s*(\w+)\s*\(\s*(\w+)\s*\)\s*$')
+
+
+def parse_partition_scheme(tablespace):
+    """
+    Returns (scheme, column) if the tablespace names a partition scheme, else
+    None.
+    """
+    if tablespace:
+        m = partition_scheme_re.match(tablespace)
+        if m:
+            return m.groups()
+    return None
+
+
+def month_boundaries(start, end):
+    """
+    Returns the first day of every month from start up to end (inclusive), as
+    boundaries for a monthly partition function.
+    """
+    boundaries = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        boundaries.append(datetime.date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return boundaries
+
+
+def _partition_sql(qn, partition, function=None, quote_value=None):
+    # A partition is given either by number or, with the partition function,
+    # by a value that falls in it.
+    if function is None:
+        return '%d' % int(partition)
+    return '$PARTITION.%s(%s)' % (qn(function), quote_value(partition))
+
+
+def switch_partition_sql(qn, table, partition, to_table, to_partitioned=False, function=None, quote_value=None):
+    partition = _partition_sql(qn, partition, function, quote_value)
+    sql = 'ALTER TABLE %s SWITCH PARTITION %s TO %s' % (qn(table), partition, qn(to_table))
+    if to_partitioned:
+        sql += ' PARTITION %s' % partition
+    return sql
+
+
+def truncate_partitions_sql(qn, table, partitions):
+    return 'TRUNCATE TABLE %s WITH (PARTITIONS (%s))' % (
+        qn(table), ', '.join('%d' % int(p) for p in partitions))
+
+
+class PartitionOperation(Operation):
+    reduces_to_sql = True
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _execute(self, app_label, schema_editor, sql):
+        if schema_editor.connection.vendor != 'microsoft':
+            return
+        if router.allow_migrate(schema_editor.connection.alias, app_label):
+            schema_editor.execute(sql, params=None)
+
+
+class CreatePartitionFunction(PartitionOperation):
+    """
+    CREATE PARTITION FUNCTION name (input_type) AS RANGE RIGHT FOR VALUES (...)
+
+    input_type must be the column type of the partitioning column, e.g.
+    'datetime' for a DateTimeField or 'date' for a DateField.
+    """
+    def __init__(self, name, boundaries, input_type, range='RIGHT'):
+        self.name = name
+        self.boundaries = boundaries
+        self.input_type = input_type
+        self.range = range
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._execute(app_label, schema_editor, 'CREATE PARTITION FUNCTION %s (%s) AS RANGE %s FOR VALUES (%s)' % (
+            schema_editor.quote_name(self.name), self.input_type, self.range,
+            ', '.join(schema_editor.quote_value(b) for b in self.boundaries)))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._execute(app_label, schema_editor, 'DROP PARTITION FUNCTION %s' % schema_editor.quote_name(self.name))
+
+    def describe(self):
+        return "Create partition function %s" % self.name
+
+
+class CreatePartitionScheme(PartitionOperation):
+    """
+    CREATE PARTITION SCHEME name AS PARTITION function TO (filegroups...)
+
+    Without filegroups every partition goes to the PRIMARY filegroup.
+    """
+    def __init__(self, name, function, filegroups=None):
+        self.name = name
+        self.function = function
+        self.filegroups = filegroups
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        qn = schema_editor.quote_name
+        if self.filegroups:
+            to = 'TO (%s)' % ', '.join(qn(fg) for fg in self.filegroups)
+        else:
+            to = 'ALL TO ([PRIMARY])'
+        self._execute(app_label, schema_editor, 'CREATE PARTITION SCHEME %s AS PARTITION %s %s' % (
+            qn(self.name), qn(self.function), to))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._execute(app_label, schema_editor, 'DROP PARTITION SCHEME %s' % schema_editor.quote_name(self.name))
+
+    def describe(self):
+        return "Create partition scheme %s" % self.name
+
+
+class SwitchPartition(PartitionOperation):
+    """
+    Moves a partition of a model's table into an empty archive table with the
+    same structure, on the same filegroup. `partition` is a partition number,
+    or a value that falls in the partition when `function` is given.
+    """
+    reversible = False
+
+    def __init__(self, model_name, partition, to_table, to_partitioned=False, function=None):
+        self.model_name = model_name
+        self.partition = partition
+        self.to_table = to_table
+        self.to_partitioned = to_partitioned
+        self.function = function
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        self._execute(app_label, schema_editor, switch_partition_sql(
+            schema_editor.quote_name, model._meta.db_table, self.partition, self.to_table,
+            self.to_partitioned, self.function, schema_editor.quote_value))
+
+    def describe(self):
+        return "Switch partition %s of %s to %s" % (self.partition, self.model_name, self.to_table)
+
+
+class TruncatePartition(PartitionOperation):
+    """
+    Empties the given partitions (by number) of a model's table. Needs SQL
+    Server 2016 or later.
+    """
+    reversible = False
+
+    def __init__(self, model_name, partitions):
+        self.model_name = model_name
+        self.partitions = partitions
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        self._execute(app_label, schema_editor, truncate_partitions_sql(
+            schema_editor.quote_name, model._meta.db_table, self.partitions))
+
+    def describe(self):
+        return "Truncate partitions %s of %s" % (', '.join(map(str, self.partitions)), self.model_name)
+
+
+def switch_partition(model, partition, to_table, to_partitioned=False, function=None, using=None):
+    """
+    Runtime counterpart of SwitchPartition, for scheduled retention jobs.
+    """
+    connection = connections[using or router.db_for_write(model) or DEFAULT_DB_ALIAS]
+    with connection.schema_editor() as editor:
+        editor.execute(switch_partition_sql(
+            editor.quote_name, model._meta.db_table, partition, to_table,
+            to_partitioned, function, editor.quote_value), params=None)
+
+
+def truncate_partitions(model, partitions, using=None):
+    """
+    Runtime counterpart of TruncatePartition.
+    """
+    connection = connections[using or router.db_for_write(model) or DEFAULT_DB_ALIAS]
+    with connection.schema_editor() as editor:
+        editor.execute(truncate_partitions_sql(editor.quote_name, model._meta.db_table, partitions), params=None)
+
+
+def split_range(function, scheme, boundary, filegroup='PRIMARY', using=DEFAULT_DB_ALIAS):
+    """
+    Adds a partition for the range starting at boundary, e.g. next month's.
+    """
+    connection = connections[using]
+    with connection.schema_editor() as editor:
+        qn = editor.quote_name
+        editor.execute('ALTER PARTITION SCHEME %s NEXT USED %s; ALTER PARTITION FUNCTION %s() SPLIT RANGE (%s)' % (
+            qn(scheme), qn(filegroup), qn(function), editor.quote_value(boundary)), params=None)
+
+
+def merge_range(function, boundary, using=DEFAULT_DB_ALIAS):
+    """
+    Removes the boundary between two partitions, e.g. once the older one has
+    been switched out or truncated.
+    """
+    connection = connections[using]
+    with connection.schema_editor() as editor:
+        editor.execute('ALTER PARTITION FUNCTION %s() MERGE RANGE (%s)' % (
+            editor.quote_name(function), editor.quote_value(boundary)), params=None)
@@ -0,0 +1,178 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A bounded pool of worker threads with connection affinity.
+
+Django keeps one connection per thread and database alias, so every worker
+thread of the pool talks to SQL Server through its own connection. pyodbc
+releases the GIL while it waits on the server, which lets calls dispatched to
+different workers overlap their database waits.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.query import QuerySet
+
+# Number of worker threads (and thus connections) per database alias, unless
+# the 'worker_pool_size' option says otherwise.
+DEFAULT_POOL_SIZE = 10
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _close_connection(alias):
+    connections[alias].close()
+
+
+def _release_connection(alias):
+    """
+    Called on a worker thread once a unit of work is done. Mirrors what Django
+    does at the end of a request: drop the connection if it is broken or has
+    outlived CONN_MAX_AGE.
+    """
+    connection = connections[alias]
+    if not connection.in_atomic_block:
+        connection.close_if_unusable_or_obsolete()
+
+
+class Worker(object):
+    """
+    A single thread. Everything submitted to the same worker runs on the same
+    thread and therefore on the same database connection.
+    """
+    def __init__(self, alias):
+        self.alias = alias
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self.submit(_close_connection, self.alias)
+        self.executor.shutdown(wait=True)
+
+
+class WorkerPool(object):
+    """
+    Hands out at most `size` workers for one database alias. Callers that need
+    several calls to share a connection (e.g. a transaction) acquire a worker
+    and keep it; one-off calls go through run().
+    """
+    def __init__(self, alias, size):
+        self.alias = alias
+        self.size = size
+        # LIFO so that recently used workers, whose connections are most
+        # likely to still be open, are picked first.
+        self._idle = queue.LifoQueue()
+        for i in range(size):
+            self._idle.put(Worker(alias))
+
+    def acquire(self, timeout=None):
+        """
+        Returns an idle worker, blocking until one is available.
+        """
+        return self._idle.get(timeout=timeout)
+
+    def release(self, worker):
+        worker.submit(_release_connection, self.alias)
+        self._idle.put(worker)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Runs fn on the next idle worker and returns a Future. The worker goes
+        back to the pool as soon as fn is done.
+        """
+        worker = self.acquire()
+        try:
+            future = worker.submit(fn, *args, **kwargs)
+        except Exception:
+            self._idle.put(worker)
+            raise
+        future.add_done_callback(lambda f: self.release(worker))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        for i in range(self.size):
+            self.acquire().shutdown()
+
+
+def get_pool(alias=DEFAULT_DB_ALIAS):
+    """
+    Returns the worker pool for the given database alias, creating it on first
+    use.
+    """
+    try:
+        return _pools[alias]
+    except KeyError:
+        pass
+    with _pools_lock:
+        if alias not in _pools:
+            options = connections.databases[alias].get('OPTIONS', {})
+            size = options.get('worker_pool_size', DEFAULT_POOL_SIZE)
+            _pools[alias] = WorkerPool(alias, size)
+        return _pools[alias]
+
+
+def _evaluate(item):
+    if isinstance(item, QuerySet):
+        return list(item)
+    return item()
+
+
+def gather(*items, **kwargs):
+    """
+    Evaluates independent read-only querysets at the same time, each on its
+    own pooled connection, and returns the materialized results in order:
+
+        users, stats = gather(
+            User.objects.filter(is_active=True),
+            lambda: Order.objects.aggregate(total=Sum('amount')),
+        )
+
+    Querysets come back as lists; callables (for aggregate(), count(), etc.)
+    are called on a worker and their return value is used as is. Pass `using`
+    to run callables against another database alias.
+
+    Workers use their own connections, so they can't see writes the calling
+    thread hasn't committed yet. When the calling thread is inside an atomic
+    block for an alias, items for that alias are evaluated in the calling
+    thread instead.
+    """
+    using = kwargs.pop('using', DEFAULT_DB_ALIAS)
+    if kwargs:
+        raise TypeError("Unexpected keyword arguments: %s" % ', '.join(kwargs))
+
+    futures = []
+    for item in items:
+        alias = item.db if isinstance(item, QuerySet) else using
+        if connections[alias].in_atomic_block:
+            futures.append(None)
+        else:
+            futures.append(get_pool(alias).submit(_evaluate, item))
+    return [
+        _evaluate(item) if future is None else future.result()
+        for item, future in zip(items, futures)
+    ]
@@ -0,0 +1,204 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Prepared querysets.
+
+A queryset that only differs by its filter values from one request to the
+next can be compiled once, with P() standing for the values:
+
+    recent_orders = prepare(lambda: Order.objects.filter(
+        customer_id=P('customer'), status=P('status')).order_by('-created')[:20])
+
+    orders = recent_orders(customer=customer.pk, status='open')
+
+The factory is called once, the first time the prepared query runs. Later
+calls run the SQL it compiled to with the new values, and turn the rows into
+model instances, or into dicts or tuples for values() and values_list()
+querysets, with the converters looked up then.
+
+P() takes the place of a value compared with a column by an exact, gt, gte,
+lt or lte lookup. The value is prepared for the column's field when the query
+runs, and typed like the column is when the match_column_types option is on.
+Lookups that transform their value, like contains or in, refuse P() when the
+query is prepared, and None isn't a valid value: use an isnull lookup.
+Querysets with prefetch_related(), or of a related manager, can't be
+prepared.
+"""
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models.expressions import Expression
+from django.db.models.query import (
+    FlatValuesListIterable, ModelIterable, ValuesIterable, ValuesListIterable,
+    get_related_populators,
+)
+
+
+# The lookups that compare the column with their value as it is.
+SLOT_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte')
+
+
+class P(Expression):
+    """
+    The slot of a value given when the prepared query runs.
+    """
+    def __init__(self, name, output_field=None):
+        super(P, self).__init__(output_field=output_field)
+        self.name = name
+        self.target_field = output_field
+        # The lookup the slot is the value of, and the type of its column when
+        # values are typed like their columns, set by the compiler.
+        self.lookup = None
+        self.column_type = None
+
+    def __repr__(self):
+        return "P(%r)" % self.name
+
+    def _prepare(self, field):
+        # Called by the lookup the slot is the value of, with its column's
+        # field.
+        if self.target_field is None:
+            self.target_field = field
+        return self
+
+    def as_sql(self, compiler, connection):
+        return '%s', [self]
+
+
+class CompiledQuery(object):
+    """
+    The SQL of a prepared query on one database, its parameters with the P()
+    slots still in them, and what's needed to build the results.
+    """
+    def __init__(self, queryset, using):
+        if queryset._prefetch_related_lookups:
+            raise TypeError('Querysets with prefetch_related() cannot be prepared.')
+        if queryset._known_related_objects:
+            raise TypeError('Querysets of related managers cannot be prepared.')
+        self.using = using
+        query = queryset.query
+        compiler = query.get_compiler(using=using)
+        try:
+            self.sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            self.sql = ''
+        if not self.sql:
+            raise ValueError('The queryset never matches any rows, so it cannot be prepared.')
+        self.params = list(params)
+        self.slots = [(i, p) for i, p in enumerate(self.params) if isinstance(p, P)]
+        for _, slot in self.slots:
+            if slot.lookup is None or slot.lookup.lookup_name not in SLOT_LOOKUPS:
+                raise TypeError('%r can only be the value of an exact, gt, gte, lt or lte lookup.' % slot)
+        self.names = set(p.name for _, p in self.slots)
+
+        self.iterable_class = queryset._iterable_class
+        self.col_count = compiler.col_count
+        self.converters = list(compiler.get_converters([s[0] for s in compiler.select[0:compiler.col_count]]).items())
+        if self.iterable_class is ModelIterable:
+            klass_info = compiler.klass_info
+            self.model = klass_info['model']
+            select_fields = klass_info['select_fields']
+            self.model_fields = slice(select_fields[0], select_fields[-1] + 1)
+            self.init_list = [f[0].target.attname for f in compiler.select[self.model_fields]]
+            self.related_populators = get_related_populators(klass_info, compiler.select, using)
+            self.annotation_col_map = compiler.annotation_col_map
+        elif self.iterable_class is ValuesIterable:
+            self.value_names = list(query.extra_select) + list(query.values_select) + list(query.annotation_select)
+        elif self.iterable_class not in (ValuesListIterable, FlatValuesListIterable):
+            raise TypeError('%s querysets cannot be prepared.' % self.iterable_class.__name__)
+
+    def bind(self, values):
+        """
+        Returns the parameters of the query with the slots filled from values.
+        """
+        given = set(values)
+        if given != self.names:
+            missing = self.names - given
+            if missing:
+                raise TypeError('Missing values for %s.' % ', '.join(sorted(missing)))
+            raise TypeError('Unexpected values for %s.' % ', '.join(sorted(given - self.names)))
+        connection = connections[self.using]
+        params = list(self.params)
+        for i, slot in self.slots:
+            value = values[slot.name]
+            if value is None:
+                raise ValueError('%r cannot be None; filter with an isnull lookup instead.' % slot)
+            if slot.target_field is not None:
+                value = slot.target_field.get_db_prep_value(value, connection, prepared=False)
+            if slot.column_type is not None:
+                value = connection.ops.typed_lookup_params(slot.lookup, slot.column_type, [value])[0]
+            params[i] = value
+        return params
+
+    def rows(self, params):
+        connection = connections[self.using]
+        cursor = connection.cursor()
+        try:
+            cursor.execute(self.sql, params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        for row in rows:
+            row = list(row[:self.col_count])
+            for pos, (convs, expression) in self.converters:
+                value = row[pos]
+                for converter in convs:
+                    value = converter(value, expression, connection)
+                row[pos] = value
+            yield row
+
+    def results(self, params):
+        if self.iterable_class is ModelIterable:
+            return [self._model_instance(row) for row in self.rows(params)]
+        if self.iterable_class is ValuesIterable:
+            return [dict(zip(self.value_names, row)) for row in self.rows(params)]
+        if self.iterable_class is FlatValuesListIterable:
+            return [row[0] for row in self.rows(params)]
+        return [tuple(row) for row in self.rows(params)]
+
+    def _model_instance(self, row):
+        obj = self.model.from_db(self.using, self.init_list, row[self.model_fields])
+        for populator in self.related_populators:
+            populator.populate(row, obj)
+        for attr_name, col_pos in self.annotation_col_map.items():
+            setattr(obj, attr_name, row[col_pos])
+        return obj
+
+
+class PreparedQuery(object):
+    def __init__(self, factory, using=None):
+        self.factory = factory
+        self.using = using
+        self._compiled = None
+
+    def _compile(self):
+        if self._compiled is None:
+            queryset = self.factory()
+            if self.using is not None:
+                queryset = queryset.using(self.using)
+            self._compiled = CompiledQuery(queryset, queryset.db)
+        return self._compiled
+
+    def __call__(self, **values):
+        compiled = self._compile()
+        return compiled.results(compiled.bind(values))
+
+
+def prepare(factory, using=None):
+    """
+    Compiles the queryset returned by factory once, the first time the
+    returned callable is called, and runs it with the values passed to it as
+    keyword arguments for its P() slots.
+    """
+    return PreparedQuery(factory, using)
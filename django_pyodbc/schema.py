@@ -0,0 +1,339 @@
+# Copyright 2013-2017 Lionheart Software LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import decimal
+
+from django.db import NotSupportedError
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+
+from django_pyodbc.compat import binary_type, text_type
+from django_pyodbc.fields import SequenceAutoField
+from django_pyodbc.indexes import has_clustered_columnstore
+from django_pyodbc.operations import (
+    EDITION_AZURE_SQL_DB, EDITION_AZURE_SQL_MI, EDITION_ENTERPRISE,
+)
+from django_pyodbc.partitioning import parse_partition_scheme
+
+
+class DatabaseSchemaEditor(BaseDatabaseSchemaEditor):
+    sql_rename_table = "EXEC sp_rename %(old_table)s, %(new_table)s"
+    sql_delete_table = "DROP TABLE %(table)s"
+
+    sql_create_column = "ALTER TABLE %(table)s ADD %(column)s %(definition)s"
+    sql_alter_column_type = "ALTER COLUMN %(column)s %(type)s"
+    sql_alter_column_null = "ALTER COLUMN %(column)s %(type)s NULL"
+    sql_alter_column_not_null = "ALTER COLUMN %(column)s %(type)s NOT NULL"
+    sql_alter_column_default = "ADD CONSTRAINT %(name)s DEFAULT %(default)s FOR %(column)s"
+    sql_alter_column_no_default = "DROP CONSTRAINT %(name)s"
+    sql_delete_column = "ALTER TABLE %(table)s DROP COLUMN %(column)s"
+    sql_rename_column = "EXEC sp_rename '%(table)s.%(old_column)s', %(new_column)s, 'COLUMN'"
+
+    sql_delete_index = "DROP INDEX %(name)s ON %(table)s"
+
+    sql_create_partitioned_pk = (
+        "ALTER TABLE %(table)s ADD CONSTRAINT %(name)s PRIMARY KEY %(clustered)s (%(columns)s) %(tablespace)s"
+    )
+
+    sql_create_sequence = "CREATE SEQUENCE %(sequence)s AS %(type)s START WITH 1 INCREMENT BY 1"
+    sql_delete_sequence = "DROP SEQUENCE %(sequence)s"
+    sql_rename_sequence = "EXEC sp_rename %(old_sequence)s, %(new_sequence)s"
+    # CREATE SEQUENCE takes only a constant after START WITH.
+    sql_create_sequence_after_column = (
+        "DECLARE @start bigint; "
+        "SELECT @start = ISNULL(MAX(%(column)s), 0) + 1 FROM %(table)s; "
+        "EXEC (N'CREATE SEQUENCE %(sequence)s AS %(type)s START WITH ' + CAST(@start AS nvarchar(20)) + "
+        "N' INCREMENT BY 1')"
+    )
+
+    sql_create_fulltext_catalog = "CREATE FULLTEXT CATALOG %(name)s%(default)s"
+    sql_delete_fulltext_catalog = "DROP FULLTEXT CATALOG %(name)s"
+    sql_create_fulltext_index = (
+        "DECLARE @sql nvarchar(max); "
+        "SELECT @sql = N'CREATE FULLTEXT INDEX ON %(table)s (%(columns)s) KEY INDEX ' + QUOTENAME(name) + "
+        "N'%(catalog)s WITH CHANGE_TRACKING %(change_tracking)s' "
+        "FROM sys.indexes WHERE object_id = OBJECT_ID(%(table_string)s) AND is_primary_key = 1; "
+        "EXEC sp_executesql @sql"
+    )
+    sql_delete_fulltext_index = "DROP FULLTEXT INDEX ON %(table)s"
+
+    # SQL Server refuses to drop a column that still has a default or a check
+    # constraint on it, and those get server generated names.
+    sql_delete_column_constraints = (
+        "DECLARE @sql nvarchar(max); SET @sql = N''; "
+        "SELECT @sql = @sql + N'ALTER TABLE %(table)s DROP CONSTRAINT ' + QUOTENAME(c.name) + N'; ' "
+        "FROM (SELECT name, parent_object_id, parent_column_id FROM sys.default_constraints "
+        "UNION ALL SELECT name, parent_object_id, parent_column_id FROM sys.check_constraints) c "
+        "WHERE c.parent_object_id = OBJECT_ID(N'%(table)s') "
+        "AND c.parent_column_id = COLUMNPROPERTY(OBJECT_ID(N'%(table)s'), N'%(column)s', 'ColumnId'); "
+        "EXEC sp_executesql @sql"
+    )
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Send the deferred statements (indexes, foreign keys, unique
+        # constraints) to the server as a single batch.
+        if exc_type is None and len(self.deferred_sql) > 1 and not self.collect_sql:
+            self.execute(';\n'.join(str(sql) for sql in self.deferred_sql))
+            self.deferred_sql = []
+        super(DatabaseSchemaEditor, self).__exit__(exc_type, exc_value, traceback)
+        # The schema changed, so drop what the backend cached about it.
+        self.connection.ops._foreign_keys = None
+        self.connection.introspection._column_info = {}
+        self.connection.introspection._has_triggers = {}
+
+    def quote_value(self, value):
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, (int, float, decimal.Decimal)):
+            return str(value)
+        if isinstance(value, (datetime.date, datetime.time, datetime.datetime)):
+            return "'%s'" % value.isoformat()
+        if isinstance(value, binary_type):
+            return '0x%s' % ''.join('%02x' % c for c in bytearray(value))
+        return "N'%s'" % text_type(value).replace("'", "''")
+
+    def prepare_default(self, value):
+        return self.quote_value(value)
+
+    def _default_constraint_name(self, model, field):
+        return self.quote_name(self._create_index_name(model._meta.db_table, [field.column], suffix='_dflt'))
+
+    def column_sql(self, model, field, include_default=False):
+        sql, params = super(DatabaseSchemaEditor, self).column_sql(model, field, include_default)
+        if sql is not None and ' DEFAULT ' in sql:
+            # Name the constraint so that add_field() can drop it again.
+            sql = sql.replace(' DEFAULT ', ' CONSTRAINT %s DEFAULT ' % self._default_constraint_name(model, field), 1)
+        if sql is not None and field.primary_key:
+            if self._partition_key(model):
+                # create_model() adds a primary key aligned with the partitions.
+                tablespace_sql = ' ' + self.connection.ops.tablespace_sql(model._meta.db_tablespace, inline=True)
+                sql = sql.replace(' PRIMARY KEY', '', 1).replace(tablespace_sql, '', 1)
+            elif has_clustered_columnstore(model):
+                # The clustered index of the table is the columnstore one.
+                sql = sql.replace(' PRIMARY KEY', ' PRIMARY KEY NONCLUSTERED', 1)
+        elif sql is not None and field.unique:
+            tablespace = field.db_tablespace or model._meta.db_tablespace
+            partition_scheme = parse_partition_scheme(tablespace)
+            if partition_scheme and partition_scheme[1] != field.column:
+                # A unique index can only be partitioned on a column of its
+                # key, so this one goes to the default filegroup instead. Left
+                # out, the ON clause would default to the table's scheme.
+                sql = sql.replace(
+                    self.connection.ops.tablespace_sql(tablespace, inline=True),
+                    self.connection.ops.sql_for_tablespace('default', inline=True), 1)
+        return sql, params
+
+    def _partition_key(self, model):
+        """
+        Returns (scheme, column) when the model's table is partitioned on a
+        column other than its primary key, which then has to be part of the
+        primary key too.
+        """
+        partition_scheme = parse_partition_scheme(model._meta.db_tablespace)
+        if partition_scheme and partition_scheme[1] != model._meta.pk.column:
+            return partition_scheme
+        return None
+
+    def _create_sequence(self, model, field):
+        if isinstance(field, SequenceAutoField):
+            self.execute(self.sql_create_sequence % {
+                'sequence': self.quote_name(field.get_sequence_name(self.connection)),
+                'type': field.sequence_type,
+            })
+
+    def _delete_sequence(self, model, field):
+        if isinstance(field, SequenceAutoField):
+            self._drop_sequence(field.get_sequence_name(self.connection, model._meta.db_table))
+
+    def _drop_sequence(self, sequence_name):
+        self.execute(self.sql_delete_sequence % {'sequence': self.quote_name(sequence_name)})
+        self.connection.ops.forget_sequence_range(sequence_name)
+
+    def _rename_sequence(self, old_sequence_name, new_sequence_name):
+        self.execute(self.sql_rename_sequence % {
+            'old_sequence': self.quote_value(self.quote_name(old_sequence_name)),
+            'new_sequence': self.quote_value(new_sequence_name),
+        })
+        self.connection.ops.forget_sequence_range(old_sequence_name)
+        self.connection.ops.forget_sequence_range(new_sequence_name)
+
+    def create_model(self, model):
+        for field in model._meta.local_fields:
+            self._create_sequence(model, field)
+        super(DatabaseSchemaEditor, self).create_model(model)
+        partition_key = self._partition_key(model)
+        if partition_key:
+            table = model._meta.db_table
+            self.execute(self.sql_create_partitioned_pk % {
+                'table': self.quote_name(table),
+                'name': self.quote_name(self._create_index_name(table, [model._meta.pk.column], suffix='_pk')),
+                'clustered': 'NONCLUSTERED' if has_clustered_columnstore(model) else 'CLUSTERED',
+                'columns': ', '.join(self.quote_name(c) for c in (model._meta.pk.column, partition_key[1])),
+                'tablespace': self.connection.ops.tablespace_sql(model._meta.db_tablespace),
+            })
+
+    def delete_model(self, model):
+        super(DatabaseSchemaEditor, self).delete_model(model)
+        for field in model._meta.local_fields:
+            self._delete_sequence(model, field)
+
+    def alter_db_table(self, model, old_db_table, new_db_table):
+        super(DatabaseSchemaEditor, self).alter_db_table(model, old_db_table, new_db_table)
+        if old_db_table == new_db_table:
+            return
+        # Sequences named after the table follow it.
+        for field in model._meta.local_fields:
+            if isinstance(field, SequenceAutoField) and field.sequence_name is None:
+                self._rename_sequence(
+                    field.get_sequence_name(self.connection, old_db_table),
+                    field.get_sequence_name(self.connection, new_db_table))
+
+    def add_field(self, model, field):
+        self._create_sequence(model, field)
+        super(DatabaseSchemaEditor, self).add_field(model, field)
+
+    def alter_field(self, model, old_field, new_field, strict=False):
+        super(DatabaseSchemaEditor, self).alter_field(model, old_field, new_field, strict)
+        table = model._meta.db_table
+        old_sequence = (isinstance(old_field, SequenceAutoField) and
+                        old_field.get_sequence_name(self.connection, table))
+        new_sequence = (isinstance(new_field, SequenceAutoField) and
+                        new_field.get_sequence_name(self.connection, table))
+        if old_sequence == new_sequence:
+            return
+        if old_sequence and new_sequence:
+            self._rename_sequence(old_sequence, new_sequence)
+        elif old_sequence:
+            self._drop_sequence(old_sequence)
+        else:
+            # The sequence takes over from the values already in the column.
+            self.execute(self.sql_create_sequence_after_column % {
+                'column': self.quote_name(new_field.column),
+                'table': self.quote_name(table),
+                'sequence': self.quote_name(new_sequence).replace("'", "''"),
+                'type': new_field.sequence_type,
+            })
+
+    def _alter_column_default_sql(self, model, old_field, new_field, drop=False):
+        # SQL Server doesn't take parameters in DDL, so the default is inlined.
+        sql = self.sql_alter_column_no_default if drop else self.sql_alter_column_default
+        return (
+            sql % {
+                'name': self._default_constraint_name(model, new_field),
+                'column': self.quote_name(new_field.column),
+                'default': None if drop else self.prepare_default(self.effective_default(new_field)),
+            },
+            [],
+        )
+
+    def _alter_column_type_sql(self, model, old_field, new_field, new_type):
+        # ALTER COLUMN resets the nullability unless it's restated.
+        new_type = '%s %s' % (new_type, 'NULL' if new_field.null else 'NOT NULL')
+        return super(DatabaseSchemaEditor, self)._alter_column_type_sql(model, old_field, new_field, new_type)
+
+    def remove_field(self, model, field):
+        if not field.many_to_many and field.db_parameters(connection=self.connection)['type'] is not None:
+            self.execute(self.sql_delete_column_constraints % {
+                'table': self.quote_name(model._meta.db_table),
+                'column': field.column,
+            })
+        super(DatabaseSchemaEditor, self).remove_field(model, field)
+        self._delete_sequence(model, field)
+
+    def _execute_outside_transaction(self, sql):
+        # Full-text DDL is refused inside a transaction, which the connection
+        # otherwise opens implicitly.
+        if self.collect_sql:
+            self.execute(sql, params=None)
+            return
+        if self.connection.in_atomic_block:
+            raise NotSupportedError(
+                "Full-text catalogs and indexes can't be changed inside an atomic block.")
+        autocommit = self.connection.get_autocommit()
+        self.connection.set_autocommit(True)
+        try:
+            self.execute(sql, params=None)
+        finally:
+            self.connection.set_autocommit(autocommit)
+
+    def create_fulltext_catalog(self, name, default=False):
+        self._execute_outside_transaction(self.sql_create_fulltext_catalog % {
+            'name': self.quote_name(name),
+            'default': ' AS DEFAULT' if default else '',
+        })
+
+    def delete_fulltext_catalog(self, name):
+        self._execute_outside_transaction(self.sql_delete_fulltext_catalog % {'name': self.quote_name(name)})
+
+    def create_fulltext_index(self, model, fields, catalog=None, language=None, change_tracking='AUTO'):
+        columns = []
+        for field_name in fields:
+            column = self.quote_name(model._meta.get_field(field_name).column)
+            if language is not None:
+                column += ' LANGUAGE %s' % self.quote_value(language)
+            columns.append(column)
+        table = model._meta.db_table
+        # The key index is the primary key, whose name the server generated.
+        self._execute_outside_transaction(self.sql_create_fulltext_index % {
+            'table': self.quote_name(table),
+            'table_string': self.quote_value(self.quote_name(table))[1:],
+            'columns': ', '.join(columns).replace("'", "''"),
+            'catalog': ' ON %s' % self.quote_name(catalog) if catalog else '',
+            'change_tracking': change_tracking,
+        })
+
+    def delete_fulltext_index(self, model):
+        self._execute_outside_transaction(self.sql_delete_fulltext_index % {
+            'table': self.quote_name(model._meta.db_table),
+        })
+
+    def _supports_online_index(self):
+        edition = self.connection.ops.engine_edition
+        return edition in (EDITION_ENTERPRISE, EDITION_AZURE_SQL_DB, EDITION_AZURE_SQL_MI)
+
+    def _supports_resumable_index(self):
+        edition = self.connection.ops.engine_edition
+        return (edition in (EDITION_AZURE_SQL_DB, EDITION_AZURE_SQL_MI) or
+                (edition == EDITION_ENTERPRISE and self.connection.ops.sql_server_ver >= 2019))
+
+    def _index_options_sql(self):
+        """
+        Returns the WITH (...) clause for CREATE INDEX built from the index_*
+        entries of the database OPTIONS. Options the server can't honour are
+        left out rather than failing the migration.
+        """
+        options = self.connection.settings_dict.get('OPTIONS', {})
+        index_options = []
+        online = options.get('index_online', False) and self._supports_online_index()
+        if online:
+            index_options.append('ONLINE = ON')
+        if options.get('index_sort_in_tempdb', False):
+            index_options.append('SORT_IN_TEMPDB = ON')
+        if options.get('index_maxdop') is not None:
+            index_options.append('MAXDOP = %d' % int(options['index_maxdop']))
+        if online and options.get('index_resumable', False) and self._supports_resumable_index():
+            index_options.append('RESUMABLE = ON')
+            if options.get('index_max_duration') is not None:
+                index_options.append('MAX_DURATION = %d MINUTES' % int(options['index_max_duration']))
+        if not index_options:
+            return ''
+        return ' WITH (%s)' % ', '.join(index_options)
+
+    def _create_index_sql(self, model, fields, **kwargs):
+        statement = super(DatabaseSchemaEditor, self)._create_index_sql(model, fields, **kwargs)
+        # The WITH clause goes before the ON <filegroup> of the tablespace.
+        statement.parts['extra'] = self._index_options_sql() + statement.parts['extra']
+        return statement
@@ -0,0 +1,41 @@
+from django.db import models
+
+from django_pyodbc.fields import SequenceAutoField
+from django_pyodbc.indexes import ColumnStoreIndex
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Book(models.Model):
+    title = models.CharField(max_length=100)
+    authors = models.ManyToManyField(Author)
+
+
+class Chapter(models.Model):
+    book = models.ForeignKey(Book, models.CASCADE)
+    title = models.CharField(max_length=100)
+
+
+class Event(models.Model):
+    id = SequenceAutoField(range_size=10)
+    name = models.CharField(max_length=100)
+
+
+class Reading(models.Model):
+    sensor = models.CharField(max_length=20)
+    recorded = models.DateTimeField()
+    value = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['sensor', '-recorded'], name='reading_sensor_idx')]
+        unique_together = [('sensor', 'recorded')]
+
+
+class Metric(models.Model):
+    recorded = models.DateTimeField()
+    value = models.FloatField()
+
+    class Meta:
+        indexes = [ColumnStoreIndex(fields=['recorded', 'value'], name='metric_cs')]
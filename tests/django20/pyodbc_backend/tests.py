@@ -0,0 +1,1555 @@
+import asyncio
+import datetime
+import decimal
+import warnings
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import DatabaseError, IntegrityError, NotSupportedError, connection, connections, models, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import TruncDay, TruncMonth
+from django.db.models.expressions import Col
+from django.db.models.sql import InsertQuery
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, isolate_apps, override_settings
+from django.utils import timezone
+
+import pyodbc as Database
+
+from django_pyodbc import operations, pool
+from django_pyodbc.aio import AsyncConnection
+from django_pyodbc.base import CursorWrapper
+from django_pyodbc.batch import WriteBatch, check_updated
+from django_pyodbc.fields import BigSequenceAutoField, SequenceAutoField
+from django_pyodbc.fulltext import SearchRank
+from django_pyodbc.indexes import ColumnStoreIndex
+from django_pyodbc.introspection import SQL_AUTOFIELD, SchemaSnapshot
+from django_pyodbc.operations import EDITION_AZURE_SQL_DB, EDITION_ENTERPRISE, DateTimeParam, VarCharParam
+from django_pyodbc.partitioning import (
+    CreatePartitionFunction, month_boundaries, parse_partition_scheme, switch_partition_sql,
+    truncate_partitions_sql,
+)
+from django_pyodbc.pool import WorkerPool, gather
+from django_pyodbc.prepared import CompiledQuery, P, prepare
+
+from .models import Author, Book, Chapter, Event, Metric, Reading
+
+
+class SchemaEditorTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_add_not_null_field_with_default(self):
+        # The default is inlined in the DDL and fills the existing rows.
+        Author.objects.create(name='Anna')
+        field = models.IntegerField(default=42)
+        field.set_attributes_from_name('age')
+        with connection.schema_editor() as editor:
+            editor.add_field(Author, field)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT age FROM %s' % connection.ops.quote_name(Author._meta.db_table))
+                self.assertEqual(cursor.fetchall()[0][0], 42)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.remove_field(Author, field)
+
+    def test_rename_column(self):
+        old_field = Author._meta.get_field('name')
+        new_field = models.CharField(max_length=100)
+        new_field.set_attributes_from_name('full_name')
+        with connection.schema_editor() as editor:
+            editor.alter_field(Author, old_field, new_field, strict=True)
+        try:
+            with connection.cursor() as cursor:
+                columns = [c[0] for c in connection.introspection.get_table_description(cursor, 'pyodbc_backend_author')]
+            self.assertEqual(columns, ['id', 'full_name'])
+        finally:
+            with connection.schema_editor() as editor:
+                editor.alter_field(Author, new_field, old_field, strict=True)
+
+    def test_alter_column_default_is_inlined(self):
+        old_field = Author._meta.get_field('name')
+        new_field = models.CharField(max_length=100, default="O'Brien")
+        new_field.set_attributes_from_name('name')
+        with connection.schema_editor(collect_sql=True) as editor:
+            sql, params = editor._alter_column_default_sql(Author, old_field, new_field)
+        self.assertIn("DEFAULT N'O''Brien' FOR", sql)
+        self.assertEqual(params, [])
+
+
+class IndexOptionsTests(SimpleTestCase):
+    def create_index_sql(self, edition, version, **options):
+        with mock.patch.object(connection.ops, '_ss_edition', edition), \
+                mock.patch.object(connection.ops, '_ss_ver', version), \
+                mock.patch.dict(connection.settings_dict['OPTIONS'], options):
+            with connection.schema_editor(collect_sql=True) as editor:
+                return str(editor._create_index_sql(Author, [Author._meta.get_field('name')]))
+
+    def test_no_options(self):
+        self.assertNotIn(' WITH ', self.create_index_sql(EDITION_ENTERPRISE, 2019))
+
+    def test_online_resumable(self):
+        sql = self.create_index_sql(
+            EDITION_ENTERPRISE, 2019, index_online=True, index_resumable=True,
+            index_max_duration=30, index_maxdop=4, index_sort_in_tempdb=True)
+        self.assertTrue(sql.endswith(
+            ' WITH (ONLINE = ON, SORT_IN_TEMPDB = ON, MAXDOP = 4, RESUMABLE = ON, MAX_DURATION = 30 MINUTES)'), sql)
+
+    def test_unsupported_options_are_left_out(self):
+        # Standard edition builds indexes offline, and resumable builds are
+        # new in 2019.
+        self.assertTrue(self.create_index_sql(2, 2019, index_online=True, index_maxdop=2).endswith(' WITH (MAXDOP = 2)'))
+        self.assertTrue(self.create_index_sql(
+            EDITION_ENTERPRISE, 2017, index_online=True, index_resumable=True).endswith(' WITH (ONLINE = ON)'))
+
+
+class LoadDataTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_enables_only_its_own_constraints(self):
+        # A book and its authors table are disabled in one call, so only one
+        # entry of the stack belongs to ss_loaddata.
+        connection.disable_constraint_checking()
+        try:
+            call_command('ss_loaddata', 'pyodbc_backend_books', verbosity=0)
+            self.assertEqual(len(connection._disabled_constraints), 1)
+        finally:
+            connection.enable_constraint_checking()
+        self.assertEqual(connection._disabled_constraints, [])
+        self.assertEqual(list(Book.objects.get().authors.all()), [Author.objects.get()])
+
+    def test_loads_explicit_keys(self):
+        call_command('ss_loaddata', 'pyodbc_backend_books', verbosity=0)
+        self.assertEqual(Author.objects.get().pk, 1)
+        # Identity values continue after the loaded keys.
+        self.assertEqual(Author.objects.create(name='Bob').pk, 2)
+
+    def test_existing_objects_are_updated(self):
+        Author.objects.create(pk=1, name='Old')
+        call_command('ss_loaddata', 'pyodbc_backend_books', verbosity=0)
+        call_command('ss_loaddata', 'pyodbc_backend_books', verbosity=0)
+        self.assertEqual(list(Author.objects.values_list('pk', 'name')), [(1, 'Anna')])
+        self.assertEqual(Book.objects.get().authors.count(), 1)
+
+
+class FullTextSchemaTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_refused_in_atomic_block(self):
+        with transaction.atomic():
+            with connection.schema_editor() as editor:
+                with self.assertRaises(NotSupportedError):
+                    editor.create_fulltext_catalog('pyodbc_backend_catalog')
+
+
+class FullTextSearchTests(SimpleTestCase):
+    def compile(self, queryset):
+        return queryset.query.get_compiler(connection=connection).as_sql()
+
+    def test_lookups(self):
+        sql, params = self.compile(Author.objects.filter(name__contains_ft='"ann*"'))
+        self.assertIn('WHERE CONTAINS([pyodbc_backend_author].[name], %s)', sql)
+        self.assertEqual(params, ('"ann*"',))
+        sql, params = self.compile(Author.objects.filter(name__freetext='anna'))
+        self.assertIn('WHERE FREETEXT([pyodbc_backend_author].[name], %s)', sql)
+        self.assertEqual(params, ('anna',))
+
+    def test_search_rank(self):
+        sql, params = self.compile(
+            Author.objects.filter(name__freetext='anna').annotate(
+                rank=SearchRank('name', 'anna', function='FREETEXTTABLE', top_n=10)).order_by('-rank'))
+        self.assertEqual(
+            sql,
+            'SELECT [pyodbc_backend_author].[id], [pyodbc_backend_author].[name], COALESCE(T2.[RANK], 0) AS [rank] '
+            'FROM [pyodbc_backend_author] '
+            'LEFT OUTER JOIN FREETEXTTABLE([pyodbc_backend_author], [name], %s, 10) AS T2 '
+            'ON (T2.[KEY] = [pyodbc_backend_author].[id]) '
+            'WHERE FREETEXT([pyodbc_backend_author].[name], %s) ORDER BY [rank] DESC')
+        self.assertEqual(params, ('anna', 'anna'))
+
+    def test_search_rank_joins(self):
+        # The same search is joined once.
+        sql, params = self.compile(Author.objects.annotate(
+            a=SearchRank('name', 'anna'), b=SearchRank('name', 'anna'), c=SearchRank('name', 'ben')))
+        self.assertEqual(sql.count('JOIN CONTAINSTABLE'), 2)
+        self.assertEqual(params, ('anna', 'ben'))
+        # The join follows its query into a subquery.
+        sql, params = self.compile(Book.objects.filter(
+            authors__in=Author.objects.annotate(rank=SearchRank('name', 'anna')).filter(rank__gt=0).values('pk')))
+        self.assertIn(
+            'LEFT OUTER JOIN CONTAINSTABLE([pyodbc_backend_author], [name], %s) AS U1 ON (U1.[KEY] = U0.[id]) '
+            'WHERE COALESCE(U1.[RANK], 0) > %s', sql)
+
+    def test_search_rank_function(self):
+        with self.assertRaisesMessage(ValueError, 'function must be CONTAINSTABLE or FREETEXTTABLE.'):
+            SearchRank('name', 'anna', function='CONTAINS')
+
+    def test_ddl(self):
+        with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+            editor.create_fulltext_catalog('pyodbc_backend_catalog', default=True)
+            editor.create_fulltext_index(Author, ['name'], catalog='pyodbc_backend_catalog', language='English')
+            editor.delete_fulltext_index(Author)
+        create_catalog, create_index, delete_index = editor.collected_sql
+        self.assertEqual(create_catalog, 'CREATE FULLTEXT CATALOG [pyodbc_backend_catalog] AS DEFAULT;')
+        self.assertIn(
+            "N'CREATE FULLTEXT INDEX ON [pyodbc_backend_author] ([name] LANGUAGE N''English'') KEY INDEX '"
+            " + QUOTENAME(name) + N' ON [pyodbc_backend_catalog] WITH CHANGE_TRACKING AUTO'", create_index)
+        self.assertIn("OBJECT_ID('[pyodbc_backend_author]') AND is_primary_key = 1", create_index)
+        self.assertEqual(delete_index, 'DROP FULLTEXT INDEX ON [pyodbc_backend_author];')
+
+
+class SlicedSubqueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [Author.objects.create(name='Author %02d' % i) for i in range(12)]
+
+    def test_sliced_subquery_annotation(self):
+        second = Author.objects.exclude(pk=OuterRef('pk')).order_by('name').values('name')[1:2]
+        names = Author.objects.annotate(other=Subquery(second)).order_by('name').values_list('other', flat=True)
+        self.assertEqual(list(names)[:3], ['Author 02', 'Author 02', 'Author 01'])
+
+    def test_sliced_in_subquery(self):
+        page = Author.objects.order_by('name').values('pk')[5:10]
+        self.assertEqual(list(Author.objects.filter(pk__in=page).order_by('name')), self.authors[5:10])
+
+    def test_top_level_slice_keeps_order(self):
+        self.assertEqual(list(Author.objects.order_by('-name')[5:10]), self.authors[6:1:-1])
+
+
+class ConverterTests(TestCase):
+    def converters(self, field):
+        return connection.ops.get_db_converters(Col('t', field))
+
+    def test_converters_by_type(self):
+        ops = connection.ops
+        with mock.patch.object(connection, 'drv_name', 'MSODBCSQL17.DLL'), mock.patch.object(ops, '_ss_ver', 2016):
+            for field in (models.CharField(max_length=10), models.DateField(), models.DateTimeField(),
+                          models.FloatField()):
+                self.assertEqual(self.converters(field), [])
+        with mock.patch.object(connection, 'drv_name', 'MSODBCSQL17.DLL'), mock.patch.object(ops, '_ss_ver', 2005):
+            # Dates and times are stored as datetime.
+            self.assertEqual(self.converters(models.DateField()), [ops.convert_datefield_value])
+            self.assertEqual(self.converters(models.TimeField()), [ops.convert_timefield_value])
+            self.assertEqual(self.converters(models.FloatField()), [])
+        with mock.patch.object(connection, 'drv_name', 'SQLSRV32.DLL'), mock.patch.object(ops, '_ss_ver', 2016):
+            self.assertEqual(self.converters(models.DateTimeField()), [ops.convert_datetimefield_value])
+            self.assertEqual(self.converters(models.FloatField()), [ops.convert_floatfield_value])
+
+    def test_convert(self):
+        ops = connection.ops
+        self.assertEqual(
+            ops.convert_datefield_value(datetime.datetime(2017, 3, 4, 0, 0), None, connection),
+            datetime.date(2017, 3, 4))
+        self.assertEqual(ops.convert_datefield_value('2017-03-04', None, connection), datetime.date(2017, 3, 4))
+        self.assertEqual(
+            ops.convert_timefield_value(datetime.datetime(1900, 1, 1, 12, 30), None, connection),
+            datetime.time(12, 30))
+        self.assertEqual(
+            ops.convert_datetimefield_value('2017-03-04 12:30:00', None, connection),
+            datetime.datetime(2017, 3, 4, 12, 30))
+        self.assertEqual(ops.convert_floatfield_value(decimal.Decimal('1.5'), None, connection), 1.5)
+        self.assertIsNone(ops.convert_floatfield_value(None, None, connection))
+
+    def test_fetched_values(self):
+        Metric.objects.create(recorded=datetime.datetime(2017, 3, 4, 12, 30), value=1.5)
+        self.assertEqual(
+            list(Metric.objects.values_list('recorded', 'value')),
+            [(datetime.datetime(2017, 3, 4, 12, 30), 1.5)])
+
+    def test_sliced_rows_have_no_row_number(self):
+        Author.objects.bulk_create([Author(name='Author %02d' % i) for i in range(5)])
+        self.assertEqual(
+            list(Author.objects.order_by('name').values_list('name')[1:3]),
+            [('Author 01',), ('Author 02',)])
+
+
+class RecordingCursor(object):
+    def __init__(self):
+        self.calls = []
+
+    def setinputsizes(self, sizes):
+        self.calls.append(('setinputsizes', sizes))
+
+    def execute(self, sql, params):
+        self.calls.append(('execute', params))
+
+    def executemany(self, sql, params_list):
+        self.calls.append(('executemany', params_list))
+
+
+class ParameterSizeTests(SimpleTestCase):
+    def setUp(self):
+        self.cursor = RecordingCursor()
+        self.wrapper = CursorWrapper(self.cursor, True, db_wrpr=connection)
+
+    def test_strings_are_bound_with_normalized_sizes(self):
+        self.wrapper.execute('SELECT %s, %s', ['a', 'b' * 5000])
+        self.assertEqual(self.cursor.calls[0][0], 'setinputsizes')
+        self.assertEqual([size[1] for size in self.cursor.calls[0][1]], [4000, 0])
+
+    def test_input_sizes(self):
+        sizes = self.wrapper.input_sizes(['a', decimal.Decimal('1.25'), 1, VarCharParam('v'), None])
+        self.assertEqual(sizes, [
+            (Database.SQL_WVARCHAR, 4000, 0),
+            (Database.SQL_DECIMAL, 38, 2),
+            None,
+            (Database.SQL_VARCHAR, 8000, 0),
+            None,
+        ])
+        self.assertIsNone(self.wrapper.input_sizes([1, None]))
+
+    def test_without_normalization(self):
+        with mock.patch.object(connection, 'normalize_params', False):
+            self.assertIsNone(self.wrapper.input_sizes(['a', decimal.Decimal('1.25')]))
+            # Parameters typed after their column are still bound as such.
+            self.assertEqual(self.wrapper.input_sizes(['a', VarCharParam('v')]), [None, (Database.SQL_VARCHAR, 8000, 0)])
+
+    def test_sizes_are_cleared_when_no_longer_needed(self):
+        self.wrapper.execute('SELECT %s', ['a'])
+        self.wrapper.execute('SELECT %s', [1])
+        self.wrapper.execute('SELECT %s', [2])
+        self.assertEqual([call[0] for call in self.cursor.calls], [
+            'setinputsizes', 'execute', 'setinputsizes', 'execute', 'execute'])
+        self.assertIsNone(self.cursor.calls[2][1])
+
+    def test_executemany_resets_sizes(self):
+        self.wrapper.execute('SELECT %s', ['a'])
+        self.wrapper.executemany('INSERT INTO t VALUES (%s)', [[1], [2]])
+        self.assertEqual(self.cursor.calls[-2:], [
+            ('setinputsizes', None),
+            ('executemany', [(1,), (2,)]),
+        ])
+
+
+class ColumnTypeMatchingTests(SimpleTestCase):
+    column_types = {'sensor': 'varchar', 'recorded': 'datetime', 'value': 'int'}
+
+    def setUp(self):
+        get_column_type = mock.patch.object(
+            connection.introspection, 'get_column_type', lambda table, column: self.column_types.get(column))
+        get_column_type.start()
+        self.addCleanup(get_column_type.stop)
+
+    def compile(self, queryset, match=True, warn=False):
+        with mock.patch.object(connection, 'match_column_types', match), \
+                mock.patch.object(connection, 'warn_column_type_mismatch', warn):
+            return queryset.query.get_compiler(connection=connection).as_sql()[1]
+
+    def test_varchar_column(self):
+        params = self.compile(Reading.objects.filter(sensor__in=['a', 'b']))
+        self.assertEqual(sorted(params), ['a', 'b'])
+        self.assertTrue(all(isinstance(p, VarCharParam) for p in params))
+
+    def test_datetime_column(self):
+        value = datetime.datetime(2018, 1, 2, 3, 4, 5, 678901)
+        param, = self.compile(Reading.objects.filter(recorded__gte=value))
+        self.assertIsInstance(param, DateTimeParam)
+        # datetime keeps milliseconds at most.
+        microsecond = 678000 if connection.features.supports_microsecond_precision else 0
+        self.assertEqual(param, value.replace(microsecond=microsecond))
+
+    def test_other_columns_are_left_alone(self):
+        param, = self.compile(Reading.objects.filter(value=1))
+        self.assertIs(type(param), int)
+        param, = self.compile(Author.objects.filter(name='Anna'))
+        self.assertIs(type(param), str)
+
+    def test_disabled(self):
+        param, = self.compile(Reading.objects.filter(sensor='a'), match=False)
+        self.assertIs(type(param), str)
+
+    def test_warn_column_type_mismatch(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            param, = self.compile(Reading.objects.filter(sensor='a'), match=False, warn=True)
+        self.assertIs(type(param), str)
+        self.assertEqual(len(caught), 1)
+        self.assertIs(caught[0].category, RuntimeWarning)
+        self.assertIn('sensor', str(caught[0].message))
+
+
+class TruncatedDateFilterTests(SimpleTestCase):
+    def compile(self, queryset):
+        with mock.patch.object(connection.ops, '_ss_ver', 2016):
+            return queryset.query.get_compiler(connection=connection).as_sql()
+
+    def test_date_lookup(self):
+        sql, params = self.compile(Reading.objects.filter(recorded__date=datetime.date(2018, 1, 2)))
+        self.assertIn('[recorded] >= %s AND [pyodbc_backend_reading].[recorded] < %s', sql)
+        self.assertNotIn('CAST', sql)
+        self.assertEqual(params, (datetime.datetime(2018, 1, 2), datetime.datetime(2018, 1, 3)))
+
+    def test_trunc_comparisons(self):
+        queryset = Reading.objects.annotate(month=TruncMonth('recorded'))
+        for lookup, value, expected in (
+                ('month', datetime.datetime(2018, 1, 1), (datetime.datetime(2018, 1, 1), datetime.datetime(2018, 2, 1))),
+                ('month__gt', datetime.datetime(2018, 1, 1), (datetime.datetime(2018, 2, 1),)),
+                ('month__gte', datetime.datetime(2018, 1, 1), (datetime.datetime(2018, 1, 1),)),
+                ('month__gte', datetime.datetime(2018, 1, 15), (datetime.datetime(2018, 2, 1),)),
+                ('month__lt', datetime.datetime(2018, 1, 1), (datetime.datetime(2018, 1, 1),)),
+                ('month__lt', datetime.datetime(2018, 1, 15), (datetime.datetime(2018, 2, 1),)),
+                ('month__lte', datetime.datetime(2018, 1, 15), (datetime.datetime(2018, 2, 1),)),
+                ('month', datetime.datetime(2018, 12, 1), (datetime.datetime(2018, 12, 1), datetime.datetime(2019, 1, 1)))):
+            with self.subTest(lookup=lookup, value=value):
+                sql, params = self.compile(queryset.filter(**{lookup: value}))
+                where = sql.split(' WHERE ')[1]
+                self.assertNotIn('DATEADD', where)
+                self.assertEqual(params, expected)
+
+    def test_unaligned_exact_is_left_alone(self):
+        # No month starts at that value, so there's no range to compile.
+        sql, params = self.compile(
+            Reading.objects.annotate(month=TruncMonth('recorded')).filter(month=datetime.datetime(2018, 1, 15)))
+        self.assertIn('DATEADD(month', sql.split(' WHERE ')[1])
+
+    @override_settings(USE_TZ=True, TIME_ZONE='America/Chicago')
+    def test_bounds_in_current_time_zone(self):
+        sql, params = self.compile(
+            Reading.objects.annotate(day=TruncDay('recorded')).filter(day=timezone.make_aware(datetime.datetime(2018, 7, 1))))
+        utc = timezone.utc
+        self.assertEqual(params, (
+            datetime.datetime(2018, 7, 1, 5, tzinfo=utc), datetime.datetime(2018, 7, 2, 5, tzinfo=utc)))
+
+    def test_trunc_sql(self):
+        ops = connection.ops
+        with mock.patch.object(ops, '_ss_ver', 2022):
+            self.assertEqual(ops.datetime_trunc_sql('month', 'd', None), 'DATETRUNC(month, d)')
+        with mock.patch.object(ops, '_ss_ver', 2016):
+            self.assertEqual(ops.datetime_trunc_sql('month', 'd', None), 'DATEADD(month, DATEDIFF(month, 0, d), 0)')
+            # Seconds are counted from the start of the day, which fits DATEDIFF's int.
+            self.assertEqual(
+                ops.datetime_trunc_sql('second', 'd', None),
+                'DATEADD(second, DATEDIFF(second, DATEADD(day, DATEDIFF(day, 0, d), 0), d), '
+                'DATEADD(day, DATEDIFF(day, 0, d), 0))')
+
+    @override_settings(USE_TZ=True)
+    def test_time_zone_offset_in_minutes(self):
+        self.assertEqual(connection.ops.datetime_extract_sql('hour', 'd', 'Asia/Kolkata'),
+                         'DATEPART(hour, DATEADD(minute, 330, d))')
+        self.assertEqual(connection.ops.datetime_extract_sql('hour', 'd', 'UTC'), 'DATEPART(hour, d)')
+
+
+class DatePartFilterTests(SimpleTestCase):
+    def compile(self, queryset):
+        with mock.patch.object(connection.ops, '_ss_ver', 2016):
+            sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+        return sql.split(' WHERE ')[1], params
+
+    def test_year(self):
+        where, params = self.compile(Reading.objects.filter(recorded__year=2018))
+        self.assertNotIn('BETWEEN', where)
+        self.assertEqual(params, (datetime.datetime(2018, 1, 1), datetime.datetime(2019, 1, 1)))
+        where, params = self.compile(Reading.objects.filter(recorded__year__gt=2018))
+        self.assertEqual(params, (datetime.datetime(2019, 1, 1),))
+        where, params = self.compile(Reading.objects.filter(recorded__year__lte=2018))
+        self.assertEqual(params, (datetime.datetime(2019, 1, 1),))
+
+    def test_year_month_day(self):
+        where, params = self.compile(
+            Reading.objects.filter(recorded__year=2018, recorded__month=12, recorded__day=31, sensor='a'))
+        self.assertNotIn('DATEPART', where)
+        self.assertIn('[sensor] = %s', where)
+        self.assertEqual(sorted(params, key=str), [
+            datetime.datetime(2018, 12, 31), datetime.datetime(2019, 1, 1), 'a'])
+
+    def test_year_quarter(self):
+        where, params = self.compile(Reading.objects.filter(recorded__year=2018, recorded__quarter=2))
+        self.assertNotIn('DATEPART', where)
+        self.assertEqual(params, (datetime.datetime(2018, 4, 1), datetime.datetime(2018, 7, 1)))
+
+    def test_parts_left_alone(self):
+        # A month on its own is no single range.
+        where, params = self.compile(Reading.objects.filter(recorded__month=3))
+        self.assertIn('DATEPART(month', where)
+        self.assertEqual(params, (3,))
+        # A day without a month isn't either.
+        where, params = self.compile(Reading.objects.filter(recorded__year=2018, recorded__day=3))
+        self.assertIn('DATEPART(day', where)
+        # Nor is a date that doesn't exist.
+        where, params = self.compile(Reading.objects.filter(recorded__year=2018, recorded__month=2, recorded__day=30))
+        self.assertIn('DATEPART(day', where)
+
+    def test_or_is_left_alone(self):
+        where, params = self.compile(Reading.objects.filter(
+            models.Q(recorded__year=2018) | models.Q(recorded__month=3)))
+        self.assertIn('DATEPART(month', where)
+
+
+class CaseInsensitiveLookupTests(SimpleTestCase):
+    def compile(self, queryset, collation, configured=None):
+        with mock.patch.object(connection.introspection, 'get_column_collation', lambda table, column: collation), \
+                mock.patch.object(connection, 'collation', configured, create=True):
+            sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+        return sql.split(' WHERE ')[1], params
+
+    def test_is_case_insensitive(self):
+        ops = connection.ops
+        self.assertTrue(ops.is_case_insensitive('SQL_Latin1_General_CP1_CI_AS'))
+        self.assertTrue(ops.is_case_insensitive('Latin1_General_100_CI_AI_SC_UTF8'))
+        self.assertTrue(ops.is_case_insensitive('Japanese_CI'))
+        self.assertFalse(ops.is_case_insensitive('Latin1_General_CS_AS'))
+        self.assertFalse(ops.is_case_insensitive('Latin1_General_BIN2'))
+        self.assertFalse(ops.is_case_insensitive(None))
+
+    def test_case_insensitive_collation(self):
+        for lookup, value in (('iexact', 'anna'), ('icontains', 'nn'), ('istartswith', 'an'), ('iendswith', 'na')):
+            with self.subTest(lookup=lookup):
+                where, params = self.compile(
+                    Author.objects.filter(**{'name__%s' % lookup: value}), 'SQL_Latin1_General_CP1_CI_AS')
+                self.assertNotIn('UPPER', where)
+
+    def test_case_sensitive_collation(self):
+        where, params = self.compile(Author.objects.filter(name__iexact='anna'), 'Latin1_General_CS_AS')
+        self.assertIn('UPPER', where)
+
+    def test_configured_collation_governs_like(self):
+        # The LIKE operators are given the configured collation, whatever the column's.
+        where, params = self.compile(
+            Author.objects.filter(name__icontains='nn'), 'SQL_Latin1_General_CP1_CI_AS', 'Latin1_General_CS_AS')
+        self.assertIn('UPPER', where)
+        where, params = self.compile(
+            Author.objects.filter(name__icontains='nn'), 'Latin1_General_CS_AS', 'Latin1_General_CI_AS')
+        self.assertNotIn('UPPER', where)
+
+
+class ReturningInsertTests(SimpleTestCase):
+    def compile(self, has_triggers=False, version=2016):
+        query = InsertQuery(Author)
+        query.insert_values([Author._meta.get_field('name')], [Author(name='Anna')])
+        compiler = query.get_compiler(connection=connection)
+        compiler.return_id = True
+        with mock.patch.object(connection.introspection, 'has_triggers', lambda table: has_triggers), \
+                mock.patch.object(connection.ops, '_ss_ver', version):
+            (sql, params), = compiler.as_sql()
+        return sql, params
+
+    def test_output_inserted(self):
+        self.assertEqual(self.compile(), (
+            'INSERT INTO [pyodbc_backend_author] ([name]) OUTPUT INSERTED.[id] VALUES (%s)', ('Anna',)))
+
+    def test_scope_identity(self):
+        # OUTPUT without INTO is refused on tables with triggers, and SQL Server 2000 has no OUTPUT.
+        expected = (
+            'INSERT INTO [pyodbc_backend_author] ([name]) VALUES (%s); SELECT CAST(SCOPE_IDENTITY() AS bigint)',
+            ('Anna',))
+        self.assertEqual(self.compile(has_triggers=True), expected)
+        self.assertEqual(self.compile(version=2000), expected)
+
+    def test_id_after_row_counts(self):
+        cursor = mock.Mock(description=None)
+
+        def nextset():
+            cursor.description = [('id',)]
+            return True
+        cursor.nextset.side_effect = nextset
+        cursor.fetchone.return_value = (7,)
+        self.assertEqual(connection.ops.fetch_returned_insert_id(cursor), 7)
+        self.assertEqual(cursor.nextset.call_count, 1)
+
+
+class TriggerInsertTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_create_on_table_with_trigger(self):
+        table = connection.ops.quote_name(Author._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TRIGGER [pyodbc_backend_author_touch] ON %s AFTER INSERT AS '
+                'UPDATE %s SET [name] = [name] WHERE [id] IN (SELECT [id] FROM inserted)' % (table, table))
+        try:
+            connection.introspection._has_triggers = {}
+            author = Author.objects.create(name='Anna')
+            self.assertEqual(Author.objects.get(pk=author.pk).name, 'Anna')
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TRIGGER [pyodbc_backend_author_touch]')
+            connection.introspection._has_triggers = {}
+
+    def test_create_returns_pk(self):
+        first = Author.objects.create(name='Anna')
+        second = Author.objects.create(name='Ben')
+        self.assertEqual(second.pk, Author.objects.get(name='Ben').pk)
+        self.assertGreater(second.pk, first.pk)
+
+
+class BatchCursor(object):
+    """
+    Answers each batch with the given result sets (lists of rows, or None for
+    a row count), and records it.
+    """
+    def __init__(self, *results):
+        self.results = list(results)
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+        self.sets = self.results.pop(0)
+        self.description = self.sets and self.sets[0] is not None and [('c',)] or None
+
+    def fetchone(self):
+        return self.sets[0][0]
+
+    def nextset(self):
+        self.sets = self.sets[1:]
+        self.description = self.sets and self.sets[0] is not None and [('c',)] or None
+        return bool(self.sets)
+
+
+class WriteBatchTests(SimpleTestCase):
+    def batch(self, *results):
+        cursor = BatchCursor(*results)
+        return WriteBatch(mock.Mock(cursor=lambda: cursor)), cursor
+
+    def test_flush(self):
+        batch, cursor = self.batch([None, [(7,)], [(1,)]])
+        ids = []
+        batch.add('INSERT a', [1, 2])
+        batch.add('INSERT b', [3], lambda row: ids.append(row[0]))
+        batch.add('UPDATE c', [4], lambda row: ids.append(row[0]))
+        self.assertEqual(len(batch), 3)
+        batch.flush()
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(cursor.executed, [
+            ('SET NOCOUNT ON;\nINSERT a;\nINSERT b;\nUPDATE c;\nSET NOCOUNT OFF', [1, 2, 3, 4]),
+        ])
+        self.assertEqual(ids, [7, 1])
+
+    def test_split_at_max_params(self):
+        batch, cursor = self.batch([None], [None])
+        batch.add('INSERT a', range(2000))
+        batch.add('INSERT b', range(101))
+        batch.flush()
+        self.assertEqual([len(params) for sql, params in cursor.executed], [2000, 101])
+
+    def test_missing_result_sets(self):
+        batch, cursor = self.batch([None])
+        batch.add('INSERT a', [], lambda row: None)
+        with self.assertRaisesMessage(DatabaseError, 'The batch returned 0 result sets, 1 were expected.'):
+            batch.flush()
+
+    def test_discard(self):
+        batch, cursor = self.batch()
+        batch.add('INSERT a', [])
+        batch.discard()
+        batch.flush()
+        self.assertEqual(cursor.executed, [])
+
+    def test_check_updated(self):
+        check_updated('UPDATE a')((1,))
+        with self.assertRaisesMessage(DatabaseError, 'A batched update matched no rows: UPDATE a'):
+            check_updated('UPDATE a')((0,))
+
+
+class InternalCursorTests(SimpleTestCase):
+    def test_internal_statements_leave_writes_queued(self):
+        db_wrpr = mock.Mock(normalize_params=False, match_column_types=False)
+        cursor = CursorWrapper(mock.Mock(), True, db_wrpr=db_wrpr)
+        cursor.execute('SELECT 1')
+        self.assertEqual(db_wrpr._flush_writes.call_count, 1)
+        cursor.flushes_writes = False
+        cursor.execute('SELECT 1')
+        cursor.executemany('INSERT a VALUES (%s)', [(1,)])
+        self.assertEqual(db_wrpr._flush_writes.call_count, 1)
+
+
+class BatchWritesTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_writes_sent_as_one_batch(self):
+        Metric.objects.create(recorded=datetime.datetime(2018, 1, 1), value=1)
+        with self.assertNumQueries(1):
+            with connection.batch_writes():
+                authors = [Author.objects.create(name=name) for name in ('Anna', 'Ben')]
+                Author.objects.filter(name='Ben').update(name='Benjamin')
+                Metric.objects.all().delete()
+        self.assertEqual(
+            list(Author.objects.order_by('pk').values_list('pk', 'name')),
+            [(authors[0].pk, 'Anna'), (authors[1].pk, 'Benjamin')])
+        self.assertFalse(Metric.objects.exists())
+
+    def test_not_flushed_by_internal_lookups(self):
+        # The trigger check of each table and the sequence range are read
+        # while the writes are queued, and leave them queued.
+        connection.introspection._has_triggers = {}
+        connection.ops.forget_sequence_range(Event._meta.pk.get_sequence_name(connection))
+        with connection.batch_writes():
+            Author.objects.create(name='Anna')
+            Event.objects.create(name='Launch')
+            Author.objects.create(name='Ben')
+            self.assertEqual(len(connection._write_batch), 3)
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_flushed_before_reads(self):
+        with connection.batch_writes():
+            author = Author.objects.create(name='Anna')
+            self.assertEqual(list(Author.objects.values_list('pk', flat=True)), [author.pk])
+
+    def test_update_of_missing_row(self):
+        author = Author.objects.create(name='Anna')
+        Author.objects.filter(pk=author.pk).delete()
+        author.name = 'Ben'
+        with self.assertRaisesMessage(DatabaseError, 'A batched update matched no rows'):
+            with connection.batch_writes():
+                author.save()
+        self.assertFalse(Author.objects.exists())
+
+    def test_discarded_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with connection.batch_writes():
+                Author.objects.create(name='Anna')
+                raise ValueError
+        self.assertFalse(Author.objects.exists())
+
+
+class IdentityInsertTests(SimpleTestCase):
+    def setUp(self):
+        self.cursor = ScriptedCursor()
+        # SimpleTestCase has replaced connection.cursor already, and expects
+        # to find its replacement there again.
+        self.addCleanup(setattr, connection, 'cursor', connection.cursor)
+        connection.cursor = lambda: self.cursor
+        patcher = mock.patch.object(connection, '_identity_insert_table', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_switched_once_per_block(self):
+        with connection.identity_insert(Author):
+            with connection.identity_insert(Author):
+                pass
+            with connection.identity_insert('pyodbc_backend_book'):
+                pass
+        self.assertEqual(self.cursor.executed, [
+            'SET IDENTITY_INSERT [pyodbc_backend_author] ON;',
+            'SET IDENTITY_INSERT [pyodbc_backend_author] OFF;\nSET IDENTITY_INSERT [pyodbc_backend_book] ON;',
+            'SET IDENTITY_INSERT [pyodbc_backend_book] OFF;\nSET IDENTITY_INSERT [pyodbc_backend_author] ON;',
+            'SET IDENTITY_INSERT [pyodbc_backend_author] OFF;',
+        ])
+        self.assertIsNone(connection._identity_insert_table)
+
+    def test_inserts_not_wrapped_inside_block(self):
+        query = InsertQuery(Author)
+        query.insert_values(Author._meta.local_concrete_fields, [Author(pk=1, name='Anna')])
+        (sql, params), = query.get_compiler(connection=connection).as_sql()
+        self.assertTrue(sql.startswith('SET IDENTITY_INSERT [pyodbc_backend_author] ON;'))
+        with connection.identity_insert(Author):
+            (sql, params), = query.get_compiler(connection=connection).as_sql()
+        self.assertTrue(sql.startswith('INSERT INTO [pyodbc_backend_author]'))
+        self.assertNotIn('IDENTITY_INSERT', sql)
+
+
+class BulkIdentityInsertTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_bulk_create_with_keys(self):
+        Author.objects.bulk_create([Author(pk=10, name='Anna'), Author(pk=20, name='Ben')])
+        self.assertEqual(list(Author.objects.order_by('pk').values_list('pk', 'name')), [(10, 'Anna'), (20, 'Ben')])
+
+    def test_switched_once_per_batch(self):
+        # Without multi-row VALUES each row is its own INSERT.
+        with mock.patch.object(connection.features, 'has_bulk_insert', False), \
+                CaptureQueriesContext(connection) as captured:
+            Author.objects.bulk_create([Author(pk=pk, name=str(pk)) for pk in (1, 2, 3)])
+        self.assertEqual(sum(query['sql'].count('IDENTITY_INSERT') for query in captured), 2)
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertIsNone(connection._identity_insert_table)
+
+    def test_block_across_bulk_creates(self):
+        with CaptureQueriesContext(connection) as captured:
+            with connection.identity_insert(Author):
+                for pk in (1, 2, 3):
+                    Author.objects.bulk_create([Author(pk=pk, name=str(pk))])
+        self.assertEqual(sum(query['sql'].count('IDENTITY_INSERT') for query in captured), 2)
+        self.assertEqual(Author.objects.count(), 3)
+
+
+class SliceParameterTests(SimpleTestCase):
+    def compile(self, queryset, version=2016):
+        with mock.patch.object(connection.ops, '_ss_ver', version):
+            return queryset.query.get_compiler(connection=connection).as_sql()
+
+    def test_top(self):
+        sql, params = self.compile(Author.objects.filter(name='Anna')[:5])
+        self.assertTrue(sql.startswith('SELECT TOP (%s) '))
+        self.assertEqual(params, (5, 'Anna'))
+        sql, params = self.compile(Author.objects.distinct()[:5])
+        self.assertTrue(sql.startswith('SELECT DISTINCT TOP (%s) '))
+        self.assertEqual(params, (5,))
+
+    def test_row_number_bounds(self):
+        sql, params = self.compile(Author.objects.filter(name='Anna').order_by('name')[10:20])
+        self.assertIn('_row_num > %s and _row_num <= %s', sql)
+        self.assertEqual(params, ('Anna', 10, 20))
+        sql, params = self.compile(Author.objects.order_by('name')[10:])
+        self.assertIn('_row_num > %s', sql)
+        self.assertNotIn('_row_num <=', sql)
+        self.assertEqual(params, (10,))
+
+    def test_pages_share_sql(self):
+        queryset = Author.objects.order_by('name')
+        self.assertEqual(self.compile(queryset[10:20])[0], self.compile(queryset[40:60])[0])
+
+    def test_literal_top_on_sql_server_2000(self):
+        sql, params = self.compile(Author.objects.filter(name='Anna')[:5], version=2000)
+        self.assertTrue(sql.startswith('SELECT TOP 5 '))
+        self.assertEqual(params, ('Anna',))
+
+
+class PreparedQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.anna = Author.objects.create(name='Anna')
+        cls.bob = Author.objects.create(name='Bob')
+
+    def test_runs_with_new_values(self):
+        by_name = prepare(lambda: Author.objects.filter(name=P('name')))
+        self.assertEqual(list(by_name(name='Anna')), [self.anna])
+        self.assertEqual(list(by_name(name='Bob')), [self.bob])
+
+    def test_values_list(self):
+        names = prepare(lambda: Author.objects.filter(pk__gt=P('pk')).values_list('name', flat=True))
+        self.assertEqual(names(pk=self.anna.pk), ['Bob'])
+
+    def test_factory_called_once(self):
+        factory = mock.Mock(side_effect=lambda: Author.objects.filter(name=P('name')))
+        by_name = prepare(factory)
+        by_name(name='Anna')
+        with self.assertNumQueries(1):
+            self.assertEqual(list(by_name(name='Bob')), [self.bob])
+        self.assertEqual(factory.call_count, 1)
+
+    def test_values(self):
+        by_name = prepare(lambda: Author.objects.filter(name=P('name')).values('pk', 'name'))
+        self.assertEqual(by_name(name='Anna'), [{'pk': self.anna.pk, 'name': 'Anna'}])
+
+    def test_select_related_and_annotations(self):
+        book = Book.objects.create(title='Notes')
+        Chapter.objects.create(book=book, title='One')
+        chapters = prepare(lambda: Chapter.objects.select_related('book').annotate(
+            book_title=models.F('book__title')).filter(book__title=P('title')))
+        chapter, = chapters(title='Notes')
+        with self.assertNumQueries(0):
+            self.assertEqual(chapter.book, book)
+        self.assertEqual(chapter.book_title, 'Notes')
+
+    def test_values_prepared_for_their_field(self):
+        # The field turns the string into the int it's compared with.
+        by_pk = prepare(lambda: Author.objects.filter(pk=P('pk')))
+        self.assertEqual(list(by_pk(pk=str(self.anna.pk))), [self.anna])
+
+    def test_values_are_typed_like_their_column(self):
+        with mock.patch.object(connection, 'match_column_types', True), \
+                mock.patch.object(connection.introspection, 'get_column_type', lambda table, column: 'varchar'):
+            compiled = CompiledQuery(Author.objects.filter(name=P('name')), 'default')
+        # The column's type was read when the query was compiled, so binding
+        # doesn't go back to the catalog, on whichever thread it runs.
+        with mock.patch.object(connection, 'match_column_types', True), \
+                mock.patch.object(connection.introspection, 'get_column_type', side_effect=AssertionError):
+            params = compiled.bind({'name': 'Anna'})
+        self.assertIsInstance(params[0], VarCharParam)
+
+    def test_lookups_transforming_their_value(self):
+        for lookup in ('contains', 'icontains', 'startswith', 'endswith', 'iexact', 'in', 'range'):
+            value = [P('name')] if lookup == 'in' else (P('name'), P('other')) if lookup == 'range' else P('name')
+            with self.subTest(lookup=lookup):
+                with self.assertRaisesMessage(TypeError, "can only be the value of an exact, gt, gte, lt or lte lookup."):
+                    CompiledQuery(Author.objects.filter(**{'name__%s' % lookup: value}), 'default')
+
+    def test_missing_and_unexpected_values(self):
+        compiled = CompiledQuery(Author.objects.filter(name=P('name')), 'default')
+        with self.assertRaisesMessage(TypeError, 'Missing values for name.'):
+            compiled.bind({})
+        with self.assertRaisesMessage(TypeError, 'Unexpected values for pk.'):
+            compiled.bind({'name': 'Anna', 'pk': 1})
+
+    def test_none_is_refused(self):
+        compiled = CompiledQuery(Author.objects.filter(name=P('name')), 'default')
+        with self.assertRaisesMessage(ValueError, 'isnull'):
+            compiled.bind({'name': None})
+
+    def test_unsupported_querysets(self):
+        with self.assertRaises(TypeError):
+            CompiledQuery(Book.objects.prefetch_related('authors'), 'default')
+        with self.assertRaises(TypeError):
+            CompiledQuery(Book.objects.create(title='Notes').chapter_set.all(), 'default')
+        with self.assertRaises(ValueError):
+            CompiledQuery(Author.objects.filter(pk__in=[]), 'default')
+        with self.assertRaises(ValueError):
+            CompiledQuery(Author.objects.all()[0:0], 'default')
+
+
+class SequenceAutoFieldTests(TestCase):
+    multi_db = True
+
+    def test_save_draws_a_key(self):
+        first = Event.objects.create(name='first')
+        second = Event.objects.create(name='second')
+        self.assertIsNotNone(first.pk)
+        self.assertEqual(second.pk, first.pk + 1)
+        self.assertEqual(Event.objects.get(pk=second.pk).name, 'second')
+
+    def test_bulk_create_sets_keys(self):
+        events = Event.objects.bulk_create([Event(name='a'), Event(name='b')])
+        self.assertEqual(
+            sorted(Event.objects.values_list('pk', flat=True)),
+            sorted(event.pk for event in events))
+
+    def test_key_comes_from_the_target_database(self):
+        sequence = Event._meta.pk.get_sequence_name(connections['other'])
+        operations._sequence_ranges.pop(('other', sequence), None)
+        event = Event.objects.using('other').create(name='other')
+        self.assertEqual(operations._sequence_ranges[('other', sequence)][0], event.pk + 1)
+
+    def test_range_is_reserved_once(self):
+        sequence = Event._meta.pk.get_sequence_name(connection)
+        operations._sequence_ranges.pop(('default', sequence), None)
+        with self.assertNumQueries(2):
+            first = Event.objects.create(name='first')
+        # The other nine keys of the range come without asking the server.
+        with self.assertNumQueries(9):
+            events = [Event.objects.create(name=str(i)) for i in range(9)]
+        self.assertEqual([event.pk for event in events], list(range(first.pk + 1, first.pk + 10)))
+        with self.assertNumQueries(2):
+            Event.objects.create(name='last')
+
+
+@isolate_apps('pyodbc_backend')
+class SequenceSchemaTests(SimpleTestCase):
+    def test_deconstruct(self):
+        name, path, args, kwargs = SequenceAutoField().deconstruct()
+        self.assertEqual(path, 'django_pyodbc.fields.SequenceAutoField')
+        self.assertEqual(kwargs, {})
+        name, path, args, kwargs = SequenceAutoField(
+            primary_key=False, sequence_name='ids', range_size=10).deconstruct()
+        self.assertEqual(kwargs, {'primary_key': False, 'sequence_name': 'ids', 'range_size': 10})
+
+    def test_needs_sql_server_2012(self):
+        field = SequenceAutoField()
+        field.set_attributes_from_name('id')
+        with mock.patch.object(connection.ops, '_ss_ver', 2008):
+            with self.assertRaisesMessage(NotSupportedError, 'SequenceAutoField needs SQL Server 2012 or later.'):
+                field.next_value(connection)
+
+    def test_create_and_rename(self):
+        class Ticket(models.Model):
+            id = BigSequenceAutoField()
+
+            class Meta:
+                app_label = 'pyodbc_backend'
+
+        with mock.patch.object(connection.ops, '_ss_ver', 2016), \
+                connection.schema_editor(collect_sql=True, atomic=False) as editor:
+            editor.create_model(Ticket)
+            editor.alter_db_table(Ticket, 'pyodbc_backend_ticket', 'pyodbc_backend_ticket2')
+        self.assertEqual(
+            editor.collected_sql[0],
+            'CREATE SEQUENCE [pyodbc_backend_ticket_id_seq] AS bigint START WITH 1 INCREMENT BY 1;')
+        self.assertIn('[id] bigint NOT NULL PRIMARY KEY', editor.collected_sql[1])
+        self.assertNotIn('IDENTITY', editor.collected_sql[1])
+        self.assertEqual(
+            editor.collected_sql[-1],
+            "EXEC sp_rename N'[pyodbc_backend_ticket_id_seq]', N'pyodbc_backend_ticket2_id_seq';")
+
+    def test_ranges_forgotten_with_their_sequence(self):
+        class Ticket(models.Model):
+            id = SequenceAutoField()
+
+            class Meta:
+                app_label = 'pyodbc_backend'
+
+        for sequence in ('pyodbc_backend_ticket_id_seq', 'pyodbc_backend_ticket2_id_seq'):
+            operations._sequence_ranges[('default', sequence)] = [5, 100]
+            self.addCleanup(operations._sequence_ranges.pop, ('default', sequence), None)
+        with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+            editor.alter_db_table(Ticket, 'pyodbc_backend_ticket', 'pyodbc_backend_ticket2')
+            self.assertNotIn(('default', 'pyodbc_backend_ticket_id_seq'), operations._sequence_ranges)
+            self.assertNotIn(('default', 'pyodbc_backend_ticket2_id_seq'), operations._sequence_ranges)
+            operations._sequence_ranges[('default', 'pyodbc_backend_ticket_id_seq')] = [5, 100]
+            editor.delete_model(Ticket)
+        self.assertNotIn(('default', 'pyodbc_backend_ticket_id_seq'), operations._sequence_ranges)
+        self.assertEqual(editor.collected_sql[-1], 'DROP SEQUENCE [pyodbc_backend_ticket_id_seq];')
+
+    def test_alter_field(self):
+        class Ticket(models.Model):
+            id = models.IntegerField(primary_key=True)
+
+            class Meta:
+                app_label = 'pyodbc_backend'
+
+        old_field = Ticket._meta.pk
+        new_field = SequenceAutoField()
+        new_field.set_attributes_from_name('id')
+        new_field.model = Ticket
+        renamed_field = SequenceAutoField(sequence_name='ticket_ids')
+        renamed_field.set_attributes_from_name('id')
+        renamed_field.model = Ticket
+        with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+            editor.alter_field(Ticket, old_field, new_field)
+            editor.alter_field(Ticket, new_field, renamed_field)
+            editor.alter_field(Ticket, renamed_field, old_field)
+        self.assertEqual(editor.collected_sql, [
+            'DECLARE @start bigint; SELECT @start = ISNULL(MAX([id]), 0) + 1 FROM [pyodbc_backend_ticket]; '
+            "EXEC (N'CREATE SEQUENCE [pyodbc_backend_ticket_id_seq] AS int START WITH ' "
+            "+ CAST(@start AS nvarchar(20)) + N' INCREMENT BY 1');",
+            "EXEC sp_rename N'[pyodbc_backend_ticket_id_seq]', N'ticket_ids';",
+            'DROP SEQUENCE [ticket_ids];',
+        ])
+
+
+class SequenceAlterFieldTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    @isolate_apps('pyodbc_backend')
+    def test_sequence_starts_after_existing_keys(self):
+        class Ticket(models.Model):
+            id = models.IntegerField(primary_key=True)
+
+            class Meta:
+                app_label = 'pyodbc_backend'
+
+        new_field = SequenceAutoField()
+        new_field.set_attributes_from_name('id')
+        new_field.model = Ticket
+        with connection.schema_editor() as editor:
+            editor.create_model(Ticket)
+        try:
+            Ticket.objects.bulk_create([Ticket(id=1), Ticket(id=7)])
+            with connection.schema_editor() as editor:
+                editor.alter_field(Ticket, Ticket._meta.pk, new_field)
+            self.assertEqual(new_field.next_value(connection), 8)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.alter_field(Ticket, new_field, Ticket._meta.pk)
+                editor.delete_model(Ticket)
+
+
+class PartitioningTests(TestCase):
+    @isolate_apps('pyodbc_backend')
+    def test_unique_columns_of_partitioned_tables(self):
+        class Reading(models.Model):
+            recorded = models.DateTimeField(unique=True)
+            serial = models.CharField(max_length=20, unique=True)
+
+            class Meta:
+                db_tablespace = 'ps_monthly(recorded)'
+
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Reading)
+        create_table = editor.collected_sql[0]
+        self.assertIn('[recorded] datetime NOT NULL UNIQUE ON [ps_monthly]([recorded])', create_table)
+        self.assertIn('[serial] nvarchar(20) NOT NULL UNIQUE ON [default]', create_table)
+        self.assertIn('PRIMARY KEY CLUSTERED ([id], [recorded]) ON [ps_monthly]([recorded])', editor.collected_sql[1])
+
+    def test_parse_partition_scheme(self):
+        self.assertEqual(parse_partition_scheme('ps_monthly(recorded)'), ('ps_monthly', 'recorded'))
+        self.assertEqual(parse_partition_scheme(' ps_monthly ( recorded ) '), ('ps_monthly', 'recorded'))
+        self.assertIsNone(parse_partition_scheme('archive'))
+        self.assertIsNone(parse_partition_scheme(''))
+
+    def test_month_boundaries(self):
+        self.assertEqual(month_boundaries(datetime.date(2016, 11, 15), datetime.date(2017, 2, 1)), [
+            datetime.date(2016, 11, 1), datetime.date(2016, 12, 1),
+            datetime.date(2017, 1, 1), datetime.date(2017, 2, 1),
+        ])
+
+    def test_switch_and_truncate_sql(self):
+        qn = connection.ops.quote_name
+        with connection.schema_editor(collect_sql=True) as editor:
+            quote_value = editor.quote_value
+        self.assertEqual(
+            switch_partition_sql(qn, 'reading', 2, 'reading_archive'),
+            'ALTER TABLE [reading] SWITCH PARTITION 2 TO [reading_archive]')
+        self.assertEqual(
+            switch_partition_sql(qn, 'reading', datetime.date(2017, 1, 1), 'reading_archive',
+                                 to_partitioned=True, function='pf_monthly', quote_value=quote_value),
+            "ALTER TABLE [reading] SWITCH PARTITION $PARTITION.[pf_monthly]('2017-01-01') "
+            "TO [reading_archive] PARTITION $PARTITION.[pf_monthly]('2017-01-01')")
+        self.assertEqual(
+            truncate_partitions_sql(qn, 'reading', [1, 2]),
+            'TRUNCATE TABLE [reading] WITH (PARTITIONS (1, 2))')
+
+    def test_partition_function_needs_input_type(self):
+        with self.assertRaises(TypeError):
+            CreatePartitionFunction('pf_monthly', [datetime.date(2017, 1, 1)])
+        operation = CreatePartitionFunction('pf_monthly', [datetime.date(2017, 1, 1)], 'date')
+        with connection.schema_editor(collect_sql=True) as editor:
+            operation.database_forwards('pyodbc_backend', editor, None, None)
+        self.assertEqual(editor.collected_sql, [
+            "CREATE PARTITION FUNCTION [pf_monthly] (date) AS RANGE RIGHT FOR VALUES ('2017-01-01');",
+        ])
+
+
+class AsyncConnectionTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.pool = WorkerPool('default', 1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.loop.close()
+
+    def connect(self):
+        conn = AsyncConnection('default', loop=self.loop)
+        conn.pool = self.pool
+        return conn
+
+    def test_aexecute(self):
+        Author.objects.create(name='Anna')
+
+        async def query():
+            async with self.connect() as conn:
+                cursor = await conn.aexecute('SELECT name FROM pyodbc_backend_author')
+                return await cursor.afetchall()
+
+        self.assertEqual([tuple(row) for row in self.loop.run_until_complete(query())], [('Anna',)])
+
+    def test_astream(self):
+        Author.objects.bulk_create([Author(name='Author %02d' % i) for i in range(25)])
+
+        async def stream():
+            names = []
+            async with self.connect() as conn:
+                async for row in conn.astream('SELECT name FROM pyodbc_backend_author ORDER BY name', chunk_size=10):
+                    names.append(row[0])
+            return names
+
+        self.assertEqual(self.loop.run_until_complete(stream()), ['Author %02d' % i for i in range(25)])
+
+    def test_run_keeps_the_connection(self):
+        # A transaction spans awaits, because every call runs on one worker.
+        async def rolled_back():
+            async with self.connect() as conn:
+                await conn.run(transaction.set_autocommit, False)
+                await conn.run(Author.objects.create, name='Bob')
+                count = await conn.run(Author.objects.count)
+                await conn.run(transaction.rollback)
+                await conn.run(transaction.set_autocommit, True)
+            return count
+
+        self.assertEqual(self.loop.run_until_complete(rolled_back()), 1)
+        self.assertEqual(Author.objects.count(), 0)
+
+    def test_cancelled_acquire_releases_the_worker(self):
+        conn = self.connect()
+
+        async def cancel_acquire():
+            held = self.pool.acquire()
+            task = self.loop.create_task(conn._acquire())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The waiting thread gets this worker, which must come back.
+            self.pool.release(held)
+            await asyncio.sleep(0.2)
+
+        self.loop.run_until_complete(cancel_acquire())
+        self.assertIsNone(conn._worker)
+        self.assertEqual(self.pool._idle.qsize(), 1)
+
+
+class GatherTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def setUp(self):
+        self.pool = pool._pools['default'] = WorkerPool('default', 2)
+
+    def tearDown(self):
+        del pool._pools['default']
+        self.pool.shutdown()
+
+    def test_results_in_order(self):
+        anna = Author.objects.create(name='Anna')
+        Book.objects.create(title='Notes')
+        authors, count, titles = gather(
+            Author.objects.all(),
+            lambda: Book.objects.count(),
+            Book.objects.values_list('title', flat=True),
+        )
+        self.assertEqual(authors, [anna])
+        self.assertEqual(count, 1)
+        self.assertEqual(titles, ['Notes'])
+
+    def test_atomic_block_sees_its_own_writes(self):
+        with transaction.atomic():
+            Author.objects.create(name='Anna')
+            authors, = gather(Author.objects.values_list('name', flat=True))
+        self.assertEqual(authors, ['Anna'])
+
+    def test_unexpected_arguments(self):
+        with self.assertRaises(TypeError):
+            gather(Author.objects.all(), timeout=1)
+
+
+class IntrospectionSnapshotTests(TestCase):
+    tables = ['pyodbc_backend_author', 'pyodbc_backend_book', 'pyodbc_backend_chapter']
+
+    def test_snapshot_reads_each_kind_once(self):
+        introspection = connection.introspection
+        with self.assertNumQueries(2):
+            with connection.cursor() as cursor:
+                with introspection.snapshot(self.tables):
+                    for table_name in self.tables:
+                        introspection.get_table_description(cursor, table_name)
+                        introspection.get_relations(cursor, table_name)
+
+    def test_table_description(self):
+        with connection.cursor() as cursor:
+            description = connection.introspection.get_table_description(cursor, 'pyodbc_backend_chapter')
+        self.assertEqual([column[0] for column in description], ['id', 'book_id', 'title'])
+        self.assertEqual(description[0][1], SQL_AUTOFIELD)
+        self.assertEqual(description[2][3], 100)
+
+    def test_relations(self):
+        with connection.cursor() as cursor:
+            relations = connection.introspection.get_relations(cursor, 'pyodbc_backend_chapter')
+            primary_key = connection.introspection.get_primary_key_column(cursor, 'pyodbc_backend_chapter')
+        self.assertEqual(relations, {'book_id': ('id', 'pyodbc_backend_book')})
+        self.assertEqual(primary_key, 'id')
+
+    def test_ss_inspectdb(self):
+        out = StringIO()
+        call_command('ss_inspectdb', 'pyodbc_backend_chapter', stdout=out)
+        self.assertIn("book = models.ForeignKey('PyodbcBackendBook', models.DO_NOTHING)", out.getvalue())
+
+    def test_snapshot_of_many_tables(self):
+        # The constraint query repeats the table names, which would exceed
+        # the 2100 parameters a query takes.
+        tables = self.tables + ['missing_%d' % i for i in range(1100)]
+        with connection.cursor() as cursor:
+            with connection.introspection.snapshot(tables):
+                relations = connection.introspection.get_relations(cursor, 'pyodbc_backend_chapter')
+        self.assertEqual(relations, {'book_id': ('id', 'pyodbc_backend_book')})
+
+
+class SchemaSnapshotFilterTests(SimpleTestCase):
+    def fetch(self, table_names, filters):
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = []
+        SchemaSnapshot(connection, table_names)._fetch(cursor, 'SELECT 1 WHERE %(where)s', filters)
+        (sql, params), kwargs = cursor.execute.call_args
+        return sql, params
+
+    def test_names_are_bound(self):
+        sql, params = self.fetch(['a', 'b'], 2)
+        self.assertIn('t.name IN (%s, %s)', sql)
+        self.assertEqual(params, ['a', 'b', 'a', 'b'])
+
+    def test_too_many_names(self):
+        table_names = ['t%d' % i for i in range(1051)]
+        sql, params = self.fetch(table_names, 1)
+        self.assertEqual(len(params), 1051)
+        sql, params = self.fetch(table_names, 2)
+        self.assertNotIn('t.name IN', sql)
+        self.assertEqual(params, [])
+
+
+class ConstraintIntrospectionTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def setUp(self):
+        # Read the server version, which the index query depends on, up front.
+        connection.ops.sql_server_ver
+
+    def get_constraints(self, table_name):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, table_name)
+
+    def test_two_queries(self):
+        with self.assertNumQueries(2):
+            self.get_constraints('pyodbc_backend_reading')
+
+    def test_index(self):
+        index = self.get_constraints('pyodbc_backend_reading')['reading_sensor_idx']
+        self.assertEqual(index['type'], 'idx')
+        self.assertEqual(index['columns'], ['sensor', 'recorded'])
+        self.assertEqual(index['orders'], ['ASC', 'DESC'])
+        self.assertTrue(index['index'])
+        self.assertFalse(index['clustered'])
+
+    def test_primary_key_unique_and_check(self):
+        constraints = self.get_constraints('pyodbc_backend_reading').values()
+        primary_key, = [c for c in constraints if c['primary_key']]
+        self.assertEqual(primary_key['columns'], ['id'])
+        self.assertTrue(primary_key['clustered'])
+        self.assertFalse(primary_key['index'])
+        unique, = [c for c in constraints if c['unique'] and not c['primary_key']]
+        self.assertEqual(unique['columns'], ['sensor', 'recorded'])
+        self.assertFalse(unique['index'])
+        check, = [c for c in constraints if c['check']]
+        self.assertEqual(check['columns'], ['value'])
+
+    def test_foreign_key(self):
+        foreign_key, = [c for c in self.get_constraints('pyodbc_backend_chapter').values() if c['foreign_key']]
+        self.assertEqual(foreign_key['columns'], ['book_id'])
+        self.assertEqual(foreign_key['foreign_key'], ('pyodbc_backend_book', 'id'))
+
+    def test_constraints_for_tables(self):
+        with self.assertNumQueries(2):
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints_for_tables(
+                    cursor, ['pyodbc_backend_book', 'pyodbc_backend_chapter'])
+        self.assertEqual(sorted(constraints), ['pyodbc_backend_book', 'pyodbc_backend_chapter'])
+
+    def test_alter_field_drops_index(self):
+        # The schema editor finds the index to drop by its 'idx' type.
+        old_field = Author._meta.get_field('name')
+        new_field = models.CharField(max_length=100, db_index=True)
+        new_field.set_attributes_from_name('name')
+        with connection.schema_editor() as editor:
+            editor.alter_field(Author, old_field, new_field, strict=True)
+        self.assertEqual(
+            [c['columns'] for c in self.get_constraints('pyodbc_backend_author').values() if c['index']],
+            [['name']])
+        with connection.schema_editor() as editor:
+            editor.alter_field(Author, new_field, old_field, strict=True)
+        self.assertEqual(
+            [c for c in self.get_constraints('pyodbc_backend_author').values() if c['index']], [])
+
+
+class ColumnStoreIndexTests(TestCase):
+    def test_introspection(self):
+        with connection.cursor() as cursor:
+            index = connection.introspection.get_constraints(cursor, 'pyodbc_backend_metric')['metric_cs']
+        self.assertEqual(index['type'], 'csi')
+        self.assertEqual(sorted(index['columns']), ['recorded', 'value'])
+        self.assertTrue(index['index'])
+        self.assertFalse(index['clustered'])
+
+    @isolate_apps('pyodbc_backend')
+    def test_clustered(self):
+        class Event(models.Model):
+            name = models.CharField(max_length=20)
+
+            class Meta:
+                indexes = [ColumnStoreIndex(clustered=True)]
+
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Event)
+        self.assertIn('[id] int IDENTITY (1, 1) NOT NULL PRIMARY KEY NONCLUSTERED', editor.collected_sql[0])
+        self.assertTrue(editor.collected_sql[1].startswith('CREATE CLUSTERED COLUMNSTORE INDEX ['))
+        self.assertTrue(editor.collected_sql[1].endswith('_csi] ON [pyodbc_backend_event];'))
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            ColumnStoreIndex(fields=['-recorded'], name='metric_cs')
+        with self.assertRaises(ValueError):
+            ColumnStoreIndex(fields=['recorded'], clustered=True)
+        self.assertEqual(
+            ColumnStoreIndex(clustered=True, name='event_cs').deconstruct(),
+            ('django_pyodbc.indexes.ColumnStoreIndex', (), {'name': 'event_cs', 'clustered': True}))
+
+
+class FlushTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def flush_sql(self):
+        models_ = [Author, Book, Book.authors.through, Chapter]
+        tables = [model._meta.db_table for model in models_]
+        sequences = [{'table': table, 'column': 'id'} for table in tables]
+        return connection.ops.sql_flush(no_style(), tables, sequences)
+
+    def test_sql(self):
+        sql = self.flush_sql()
+        # The foreign keys pointing at flushed tables are switched off first,
+        # one statement per referencing table.
+        nocheck = [statement for statement in sql if 'NOCHECK CONSTRAINT' in statement]
+        self.assertEqual(sql[:2], nocheck)
+        self.assertEqual(
+            [statement.split()[2] for statement in nocheck],
+            ['[pyodbc_backend_book_authors]', '[pyodbc_backend_chapter]'])
+        self.assertIn('DELETE FROM [pyodbc_backend_author];', sql)
+        self.assertIn('DELETE FROM [pyodbc_backend_book];', sql)
+        self.assertIn('TRUNCATE TABLE [pyodbc_backend_chapter];', sql)
+        self.assertIn('TRUNCATE TABLE [pyodbc_backend_book_authors];', sql)
+        self.assertTrue(sql[-1].startswith('ALTER TABLE [pyodbc_backend_chapter] CHECK CONSTRAINT '))
+
+    def test_flush(self):
+        anna = Author.objects.create(name='Anna')
+        book = Book.objects.create(title='Notes')
+        book.authors.add(anna)
+        Chapter.objects.create(book=book, title='One')
+        connection.ops.execute_sql_flush('default', self.flush_sql())
+        self.assertEqual(Author.objects.count(), 0)
+        self.assertEqual(Chapter.objects.count(), 0)
+        # Identity values start over, both for deleted and truncated tables.
+        self.assertEqual(Book.objects.create(title='Notes').pk, 1)
+        self.assertEqual(Author.objects.create(name='Anna').pk, 1)
+
+
+class ScriptedCursor(object):
+    """
+    Answers each statement with the columns and rows given for the first
+    prefix it starts with (or raises the given exception), and records it.
+    """
+    def __init__(self, results=()):
+        self.results = results
+        self.executed = []
+        self.description = None
+        self.rows = []
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        self.description, self.rows = None, []
+        for prefix, columns, rows in self.results:
+            if sql.startswith(prefix):
+                if isinstance(rows, Exception):
+                    raise rows
+                self.description = [(name,) for name in columns]
+                self.rows = list(rows)
+                return
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def nextset(self):
+        return False
+
+
+class TemplateDatabaseTests(SimpleTestCase):
+    def template_backup(self, directory, edition=EDITION_ENTERPRISE):
+        with mock.patch.dict(connection.settings_dict['TEST'], {'TEMPLATE_DIR': directory}), \
+                mock.patch.object(connection.ops, '_ss_edition', edition):
+            return connection.creation._get_template_backup('test_db')
+
+    def test_template_backup_path(self):
+        self.assertEqual(self.template_backup('C:\\Backups\\'), 'C:\\Backups\\test_db_template.bak')
+        self.assertEqual(self.template_backup('/var/opt/mssql/backup'), '/var/opt/mssql/backup/test_db_template.bak')
+        self.assertIsNone(self.template_backup(None))
+        # Azure SQL Database can't back up to disk.
+        self.assertIsNone(self.template_backup('/backup', EDITION_AZURE_SQL_DB))
+
+    def test_migration_hash(self):
+        digest = connection.creation._migration_hash()
+        self.assertEqual(len(digest), 40)
+        self.assertEqual(connection.creation._migration_hash(), digest)
+
+    def test_backup_description(self):
+        cursor = ScriptedCursor([
+            ('RESTORE HEADERONLY', ['BackupName', 'BackupDescription'], [(None, 'old'), (None, 'new')]),
+        ])
+        self.assertEqual(connection.creation._read_backup_description(cursor, "C:\\it's.bak"), 'new')
+        self.assertEqual(cursor.executed, ["RESTORE HEADERONLY FROM DISK = N'C:\\it''s.bak'"])
+        cursor = ScriptedCursor([('RESTORE HEADERONLY', [], DatabaseError('no backup'))])
+        self.assertIsNone(connection.creation._read_backup_description(cursor, 'missing.bak'))
+
+    def restore_template(self, exists, autoclobber, confirm=None):
+        cursor = ScriptedCursor([
+            ('RESTORE HEADERONLY', ['BackupDescription'], [('digest',)]),
+            ('SELECT DB_ID', ['id'], [(5 if exists else None,)]),
+        ])
+        master = mock.MagicMock()
+        master.cursor.return_value.__enter__.return_value = cursor
+        with mock.patch.dict(connection.settings_dict['TEST'], {'TEMPLATE_DIR': '/backup'}), \
+                mock.patch.object(connection.ops, '_ss_edition', EDITION_ENTERPRISE), \
+                mock.patch.object(connection.creation, '_get_master_connection', return_value=master), \
+                mock.patch('django_pyodbc.creation.input', return_value=confirm) as prompt, \
+                mock.patch('sys.stderr'):
+            try:
+                self.assertTrue(connection.creation._restore_template('test_db', 'digest', 0, autoclobber))
+            finally:
+                self.assertTrue(master.close.called)
+        return prompt.called, [sql for sql in cursor.executed if sql.startswith(('RESTORE DATABASE', 'ALTER'))]
+
+    def test_restore_over_existing_database(self):
+        restore = "RESTORE DATABASE [test_db] FROM DISK = N'/backup/test_db_template.bak' WITH REPLACE"
+        # A missing database is restored without asking.
+        self.assertEqual(self.restore_template(False, False), (False, [restore, 'ALTER DATABASE [test_db] SET MULTI_USER']))
+        prompted, executed = self.restore_template(True, True)
+        self.assertFalse(prompted)
+        self.assertEqual(executed[:2], ['ALTER DATABASE [test_db] SET SINGLE_USER WITH ROLLBACK IMMEDIATE', restore])
+        prompted, executed = self.restore_template(True, False, 'yes')
+        self.assertTrue(prompted)
+        self.assertIn(restore, executed)
+        with mock.patch('sys.stdout'), self.assertRaises(SystemExit):
+            self.restore_template(True, False, 'no')
+
+
+class CloneDatabaseTests(SimpleTestCase):
+    def test_restore_clone(self):
+        cursor = ScriptedCursor([
+            ('RESTORE FILELISTONLY', ['LogicalName', 'PhysicalName'], [
+                ('test_db', 'D:\\Data\\test_db.mdf'),
+                ('test_db_log', 'D:\\Data\\test_db_log.ldf'),
+            ]),
+            ('SELECT TOP 1 mf.physical_device_name', ['physical_device_name'], [('B:\\Backup\\test_db_clone.bak',)]),
+        ])
+        with mock.patch.dict(connection.settings_dict['TEST'], {'TEMPLATE_DIR': None}), \
+                mock.patch.object(connection.creation, '_clone_backup', None, create=True):
+            connection.creation._restore_clone(cursor, 'test_db', 'test_db_1')
+            connection.creation._restore_clone(cursor, 'test_db', 'test_db_2')
+            # The full path of the backup is kept, to delete it afterwards.
+            self.assertEqual(connection.creation._clone_backup, 'B:\\Backup\\test_db_clone.bak')
+        # The database is backed up once for all of its clones.
+        self.assertEqual(cursor.executed[0], "BACKUP DATABASE [test_db] TO DISK = N'test_db_clone.bak' WITH INIT, COPY_ONLY")
+        self.assertEqual(len([sql for sql in cursor.executed if sql.startswith('BACKUP')]), 1)
+        self.assertEqual(cursor.executed[3], (
+            "RESTORE DATABASE [test_db_1] FROM DISK = N'B:\\Backup\\test_db_clone.bak' WITH "
+            "MOVE N'test_db' TO N'D:\\Data\\test_db_1_test_db.mdf', "
+            "MOVE N'test_db_log' TO N'D:\\Data\\test_db_1_test_db_log.ldf'"))
+
+    def test_backup_deleted_with_test_database(self):
+        cursor = ScriptedCursor()
+        master = mock.MagicMock()
+        master.cursor.return_value.__enter__.return_value = cursor
+        base_destroy = 'django.db.backends.base.creation.BaseDatabaseCreation.destroy_test_db'
+        with mock.patch.object(connection.creation, '_clone_backup', '/backup/test_db_clone.bak', create=True), \
+                mock.patch.object(connection.creation, '_get_master_connection', return_value=master), \
+                mock.patch(base_destroy) as destroy:
+            # Destroying a clone leaves the backup for the others.
+            connection.creation.destroy_test_db(verbosity=0, suffix='1')
+            self.assertEqual(cursor.executed, [])
+            connection.creation.destroy_test_db('db', verbosity=0, keepdb=True)
+            self.assertEqual(cursor.executed, ["EXEC master.sys.xp_delete_file 0, N'/backup/test_db_clone.bak'"])
+            self.assertIsNone(connection.creation._clone_backup)
+            self.assertEqual(destroy.call_count, 2)
+        self.assertTrue(master.close.called)
+
+    def test_copy_database_waits_until_online(self):
+        states = iter(['COPYING', 'COPYING', 'ONLINE'])
+        cursor = ScriptedCursor()
+        cursor.fetchone = lambda: (next(states),)
+        with mock.patch.object(connection.creation, 'clone_poll_interval', 0):
+            connection.creation._copy_database(cursor, 'test_db', 'test_db_1')
+        self.assertEqual(cursor.executed[0], 'CREATE DATABASE [test_db_1] AS COPY OF [test_db]')
+        self.assertEqual(len(cursor.executed), 4)
+
+    def test_failed_copy(self):
+        cursor = ScriptedCursor([('SELECT state_desc', ['state_desc'], [('SUSPECT',)])])
+        with self.assertRaises(DatabaseError):
+            connection.creation._copy_database(cursor, 'test_db', 'test_db_1')
+
+
+class ConstraintCheckingTests(TransactionTestCase):
+    available_apps = ['pyodbc_backend']
+
+    def test_toggled_in_one_batch(self):
+        # One query finds the constraints and one switches them all off.
+        with self.assertNumQueries(2):
+            connection.disable_constraint_checking(['pyodbc_backend_chapter', 'pyodbc_backend_book_authors'])
+        with self.assertNumQueries(1):
+            connection.enable_constraint_checking()
+
+    def test_check_constraints(self):
+        with connection.constraint_checks_disabled(['pyodbc_backend_chapter']):
+            Chapter.objects.create(book_id=999, title='Orphan')
+        # Constraints on other tables are left alone.
+        connection.check_constraints(['pyodbc_backend_book'])
+        with self.assertRaises(IntegrityError):
+            connection.check_constraints(['pyodbc_backend_chapter'])
+        Chapter.objects.all().delete()
+        connection.check_constraints(['pyodbc_backend_chapter'])